@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+MediaServer asyncio Database module.
+Async versions of the read queries in database.py, for code running in an
+asyncio event loop. They share database.py's SQL and return the same rows,
+but waiting on PostgreSQL suspends the coroutine instead of blocking a
+thread, and independent queries run concurrently on separate connections.
+
+    rows = await aiodatabase.get_allsongs()
+    song, metadata = await aiodatabase.get_song_page(song_id)
+
+The pool belongs to the event loop that first uses it.
+"""
+
+import asyncio
+import sys
+from modules import pg8000
+from modules.pg8000 import aio
+import aiodbpool
+import dbpool
+import database
+from database import read_config, print_sql_string
+from rows import row_class_for
+
+
+#############################
+#                           #
+# Database Helper Functions #
+#                           #
+#############################
+
+_pool = None
+
+
+def get_pool():
+    """
+    Returns the asyncio connection pool, creating it on first use from the
+    [POOL] section of config.ini. Call it from inside the event loop.
+    """
+    global _pool
+    if _pool is None:
+        pool_config = read_config()['POOL']
+        _pool = aiodbpool.AsyncConnectionPool(
+            open_connection,
+            min_size=pool_config.getint('min_size', 1),
+            max_size=pool_config.getint('max_size', 10),
+            checkout_timeout=pool_config.getfloat('checkout_timeout', 10))
+    return _pool
+
+
+def pool_stats():
+    """ Usage counters of the asyncio connection pool."""
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+
+async def open_connection():
+    """
+    Opens a new pg8000.aio connection using the details in config.ini.
+    These connections only run single read queries, so they use autocommit
+    and never hold a transaction open between queries.
+    """
+    config = read_config()
+    conn = await aio.connect(database=config['DATABASE']['database'],
+                             user=config['DATABASE']['user'],
+                             password=config['DATABASE']['password'],
+                             host=config['DATABASE']['host'])
+    conn.max_prepared_statements = \
+        config['POOL'].getint('max_prepared_statements', 100)
+    conn.autocommit = True
+    return conn
+
+
+async def database_connect():
+    """
+    Borrows a connection from the asyncio pool, None if the database could
+    not be reached. Hand it back with get_pool().release(conn).
+    """
+    try:
+        return await get_pool().acquire()
+    except (pg8000.OperationalError, pg8000.InterfaceError, OSError) as operation_error:
+        print("""Error, you haven't updated your config.ini or you have a bad
+        connection, please try again. (Update your files first, then check
+        internet connection)
+        """)
+        print(operation_error)
+        return None
+    except dbpool.PoolTimeout as pool_error:
+        print("Error, every database connection is busy:", pool_error)
+        return None
+
+
+async def dictfetchall(sqltext,params=None):
+    """
+    Async dictfetchall: runs one query on a pooled connection and returns
+    its rows, or None if the database could not be reached.
+    """
+    conn = await database_connect()
+    if(conn is None):
+        return None
+    try:
+        if (params is None):
+            print(sqltext)
+        else:
+            print_sql_string(sqltext,params)
+        cur = await conn.execute(sqltext,params)
+        row = row_class_for(cur)
+        return list(map(row, cur))
+    except:
+        print("Unexpected error running query:", sys.exc_info()[0])
+        raise
+    finally:
+        await get_pool().release(conn)
+
+
+#####################################################
+#   Query (1 a,b,c)
+#   User home page
+#####################################################
+
+async def user_playlists(username):
+    return await dictfetchall(database.USER_PLAYLISTS_SQL,(username,))
+
+async def user_podcast_subscriptions(username):
+    return await dictfetchall(database.USER_PODCAST_SUBSCRIPTIONS_SQL,(username,))
+
+async def user_in_progress_items(username):
+    return await dictfetchall(database.USER_IN_PROGRESS_ITEMS_SQL,(username,))
+
+#####################################################
+#   List pages
+#####################################################
+
+async def get_allartists():
+    return await dictfetchall(database.ARTISTS_SQL)
+
+async def get_allsongs():
+    return await dictfetchall(database.SONGS_SQL)
+
+async def get_allpodcasts():
+    return await dictfetchall(database.PODCASTS_SQL)
+
+async def get_allalbums():
+    return await dictfetchall(database.ALBUMS_SQL)
+
+async def get_alltvshows():
+    return await dictfetchall(database.TVSHOWS_SQL)
+
+#####################################################
+#   Single item pages
+#####################################################
+
+async def get_song(song_id):
+    return await dictfetchall(database.SONG_SQL,(song_id,))
+
+async def get_song_metadata(song_id):
+    return await dictfetchall(database.SONG_METADATA_SQL,(song_id, song_id))
+
+async def get_album(album_id):
+    return await dictfetchall(database.ALBUM_SQL,(album_id,))
+
+async def get_album_songs(album_id):
+    return await dictfetchall(database.ALBUM_SONGS_SQL,(album_id,))
+
+async def get_album_genres(album_id):
+    return await dictfetchall(database.ALBUM_GENRES_SQL,(album_id,))
+
+async def get_tvshow(tvshow_id):
+    return await dictfetchall(database.TVSHOW_SQL,(tvshow_id,))
+
+async def get_all_tvshoweps_for_tvshow(tvshow_id):
+    return await dictfetchall(database.TVSHOW_EPISODES_SQL,(tvshow_id,))
+
+#####################################################
+#   Page queries
+#   Same results as the page queries in database.py,
+#   with each query running concurrently on its own
+#   connection.
+#####################################################
+
+async def get_user_home(username):
+    """
+    Playlists, podcast subscriptions and in progress items of a user.
+    """
+    return tuple(await asyncio.gather(
+        user_playlists(username),
+        user_podcast_subscriptions(username),
+        user_in_progress_items(username)))
+
+async def get_song_page(song_id):
+    """
+    A song and its metadata.
+    """
+    return tuple(await asyncio.gather(
+        get_song(song_id),
+        get_song_metadata(song_id)))
+
+async def get_album_page(album_id):
+    """
+    An album, its songs and its genres.
+    """
+    return tuple(await asyncio.gather(
+        get_album(album_id),
+        get_album_songs(album_id),
+        get_album_genres(album_id)))
+
+async def get_tvshow_page(tvshow_id):
+    """
+    A tv show and its episodes.
+    """
+    return tuple(await asyncio.gather(
+        get_tvshow(tvshow_id),
+        get_all_tvshoweps_for_tvshow(tvshow_id)))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+MediaServer asyncio connection pool.
+The asyncio counterpart of dbpool.ConnectionPool: a bounded set of
+pg8000.aio connections that coroutines borrow and hand back. Waiting for a
+free connection suspends the coroutine instead of blocking a thread.
+"""
+
+import asyncio
+import time
+
+from dbpool import PoolTimeout
+
+
+class _Checkout(object):
+    """ async with pool.connection() as conn: ..."""
+
+    def __init__(self, pool, timeout):
+        self._pool = pool
+        self._timeout = timeout
+        self._conn = None
+
+    async def __aenter__(self):
+        self._conn = await self._pool.acquire(self._timeout)
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self._pool.release(self._conn)
+
+
+class AsyncConnectionPool(object):
+    """
+    Bounded pool of pg8000.aio connections. Create it from inside the
+    event loop that will use it.
+
+        - connect: coroutine function opening a new AsyncConnection
+        - min_size: connections opened by fill() and kept when idle
+        - max_size: hard limit on open connections (idle + in use)
+        - checkout_timeout: seconds acquire() waits for a free connection
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, checkout_timeout=10):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("pool size must satisfy 0 <= min_size <= max_size, max_size >= 1")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+
+        self._cond = asyncio.Condition()
+        self._idle = []
+        self._size = 0              # idle + in use + being opened
+        self._closed = False
+
+        self._stats = {
+            'created': 0,
+            'discarded': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    #####################################################
+    #   Checkout / return
+    #####################################################
+
+    def connection(self, timeout=None):
+        """ Async context manager borrowing a connection for the block."""
+        return _Checkout(self, timeout)
+
+    async def acquire(self, timeout=None):
+        """
+        Borrow a connection. Waits up to `timeout` seconds (default:
+        checkout_timeout) if all max_size connections are in use.
+        """
+        if timeout is None:
+            timeout = self.checkout_timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        async with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(
+                        "no database connection free after %.1fs" % timeout)
+                waited = True
+                try:
+                    await asyncio.wait_for(self._cond.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+        if conn is None:
+            try:
+                conn = await self._connect()
+            except BaseException:
+                async with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            self._stats['created'] += 1
+
+        wait_time = time.monotonic() - started
+        self._stats['checkouts'] += 1
+        if waited:
+            self._stats['waits'] += 1
+            self._stats['wait_time_total'] += wait_time
+            self._stats['wait_time_max'] = max(
+                self._stats['wait_time_max'], wait_time)
+        return conn
+
+    async def release(self, conn, discard=False):
+        """
+        Hand a connection back. Any open transaction is rolled back so the
+        next borrower starts from a clean state.
+        """
+        if not discard and not conn.closed:
+            try:
+                if conn.in_transaction:
+                    await conn.rollback()
+            except Exception:
+                discard = True
+        else:
+            discard = True
+
+        if discard or self._closed:
+            self._stats['discarded'] += 1
+            await conn.close()
+        async with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    #####################################################
+    #   Maintenance
+    #####################################################
+
+    async def fill(self):
+        """ Opens connections until min_size are available."""
+        while self._size < self.min_size:
+            self._size += 1
+            try:
+                conn = await self._connect()
+            except BaseException:
+                self._size -= 1
+                raise
+            self._stats['created'] += 1
+            async with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    async def close(self):
+        """ Closes every idle connection and refuses further checkouts."""
+        async with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            await conn.close()
+
+    def stats(self):
+        """ Snapshot of the pool usage counters."""
+        stats = dict(self._stats)
+        stats['idle'] = len(self._idle)
+        stats['size'] = self._size
+        stats['in_use'] = self._size - len(self._idle)
+        stats['max_size'] = self.max_size
+        stats['wait_time_avg'] = (stats['wait_time_total'] / stats['waits']
+                                  if stats['waits'] else 0.0)
+        return stats
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+MediaServer autocomplete.
+An in-memory prefix index over the titles of every kind of item (and the
+artist names) for as-you-type suggestions without a database round trip.
+Each title is stored once; the index is a sorted list of normalised keys,
+one for every word a title can be typed from ('the star wars', 'star wars',
+'wars'), searched with bisect.
+"""
+
+import bisect
+import re
+import sys
+import threading
+import time
+import unicodedata
+from operator import itemgetter
+
+
+def normalize(text):
+    """
+    Lower case words of text without accents or punctuation, separated by
+    single spaces, eg. 'Amélie (2001)' -> 'amelie 2001'.
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'[^\W_]+', text.casefold()))
+
+
+# Bytes of a tuple of n items (the items not included)
+_TUPLE_BYTES = {2: sys.getsizeof((0, 0)), 3: sys.getsizeof((0, 0, 0))}
+
+
+class TitleIndex(object):
+    """
+    Prefix index of (item_type, item_id, title) items.
+    Lookups never lock: entries are only ever inserted, one at a time, into
+    a list that is otherwise replaced whole by build().
+    """
+
+    def __init__(self):
+        self._items = []                # item number -> (item_type, item_id, title)
+        self._entries = []              # sorted (key, item number, word position)
+        self._ids = set()               # (item_type, item_id) already indexed
+        self._bytes = 0                 # size of what the three hold, see memory_bytes()
+        self._lock = threading.Lock()   # one writer at a time
+        self.built = None               # unix time of the last build
+        self.build_seconds = None
+
+    #####################################################
+    #   Building
+    #####################################################
+
+    def build(self, rows):
+        """ Replaces the index with rows of (item_type, item_id, title)."""
+        started = time.time()
+        items, entries, ids = [], [], set()
+        for item_type, item_id, title in rows:
+            if (item_type, item_id) in ids:
+                continue
+            ids.add((item_type, item_id))
+            entries.extend(self._keys(title, len(items)))
+            items.append((item_type, item_id, title))
+        entries.sort()
+        size = self._size(items, entries)
+        with self._lock:
+            self._items, self._entries, self._ids = items, entries, ids
+            self._bytes = size
+        self.built = time.time()
+        self.build_seconds = self.built - started
+
+    def add(self, item_type, item_id, title):
+        """ Adds one item, eg. a movie that has just been added."""
+        with self._lock:
+            if (item_type, item_id) in self._ids:
+                return
+            self._items.append((item_type, item_id, title))
+            keys = self._keys(title, len(self._items) - 1)
+            for entry in keys:
+                bisect.insort(self._entries, entry)
+            self._ids.add((item_type, item_id))
+            self._bytes += self._size(self._items[-1:], keys)
+
+    @staticmethod
+    def _keys(title, number):
+        words = normalize(title).split(' ')
+        return [(' '.join(words[i:]), number, i)
+                for i in range(len(words)) if words[i]]
+
+    #####################################################
+    #   Lookups
+    #####################################################
+
+    def lookup(self, prefix, limit=10, types=None, scan=200):
+        """
+        Up to `limit` items with a word starting with prefix, as
+        (item_type, item_id, title). Titles starting with prefix come first,
+        then shorter titles. At most `scan` index entries are looked at.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        entries, items = self._entries, self._items
+        found = {}
+        i = bisect.bisect_left(entries, (prefix,))
+        end = min(len(entries), i + scan)
+        while i < end:
+            key, number, position = entries[i]
+            if not key.startswith(prefix):
+                break
+            item = items[number]
+            if types is None or item[0] in types:
+                if number not in found or position < found[number][0]:
+                    found[number] = (position, len(item[2]), item[2], number)
+            i += 1
+        best = sorted(found.values())[:limit]
+        return [items[number] for _, _, _, number in best]
+
+    #####################################################
+    #   Statistics
+    #####################################################
+
+    @staticmethod
+    def _size(items, entries):
+        """ Bytes of the tuples, strings and numbers of items and their entries."""
+        size = len(items) * (_TUPLE_BYTES[3] + _TUPLE_BYTES[2] + sys.getsizeof(len(items)))
+        size += len(entries) * _TUPLE_BYTES[3]
+        size += sum(map(sys.getsizeof, map(itemgetter(1), items)))
+        size += sum(map(sys.getsizeof, map(itemgetter(2), items)))
+        size += sum(map(sys.getsizeof, map(itemgetter(0), entries)))
+        return size
+
+    def memory_bytes(self):
+        """
+        Approximate bytes used by the index (lists, tuples and strings),
+        added up as items are indexed, so asking is cheap.
+        """
+        return sys.getsizeof(self._entries) + sys.getsizeof(self._items) \
+            + sys.getsizeof(self._ids) + self._bytes
+
+    def stats(self):
+        return {
+            'items': len(self._items),
+            'keys': len(self._entries),
+            'memory_bytes': self.memory_bytes(),
+            'built': self.built,
+            'build_seconds': self.build_seconds,
+        }
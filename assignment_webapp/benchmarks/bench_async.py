@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Blocking vs asyncio database access benchmark.
+Runs the same number of page loads through
+    - database.py, one after another
+    - database.py from a thread pool as big as the connection pool
+    - aiodatabase.py, all at once in one event loop
+against the database in config.ini. Run it from the assignment_webapp folder.
+
+    python3 benchmarks/bench_async.py [page loads] [album id]
+"""
+
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contextlib
+import io
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import database
+    import aiodatabase
+
+# A query that waits on the server, like a slow disk or a busy database
+SLOW_SQL = "SELECT pg_sleep(0.01), %s::int AS n"
+
+
+def quietly(fn, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args)
+
+
+def run_sequential(fn, args):
+    return [fn(a) for a in args]
+
+
+def run_threads(fn, args):
+    workers = database.get_pool().max_size
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(fn, args))
+
+
+def run_async(coro_fn, args):
+    async def main():
+        return await asyncio.gather(*[coro_fn(a) for a in args])
+    return asyncio.get_event_loop().run_until_complete(main())
+
+
+def sync_slow(n):
+    conn = database.database_connect()
+    cur = conn.cursor()
+    try:
+        return database.dictfetchall(cur, SLOW_SQL, (n,))
+    finally:
+        cur.close()
+        conn.close()
+
+
+async def async_slow(n):
+    return await aiodatabase.dictfetchall(SLOW_SQL, (n,))
+
+
+def timed(label, fn, *args):
+    started = time.perf_counter()
+    result = quietly(fn, *args)
+    elapsed = time.perf_counter() - started
+    print("  %-12s %8.3fs" % (label, elapsed))
+    return result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    album_id = sys.argv[2] if len(sys.argv) > 2 else '1'
+    ids = [album_id] * n
+
+    # Open and warm both pools so connection setup is not measured
+    quietly(run_threads, database.get_album_page, ids[:20])
+    quietly(run_async, aiodatabase.get_album_page, ids[:20])
+
+    print("%d album pages (3 queries each)" % n)
+    expected = timed('sequential', run_sequential, database.get_album_page, ids)
+    timed('threads', run_threads, database.get_album_page, ids)
+    result = timed('asyncio', run_async, aiodatabase.get_album_page, ids)
+    if [list(map(list, r)) for r in result] != \
+            [list(map(list, r)) for r in expected]:
+        raise AssertionError("async results differ from database.py")
+
+    print("%d queries waiting 10ms on the server" % n)
+    timed('sequential', run_sequential, sync_slow, range(n))
+    timed('threads', run_threads, sync_slow, range(n))
+    timed('asyncio', run_async, async_slow, range(n))
+
+    print("pool stats:", database.pool_stats())
+    print("async pool stats:", aiodatabase.pool_stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Autocomplete index benchmark.
+Builds autocomplete.TitleIndex over made up titles of 1 to 4 words and
+reports the build time, the memory footprint and the lookup latency of
+prefixes of different lengths. No database is needed.
+
+    python3 benchmarks/bench_autocomplete.py [titles]
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import autocomplete
+
+WORDS = ['star', 'wars', 'love', 'night', 'day', 'the', 'of', 'return', 'king',
+         'house', 'dark', 'city', 'blue', 'river', 'last', 'summer', 'ghost',
+         'road', 'heart', 'song', 'dream', 'fire', 'ice', 'storm', 'island']
+TYPES = ['song', 'album', 'artist', 'movie', 'tvshow', 'tvepisode']
+
+
+def make_titles(n):
+    random.seed(1)
+    for i in range(n):
+        words = random.sample(WORDS, random.randint(1, 3))
+        words.append('%x' % random.getrandbits(24))
+        yield random.choice(TYPES), i, ' '.join(words).title()
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    index = autocomplete.TitleIndex()
+    index.build(make_titles(n))
+    stats = index.stats()
+    print("%d titles, %d keys, built in %.2fs, %.1f MB (%.0f bytes per title)"
+          % (stats['items'], stats['keys'], stats['build_seconds'],
+             stats['memory_bytes'] / 2 ** 20, stats['memory_bytes'] / n))
+
+    for prefix in ('s', 'st', 'star', 'star wa', 'ghost r', 'a1b'):
+        times = []
+        for _ in range(1000):
+            started = time.perf_counter()
+            results = index.lookup(prefix)
+            times.append((time.perf_counter() - started) * 1000)
+        print("  %-10r median %.3fms  p99 %.3fms  %d results"
+              % (prefix, statistics.median(times),
+                 sorted(times)[int(len(times) * 0.99)], len(results)))
+
+    started = time.perf_counter()
+    for i in range(1000):
+        index.add('movie', n + i, 'Star Wars %d' % i)
+    print("  add: %.3fms per title" % ((time.perf_counter() - started)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Concurrent requests benchmark.
+Serves the app over HTTP and loads pages from 1, 2, 4 and 8 clients at once
+(each its own visitor with its own cookies, half of them logged in) against
+    - one single threaded server, one request at a time
+    - one threaded server (what main.py runs)
+    - as many single threaded server processes as clients, each client
+      sending every request to the next process in turn
+and prints the requests per second. Every response is checked: a logged in
+client must see its own home page and a logged out one must be sent to the
+login page, on whichever process serves it.
+Run it from the assignment_webapp folder, with a user in the database.
+
+    python3 benchmarks/bench_concurrency.py [seconds] [username] [password]
+"""
+
+import http.cookiejar
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contextlib
+import io
+
+HOST = '127.0.0.1'
+BASE_PORT = 5100
+CLIENTS = (1, 2, 4, 8)
+
+# What a visitor browses between visits to their home page
+PAGES = ['/list/songs', '/song/1', '/movie/101', '/artist/1', '/tvshow/1']
+
+
+def serve(port, threaded):
+    """ Runs the app on port (in a process started by start_servers)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        from werkzeug.serving import make_server
+        import routes
+    make_server(HOST, port, routes.app, threaded=threaded).serve_forever()
+
+
+def start_servers(count, threaded):
+    servers = [subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                 '--serve', str(BASE_PORT + i), str(int(threaded))],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+               for i in range(count)]
+    ports = [BASE_PORT + i for i in range(count)]
+    for port in ports:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen('http://%s:%d/login' % (HOST, port)).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+    return servers, ports
+
+
+def stop_servers(servers):
+    for server in servers:
+        server.terminate()
+        server.wait()
+
+
+class Client(threading.Thread):
+    """ One visitor: logs in (or not), then loads pages until told to stop."""
+
+    def __init__(self, ports, offset, username, password, stop):
+        super().__init__()
+        self.ports, self.offset = ports, offset
+        self.username, self.password = username, password
+        self.stop = stop
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.requests = self.errors = 0
+
+    def url(self, path):
+        port = self.ports[(self.offset + self.requests) % len(self.ports)]
+        return 'http://%s:%d%s' % (HOST, port, path)
+
+    def get(self, path, data=None):
+        response = self.opener.open(self.url(path), data)
+        body = response.read().decode('utf-8')
+        self.requests += 1
+        return response.geturl(), body
+
+    def visit_home(self):
+        final_url, body = self.get('/')
+        if self.username:
+            return not final_url.endswith('/login') and self.username in body
+        return final_url.endswith('/login')
+
+    def run(self):
+        if self.username:
+            self.get('/login', urllib.parse.urlencode(
+                {'username': self.username, 'password': self.password}).encode())
+        while not self.stop.is_set():
+            try:
+                if not self.visit_home():
+                    self.errors += 1
+                for path in PAGES:
+                    self.get(path)
+            except OSError:
+                self.errors += 1
+
+
+def run_clients(ports, count, seconds, username, password):
+    stop = threading.Event()
+    clients = [Client(ports, i, username if i % 2 == 0 else None, password, stop)
+               for i in range(count)]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    time.sleep(seconds)
+    stop.set()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+    return (sum(c.requests for c in clients) / elapsed,
+            sum(c.errors for c in clients))
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    username = sys.argv[2] if len(sys.argv) > 2 else 'alice'
+    password = sys.argv[3] if len(sys.argv) > 3 else 'pw'
+
+    print("%-10s %s" % ('clients', '  '.join('%14s' % n for n in CLIENTS)))
+    for label, processes, threaded in (('single', lambda n: 1, False),
+                                       ('threaded', lambda n: 1, True),
+                                       ('processes', lambda n: n, False)):
+        results = []
+        for count in CLIENTS:
+            servers, ports = start_servers(processes(count), threaded)
+            try:
+                rate, errors = run_clients(ports, count, seconds, username, password)
+            finally:
+                stop_servers(servers)
+            results.append('%7.1f req/s' % rate + ('!' if errors else ' '))
+            if errors:
+                print("%s, %d clients: %d wrong pages" % (label, count, errors))
+        print("%-10s %s" % (label, '  '.join(results)))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--serve']:
+        serve(int(sys.argv[2]), sys.argv[3] == '1')
+    else:
+        main()
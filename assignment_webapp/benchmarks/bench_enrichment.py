@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+OMDb enrichment benchmark.
+Starts a local HTTP stand-in for OMDb (answering after a fixed latency and
+failing a share of requests with HTTP 503) and runs enrichment jobs over
+made up movies with different worker counts and rate limits.
+No database or network access is needed.
+
+    python3 benchmarks/bench_enrichment.py [movies] [latency ms] [failure %]
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import enrichment
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    latency = 0.05
+    failure_rate = 0.0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'       # keep-alive, like OMDb
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if random.random() < self.server.failure_rate:
+            self._reply(503, {'Response': 'False', 'Error': 'busy'})
+            return
+        query = parse_qs(urlparse(self.path).query)
+        title = query.get('t', [''])[0]
+        self._reply(200, {
+            'Title': title,
+            'Year': query.get('y', [''])[0],
+            'imdbRating': '%.1f' % (len(title) % 10),
+            'imdbVotes': '{:,}'.format(len(title) * 1000),
+            'Ratings': [
+                {'Source': 'Internet Movie Database', 'Value': '7.0/10'},
+                {'Source': 'Rotten Tomatoes', 'Value': '%d%%' % (len(title) * 3 % 100)},
+            ],
+            'Response': 'True',
+        })
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_job(base_url, movies, workers, rate):
+    client = enrichment.OmdbClient(base_url, 'bench', timeout=5, retries=5,
+                                   backoff=0.05, pool_size=workers)
+    stored = []
+    job = enrichment.EnrichmentJob(
+        movies, client, stored.extend, workers=workers,
+        limiter=enrichment.TokenBucket(rate), batch_size=50)
+    job.start()
+    while job.running:
+        job.wait(0.5)
+        p = job.progress()
+        sys.stdout.write("\r  workers=%-3d rate=%-5s %4d/%d  %6.1f movies/s"
+                         % (workers, rate or '-', p['fetched'] + p['failed'],
+                            p['total'], p['throughput']))
+        sys.stdout.flush()
+    client.close()
+    p = job.progress()
+    print("\r  workers=%-3d rate=%-5s %4d stored %3d failed %6.2fs %6.1f movies/s"
+          % (workers, rate or '-', len(stored), p['failed'], p['elapsed'],
+             p['throughput']))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+    failure_rate = float(sys.argv[3]) / 100 if len(sys.argv) > 3 else 5 / 100
+
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.latency = latency
+    server.failure_rate = failure_rate
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:%d/' % server.server_address[1]
+
+    movies = [{'movie_id': i, 'movie_title': 'Movie %d' % i,
+               'release_year': 1950 + i % 70} for i in range(n)]
+    print("%d movies, %.0fms per request, %.0f%% of requests fail"
+          % (n, latency * 1000, failure_rate * 100))
+    for workers, rate in ((1, 0), (8, 0), (32, 0), (32, 50)):
+        run_job(base_url, movies, workers, rate)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
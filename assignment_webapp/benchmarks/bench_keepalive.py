@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+HTTP keep-alive benchmark.
+Loads a list page and the scripts and stylesheets it links to, over and
+over, from 1 and 4 clients against a threaded server (as main.py runs),
+    - opening a new connection for every request (Connection: close)
+    - sending every request down one kept alive connection per client
+and prints the requests per second.
+Run it from the assignment_webapp folder.
+
+    python3 benchmarks/bench_keepalive.py [seconds]
+"""
+
+import http.client
+import sys
+import threading
+import time
+
+from bench_concurrency import BASE_PORT, HOST, start_servers, stop_servers
+
+# What a browser fetches for /list/songs with an empty cache
+PAGE_LOAD = ['/list/songs'] + ['/static/' + path for path in (
+    'css/pure.css', 'css/grid.css', 'css/main.css', 'css/datatables.min.css',
+    'scripts/jquery.js', 'scripts/datatables.min.js', 'scripts/keyset_tables.js')]
+
+
+def load_pages(keep_alive, stop, counts):
+    conn = None
+    requests = 0
+    while not stop.is_set():
+        for path in PAGE_LOAD:
+            if conn is None:
+                conn = http.client.HTTPConnection(HOST, BASE_PORT)
+            conn.request('GET', path, headers={} if keep_alive else {'Connection': 'close'})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise AssertionError("%s gave %d" % (path, response.status))
+            if not keep_alive or response.will_close:
+                conn.close()
+                conn = None
+            requests += 1
+    counts.append(requests)
+
+
+def run(keep_alive, clients, seconds):
+    stop = threading.Event()
+    counts = []
+    threads = [threading.Thread(target=load_pages, args=(keep_alive, stop, counts))
+               for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - started)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    servers, _ = start_servers(1, threaded=True)
+    try:
+        for clients in (1, 4):
+            close = run(False, clients, seconds)
+            kept = run(True, clients, seconds)
+            print("%d client(s): new connections %7.1f req/s, keep-alive %7.1f req/s (x%.2f)"
+                  % (clients, close, kept, kept / close))
+    finally:
+        stop_servers(servers)
+
+
+if __name__ == '__main__':
+    main()
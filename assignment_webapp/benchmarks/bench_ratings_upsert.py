@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Movie ratings write benchmark.
+Writes ratings for made up movies the old way (one upsert and one commit per
+movie, what the addMovieRatings loop did) and the batched way
+(database.upsert_movie_ratings, one statement and one commit per batch).
+Uses a scratch copy of MovieRatings without the foreign key, so no movies
+are needed, and drops it afterwards. Run it from the assignment_webapp
+folder so config.ini is found.
+
+    python3 benchmarks/bench_ratings_upsert.py [movies]
+"""
+
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import database
+
+TABLE = 'mediaserver.movieratings_bench'
+
+PER_ROW_SQL = """INSERT INTO %s
+        (movie_id, imdb_score, imdb_votes, rt_score, top100, top250, last_updated)
+    VALUES (%%s::int, %%s::decimal, %%s::int, %%s::decimal, %%s::boolean, %%s::boolean, current_date)
+    ON CONFLICT (movie_id) DO UPDATE
+        SET imdb_score = excluded.imdb_score,
+            imdb_votes = excluded.imdb_votes,
+            rt_score = excluded.rt_score,
+            top100 = excluded.top100,
+            top250 = excluded.top250,
+            last_updated = excluded.last_updated""" % TABLE
+
+
+def make_ratings(n):
+    return [(i, round(random.uniform(1, 10), 1), random.randint(0, 10 ** 6),
+             random.choice([None, float(random.randint(0, 100))]),
+             i % 50 == 0, i % 25 == 0)
+            for i in range(n)]
+
+
+def per_row(conn, ratings):
+    cur = conn.cursor()
+    for rating in ratings:
+        cur.execute(PER_ROW_SQL, rating)
+        conn.commit()
+
+
+def batched(conn, ratings, batch_size):
+    cur = conn.cursor()
+    for start in range(0, len(ratings), batch_size):
+        database.upsert_movie_ratings(cur, ratings[start:start + batch_size])
+        conn.commit()
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    ratings = make_ratings(n)
+    database.MOVIE_RATINGS_UPSERT_SQL = database.MOVIE_RATINGS_UPSERT_SQL.replace(
+        'mediaserver.MovieRatings', TABLE)
+
+    conn = database.open_connection()
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS " + TABLE)
+    cur.execute("CREATE TABLE %s (LIKE mediaserver.MovieRatings INCLUDING ALL)" % TABLE)
+    conn.commit()
+    try:
+        print("%d movies" % n)
+        runs = [('per row', lambda: per_row(conn, ratings))]
+        for batch_size in (100, 1000, n):
+            runs.append(('batch %d' % batch_size,
+                         lambda b=batch_size: batched(conn, ratings, b)))
+        for label, run in runs:
+            for state in ('insert', 'update'):
+                if state == 'insert':
+                    cur.execute("TRUNCATE " + TABLE)
+                    conn.commit()
+                started = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - started
+                print("  %-12s %-6s %8.3fs %9.0f rows/s"
+                      % (label, state, elapsed, n / elapsed))
+        cur.execute("SELECT count(*), count(last_updated) FROM " + TABLE)
+        print("rows, rows with last_updated:", cur.fetchone())
+    finally:
+        cur.execute("DROP TABLE IF EXISTS " + TABLE)
+        conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+DataRow decoding benchmark.
+Captures the raw DataRow messages of a few queries and decodes them with
+both the generic per column loop (pg8000.core.decode_data_row) and the
+generated per statement decoder, checking they give the same rows.
+Uses the database in config.ini, run it from the assignment_webapp folder.
+
+    python3 benchmarks/bench_row_decoder.py [number of rows]
+"""
+
+import configparser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import pg8000
+from modules.pg8000.core import DATA_ROW, decode_data_row
+
+QUERIES = [
+    ('int4, int8, float8, bool',
+     """SELECT g, g::int8 * 1000, g / 7.0::float8, g %% 2 = 0
+        FROM generate_series(1, %s) g"""),
+    ('int4 with NULLs',
+     """SELECT g, CASE WHEN g %% 10 = 0 THEN NULL ELSE g END
+        FROM generate_series(1, %s) g"""),
+    ('int4, text, varchar, float8',
+     """SELECT g, 'Movie title ' || g, ('Artist ' || g %% 50)::varchar,
+               g / 3.0::float8
+        FROM generate_series(1, %s) g"""),
+    ('int4, numeric, date',
+     """SELECT g, (g / 3.0)::numeric(8,2), date '2000-01-01' + g %% 5000
+        FROM generate_series(1, %s) g"""),
+]
+
+
+def connect():
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    db = config['DATABASE']
+    return pg8000.connect(database=db.get('database', db['user']),
+                          user=db['user'], password=db['password'],
+                          host=db['host'])
+
+
+def capture(conn, sql, n):
+    """ Runs the query and returns its statement and raw DataRow messages."""
+    messages = []
+    decode = conn.message_types[DATA_ROW]
+
+    def keep(data, cursor):
+        messages.append(data)
+        decode(data, cursor)
+
+    conn.message_types[DATA_ROW] = keep
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, (n,))
+        cur.fetchall()
+    finally:
+        conn.message_types[DATA_ROW] = decode
+    return cur.ps, messages
+
+
+def best_of(runs, fn):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    conn = connect()
+    encoding = conn._client_encoding
+    print("%d rows per query, best of 5" % n)
+    print("%-30s %10s %10s %8s" % ('columns', 'loop', 'decoder', 'speedup'))
+    try:
+        for name, sql in QUERIES:
+            ps, messages = capture(conn, sql, n)
+            funcs, decoder = ps['input_funcs'], ps['row_decoder']
+            for data in messages:
+                if decoder(data, encoding) != decode_data_row(data, funcs):
+                    raise AssertionError("decoders disagree on " + name)
+            loop = best_of(5, lambda: [decode_data_row(d, funcs)
+                                       for d in messages])
+            generated = best_of(5, lambda: [decoder(d, encoding)
+                                            for d in messages])
+            print("%-30s %9.3fs %9.3fs %7.2fx" % (
+                name, loop, generated, loop / generated))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Row object benchmark.
+Compares the memory and build time of per-row dicts (what dictfetchall used
+to return) against the tuple based Row objects from rows.py.
+No database is needed, rows are made up in memory.
+
+    python3 benchmarks/bench_rows.py [number of rows]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rows import row_class
+
+COLS = ('movie_id', 'movie_title', 'release_year', 'imdb_rating', 'num_votes')
+
+
+def make_values(n):
+    return [(i, 'Movie %d' % i, 1950 + i % 70, (i % 100) / 10.0, i * 7)
+            for i in range(n)]
+
+
+def as_dicts(values):
+    return [{a: b for a, b in zip(COLS, row)} for row in values]
+
+
+def as_rows(values):
+    row = row_class(COLS)
+    return list(map(row, values))
+
+
+def measure(build, values):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build(values)
+    elapsed = time.perf_counter() - started
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # touch every row by name so lookups are part of the comparison
+    started = time.perf_counter()
+    for r in result:
+        r['movie_title']
+    lookup = time.perf_counter() - started
+    return size, peak, elapsed, lookup
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    values = make_values(n)
+    print("%d rows of %d columns" % (n, len(COLS)))
+    print("%-6s %12s %12s %10s %10s" % ('', 'retained', 'peak', 'build', 'lookup'))
+    for name, build in (('dict', as_dicts), ('Row', as_rows)):
+        size, peak, elapsed, lookup = measure(build, values)
+        print("%-6s %10.1fMB %10.1fMB %9.3fs %9.3fs" % (
+            name, size / 1e6, peak / 1e6, elapsed, lookup))
+
+
+if __name__ == '__main__':
+    main()
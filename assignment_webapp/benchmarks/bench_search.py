@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Movie title search benchmark.
+Times database.find_matchingmovies (word and literal search) and the old
+unanchored regex query as the number of titles grows, on a scratch copy of
+the Movie table (with its indexes, without the foreign keys) that is
+dropped afterwards. Run migrations/0001_search_indexes.sql first, and run
+it from the assignment_webapp folder so config.ini is found.
+
+    python3 benchmarks/bench_search.py [largest size]
+
+Every title is 'Movie <8 hex digits> <genre word>', so a hex word matches a
+title or two at any size while a genre word matches a twentieth of them.
+"""
+
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import database
+
+TABLE = 'mediaserver.movie_search_bench'
+REPEAT = 20
+
+REGEX_SQL = """SELECT * FROM %s
+    WHERE LOWER(movie_title) ~ LOWER(%%s)
+    ORDER BY movie_id""" % TABLE
+
+FILL_SQL = """INSERT INTO %s (movie_id, movie_title, release_year)
+    SELECT i,
+           'Movie ' || substr(md5(i::text), 1, 8) || ' ' ||
+           (ARRAY['action', 'drama', 'comedy', 'horror', 'western', 'musical',
+                  'thriller', 'romance', 'mystery', 'fantasy', 'crime', 'war',
+                  'history', 'family', 'sport', 'music', 'animation',
+                  'documentary', 'adventure', 'biography'])[mod(i, 20) + 1],
+           1900 + mod(i, 120)
+    FROM generate_series(%%s::int, %%s::int) AS i""" % TABLE
+
+
+def timed(function, *args):
+    """ Median milliseconds of REPEAT calls, and the rows of the last one."""
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            rows = function(*args)
+            times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), len(rows)
+
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    sizes = [n for n in (1000, 10000, 100000, 1000000) if n <= largest]
+    for name in ('MOVIE_SEARCH_SQL', 'MOVIE_SEARCH_LITERAL_SQL'):
+        setattr(database, name, getattr(database, name).replace(
+            'mediaserver.movie m', TABLE + ' m'))
+
+    conn = database.open_connection()
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS " + TABLE)
+    cur.execute("CREATE TABLE %s (LIKE mediaserver.Movie INCLUDING ALL)" % TABLE)
+    cur.execute("SELECT indexdef FROM pg_indexes WHERE tablename = 'movie_search_bench'")
+    indexes = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    print("indexes:")
+    for index in indexes:
+        print("  " + index)
+    try:
+        filled = 0
+        for n in sizes:
+            cur.execute(FILL_SQL, (filled + 1, n))
+            cur.execute("ANALYZE " + TABLE)
+            conn.commit()
+            filled = n
+            cur.execute("SELECT movie_title FROM %s WHERE movie_id = %%s" % TABLE, (n // 2,))
+            rare = cur.fetchone()[0].split()[1]
+
+            print("%d titles" % n)
+            runs = [
+                ('words, rare', database.find_matchingmovies, (rare[:6],)),
+                ('words, common', database.find_matchingmovies, ('western',)),
+                ('literal, rare', database.find_matchingmovies, (rare[1:7], True)),
+                ('literal, common', database.find_matchingmovies, ('ster', True)),
+                ('old regex, rare',
+                 lambda term: database.dictfetchall(cur, REGEX_SQL, (term,)),
+                 (rare[1:7],)),
+            ]
+            for label, function, args in runs:
+                ms, count = timed(function, *args)
+                print("  %-16s %9.2fms %6d rows" % (label, ms, count))
+    finally:
+        cur.execute("DROP TABLE IF EXISTS " + TABLE)
+        conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+server.py load test.
+Starts server.py with 1, 2, 4 ... workers, up to the number of CPU cores,
+loads pages from 4 clients per worker (see bench_concurrency.py) and prints
+the requests per second and the speed up over one worker. It then runs once
+more sending the server SIGHUP halfway, which should cost no requests.
+Run it from the assignment_webapp folder, with a user in the database.
+
+    python3 benchmarks/bench_server.py [seconds] [username] [password]
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from bench_concurrency import HOST, run_clients
+
+PORT = 5200
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server.py')
+
+
+def start_server(workers):
+    server = subprocess.Popen([sys.executable, SERVER, '--host', HOST, '--port', str(PORT),
+                               '--workers', str(workers), '--max-requests', '0'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen('http://%s:%d/login' % (HOST, PORT)).read()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return server
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    server.wait()
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    username = sys.argv[2] if len(sys.argv) > 2 else 'alice'
+    password = sys.argv[3] if len(sys.argv) > 3 else 'pw'
+    cores = os.cpu_count() or 1
+
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+
+    print("%d CPU cores" % cores)
+    first = None
+    for workers in counts:
+        server = start_server(workers)
+        try:
+            rate, errors = run_clients([PORT], 4 * workers, seconds, username, password)
+        finally:
+            stop_server(server)
+        first = first or rate
+        print("%3d workers %8.1f req/s  x%.2f%s" % (workers, rate, rate / first,
+                                                   "  %d wrong pages" % errors if errors else ""))
+
+    server = start_server(counts[-1])
+    try:
+        threading.Timer(seconds / 2, server.send_signal, (signal.SIGHUP,)).start()
+        rate, errors = run_clients([PORT], 4 * counts[-1], seconds, username, password)
+    finally:
+        stop_server(server)
+    print("reload    %8.1f req/s  %d failed or wrong pages" % (rate, errors))
+
+
+if __name__ == '__main__':
+    main()
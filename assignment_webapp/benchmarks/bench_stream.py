@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Media streaming benchmark.
+Downloads a media item from /stream/<media_id> through the bundled werkzeug
+server, whole and as random 1MB ranges (a player seeking), with the server
+    - sending the file with sendfile
+    - reading it into Python a buffer at a time ([MEDIA] buffer_size)
+and prints the throughput and how much the process' peak memory grew. The
+media item's file has to exist under the [MEDIA] root; a few hundred MB
+makes for steady numbers.
+Run it from the assignment_webapp folder, with a user in the database.
+
+    python3 benchmarks/bench_stream.py [media id] [username] [password] [seconds]
+"""
+
+import http.client
+import logging
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contextlib
+import io
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import database
+    import routes
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+HOST = '127.0.0.1'
+PORT = 5400
+RANGE = 1024 * 1024
+
+
+class BufferedHandler(WSGIRequestHandler):
+    """ Never uses sendfile."""
+
+    def sendfile_args(self, iterable):
+        return None
+
+
+def serve(port, handler):
+    server = make_server(HOST, port, routes.app, threaded=True, request_handler=handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+
+def log_in(port, username, password):
+    conn = http.client.HTTPConnection(HOST, port)
+    conn.request('POST', '/login',
+                 urllib.parse.urlencode({'username': username, 'password': password}),
+                 {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    return conn, {'Cookie': response.getheader('Set-Cookie').split(';')[0]}
+
+
+def fetch(conn, path, headers):
+    conn.request('GET', path, headers=headers)
+    response = conn.getresponse()
+    received = 0
+    while True:
+        chunk = response.read(RANGE)
+        if not chunk:
+            break
+        received += len(chunk)
+    if response.status not in (200, 206):
+        raise AssertionError("%s gave %d" % (path, response.status))
+    return received
+
+
+def run(port, media_id, size, username, password, seconds, ranges):
+    conn, headers = log_in(port, username, password)
+    path = '/stream/%s' % media_id
+    received = requests = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        if ranges:
+            start = random.randrange(max(1, size - RANGE))
+            headers['Range'] = 'bytes=%d-%d' % (start, start + RANGE - 1)
+        received += fetch(conn, path, headers)
+        requests += 1
+    return received / (time.perf_counter() - started), requests
+
+
+def main():
+    media_id = sys.argv[1] if len(sys.argv) > 1 else '1'
+    username = sys.argv[2] if len(sys.argv) > 2 else 'alice'
+    password = sys.argv[3] if len(sys.argv) > 3 else 'pw'
+    seconds = float(sys.argv[4]) if len(sys.argv) > 4 else 5
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        path = database.get_media_path(media_id)
+    if not path or not os.path.isfile(path):
+        sys.exit("media item %s has no file under the [MEDIA] root" % media_id)
+    size = os.path.getsize(path)
+    print("media item %s: %s, %.1f MB" % (media_id, path, size / 1e6))
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # no request log
+    serve(PORT, WSGIRequestHandler)
+    serve(PORT + 1, BufferedHandler)
+    for label, port in (('sendfile', PORT), ('buffered', PORT + 1)):
+        for ranges in (False, True):
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            with contextlib.redirect_stdout(io.StringIO()):
+                rate, requests = run(port, media_id, size, username, password, seconds, ranges)
+            grown = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+            print("  %-9s %-12s %8.1f MB/s %6d requests, peak memory +%d KB"
+                  % (label, '1MB ranges' if ranges else 'whole file', rate / 1e6, requests, grown))
+
+
+if __name__ == '__main__':
+    main()
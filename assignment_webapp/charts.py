@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+MediaServer IMDb charts.
+The IMDb Top 250 and MovieMeter (top 100) charts used by the movie ratings
+pages. The charts are read from a JSON snapshot on disk, so importing this
+module never touches the network, and a background thread refreshes the
+snapshot from imdb.com every refresh_interval seconds. Processes that do
+not refresh it themselves can follow() the snapshot another one writes.
+
+The chart sources in config.ini may also be local HTML files (a path or a
+file:// URL), eg. saved chart pages to use as fixtures.
+"""
+
+import configparser
+import json
+import os
+import tempfile
+import threading
+import time
+
+# chart name -> (config key of its source, default source, entries kept)
+CHARTS = {
+    'top250': ('top250_url', "https://www.imdb.com/chart/top/?ref_=nv_mv_250", 250),
+    'top100': ('top100_url', "https://www.imdb.com/chart/moviemeter/?ref_=nv_mv_mpm", 100),
+}
+
+
+def parse_chart(html, limit):
+    """
+    Returns {title: rank} for the first `limit` titles of an IMDb chart
+    page (ranks start at 0). Titles are the text of the links carrying a
+    title attribute, as on the chart pages.
+    """
+    from bs4 import BeautifulSoup as soup
+    page = soup(html, features = "html.parser")
+    ranks = {}
+    for i, link in enumerate(page.find_all("a", title = True)[:limit]):
+        ranks[link.get_text()] = i
+    return ranks
+
+
+def read_source(source, timeout=10):
+    """ The raw page at `source`: an http(s) URL, a file:// URL or a path."""
+    if source.startswith('http://') or source.startswith('https://'):
+        import requests
+        response = requests.get(source, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+    if source.startswith('file://'):
+        source = source[len('file://'):]
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+class ChartStore(object):
+    """
+    The current charts plus the snapshot they were loaded from.
+    Readers always see one complete set of charts: a refresh builds new
+    dictionaries and swaps them in with a single assignment.
+    """
+
+    def __init__(self, snapshot_path, sources=None, refresh_interval=86400,
+                 timeout=10):
+        self.snapshot_path = snapshot_path
+        self.sources = dict(sources or {})
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self._charts = {name: {} for name in CHARTS}
+        self._fetched = None            # unix time of the loaded charts
+        self._thread = None
+        self._stop = threading.Event()
+        self._follow = 0                # seconds between snapshot checks
+        self._checked = 0
+        self._mtime = None              # of the snapshot last loaded
+
+    #####################################################
+    #   Lookups
+    #####################################################
+
+    def rank(self, chart, title):
+        """ 0 based rank of title in chart, None if it is not in it."""
+        if self._follow:
+            self._reload()
+        return self._charts[chart].get(title)
+
+    def contains(self, chart, title):
+        return self.rank(chart, title) is not None
+
+    def age(self):
+        """ Seconds since the charts were fetched, None if never."""
+        if self._fetched is None:
+            return None
+        return time.time() - self._fetched
+
+    #####################################################
+    #   Snapshot
+    #####################################################
+
+    def load(self):
+        """
+        Loads the snapshot. A missing or unreadable snapshot leaves the
+        charts empty until the first refresh. Returns True if loaded.
+        """
+        self._mtime = self._snapshot_mtime()
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            charts = {name: dict(snapshot['charts'][name]) for name in CHARTS}
+            fetched = float(snapshot['fetched'])
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            print("IMDb chart snapshot not loaded:", e)
+            return False
+        self._charts, self._fetched = charts, fetched
+        return True
+
+    def refresh(self):
+        """
+        Downloads and parses every chart, then swaps them in and writes the
+        snapshot. If any chart fails the current charts are kept.
+        """
+        charts = {}
+        for name, (key, default, limit) in CHARTS.items():
+            source = self.sources.get(key, default)
+            charts[name] = parse_chart(read_source(source, self.timeout), limit)
+            if not charts[name]:
+                raise ValueError("no titles found in the %s chart at %s" % (name, source))
+        fetched = time.time()
+        self._charts, self._fetched = charts, fetched
+        self._save(charts, fetched)
+
+    def follow(self, interval=60):
+        """
+        Makes lookups load the snapshot again once another process has
+        replaced it, looking at most every `interval` seconds.
+        """
+        self._checked = time.time()
+        self._follow = interval
+
+    def _reload(self):
+        now = time.time()
+        if now - self._checked < self._follow:
+            return
+        self._checked = now
+        if self._snapshot_mtime() != self._mtime:
+            self.load()
+
+    def _snapshot_mtime(self):
+        try:
+            return os.stat(self.snapshot_path).st_mtime
+        except OSError:
+            return None
+
+    def _save(self, charts, fetched):
+        # Written to a temporary file and renamed over the snapshot, so a
+        # crash mid-write never leaves a truncated snapshot behind.
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'fetched': fetched, 'charts': charts}, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    #####################################################
+    #   Background refresh
+    #####################################################
+
+    def start(self):
+        """
+        Starts the daemon thread refreshing the charts. The first refresh
+        happens straight away if the snapshot is missing or out of date.
+        Does nothing if refresh_interval is 0 or the thread is running.
+        """
+        if self.refresh_interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='imdb-charts')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        """ Refreshes the charts every refresh_interval seconds until stop()."""
+        while True:
+            age = self.age()
+            if age is None:
+                wait = 0
+            else:
+                wait = max(0, self.refresh_interval - age)
+            if self._stop.wait(wait):
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the old charts and try again later
+                print("IMDb chart refresh failed:", e)
+                if self._stop.wait(min(self.refresh_interval, 600)):
+                    return
+
+
+def from_config(path='config.ini'):
+    """ A ChartStore set up from the [CHARTS] section of config.ini."""
+    config = configparser.ConfigParser()
+    config.read(path)
+    if 'CHARTS' not in config:
+        config['CHARTS'] = {}
+    section = config['CHARTS']
+    return ChartStore(
+        section.get('snapshot', 'imdb_charts.json'),
+        sources={key: section[key] for key, _, _ in CHARTS.values() if key in section},
+        refresh_interval=section.getfloat('refresh_interval', 86400),
+        timeout=section.getfloat('timeout', 10))
@@ -4,14 +4,23 @@ MediaServer Database module.
 Contains all interactions between the webapp and the queries to the database.
 """
 
+import base64
 import configparser
 import json
+import os
+import re
 import sys
+import threading
+import time
 from modules import pg8000
-import requests
-from bs4 import BeautifulSoup as soup
-import datetime
-from datetime import date
+import dbpool
+from rows import row_class_for
+import autocomplete
+import charts
+import enrichment
+import entitycache
+import pagecache
+from decimal import Decimal
 
 ################################################################################
 #   Welcome to the database file, where all the query magic happens.
@@ -38,68 +47,106 @@ from datetime import date
 
 # Global vars for new feature
 
-imdb250 = requests.get("https://www.imdb.com/chart/top/?ref_=nv_mv_250")
-imdb250_src = imdb250.content
-imdb250_soup = soup(imdb250_src, features = "html.parser")
+# IMDb Top 250 / MovieMeter charts, loaded from the local snapshot (see
+# charts.py). main.py starts the background refresh from imdb.com.
+imdb_charts = charts.from_config()
+imdb_charts.load()
 
-top250_titles = imdb250_soup.find_all("a", title = True)
+# Rendered catalogue pages (see pagecache.py). The functions writing to the
+# catalogue bump the generations of the parts they change.
+page_cache = pagecache.from_config()
 
-top250_dict = {} # key:value = title:rank in top 250
 
-for i in range(0, 250):
-    top250_dict[top250_titles[i].get_text()] = i
 
 
-imdb100 = requests.get("https://www.imdb.com/chart/moviemeter/?ref_=nv_mv_mpm")
-imdb100_src = imdb100.content
-imdb100_soup = soup(imdb100_src, features = "html.parser")
 
-top100_titles = imdb100_soup.find_all("a", title = True)
+#####################################################
+#   Database Connect
+#   (No need to touch
+#       (unless the exception is potatoing))
+#####################################################
 
-top100_dict = {} # key:value = title:rank in top 100
+def read_config():
+    """
+    Reads config.ini. Missing sections are created empty so callers can use
+    .get()/.getint() fallbacks without checking first.
+    """
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    for section in ('DATABASE', 'POOL', 'OMDB', 'CACHE', 'MEDIA', 'SESSION'):
+        if section not in config:
+            config[section] = {}
+    if 'database' not in config['DATABASE']:
+        config['DATABASE']['database'] = config['DATABASE']['user']
+    return config
 
-for i in range(0, 100):
-    top100_dict[top100_titles[i].get_text()] = i
 
-recently_scanned = {}
+def open_connection():
+    """
+    Opens a brand new connection using the details in config.ini.
+    Raises pg8000 errors, use database_connect() for pooled connections.
+    """
+    config = read_config()
+    # Parses the config file and connects using the connect string
+    return pg8000.connect(database=config['DATABASE']['database'],
+                          user=config['DATABASE']['user'],
+                          password=config['DATABASE']['password'],
+                          host=config['DATABASE']['host'])
 
 
+_pool = None
+_pool_lock = threading.Lock()
 
+def get_pool():
+    """
+    Returns the process wide connection pool, creating it from the [POOL]
+    section of config.ini on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config = read_config()['POOL']
+            _pool = dbpool.ConnectionPool(
+                open_connection,
+                min_size=config.getint('min_size', 1),
+                max_size=config.getint('max_size', 10),
+                idle_timeout=config.getfloat('idle_timeout', 300),
+                checkout_timeout=config.getfloat('checkout_timeout', 10),
+                health_check_interval=config.getfloat('health_check_interval', 30),
+                registry=dbpool.StatementRegistry(
+                    config.getint('max_prepared_statements', 100)))
+        return _pool
 
 
-#####################################################
-#   Database Connect
-#   (No need to touch
-#       (unless the exception is potatoing))
-#####################################################
+def pool_stats():
+    """
+    Connection pool usage (in use, idle, wait times, Parse vs Bind counts)
+    as a dict.
+    """
+    return get_pool().stats()
+
 
 def database_connect():
     """
-    Connects to the database using the connection string.
+    Borrows a connection from the connection pool.
     If 'None' was returned it means there was an issue connecting to
     the database. It would be wise to handle this ;)
+    Calling close() on the returned connection hands it back to the pool.
     """
-    # Read the config file
-    config = configparser.ConfigParser()
-    config.read('config.ini')
-    if 'database' not in config['DATABASE']:
-        config['DATABASE']['database'] = config['DATABASE']['user']
-
     # Create a connection to the database
     connection = None
     try:
-        # Parses the config file and connects using the connect string
-        connection = pg8000.connect(database=config['DATABASE']['database'],
-                                    user=config['DATABASE']['user'],
-                                    password=config['DATABASE']['password'],
-                                    host=config['DATABASE']['host'])
-    except pg8000.OperationalError as operation_error:
+        connection = get_pool().getconn()
+    except (pg8000.OperationalError, pg8000.InterfaceError) as operation_error:
         print("""Error, you haven't updated your config.ini or you have a bad
         connection, please try again. (Update your files first, then check
         internet connection)
         """)
         print(operation_error)
         return None
+    except dbpool.PoolTimeout as pool_error:
+        print("Error, every database connection is busy:", pool_error)
+        return None
 
     # return the connection to use
     return connection
@@ -119,6 +166,57 @@ def print_sql_string(inputstring, params=None):
     
     print(inputstring % params)
 
+##################################################
+# Python list as a SQL array parameter           #
+##################################################
+
+def pg_array(values):
+    """
+    A list as a PostgreSQL array literal, eg. [1, None, 3] -> '{1,NULL,3}'.
+    Cast it in the SQL (%s::int[]). It is sent as text, so the prepared
+    statement is reused whatever the element types are.
+    """
+    items = []
+    for value in values:
+        if value is None:
+            items.append('NULL')
+        elif isinstance(value, bool):
+            items.append('t' if value else 'f')
+        elif isinstance(value, (int, float, Decimal)):
+            items.append(str(value))
+        else:
+            items.append('"%s"' % str(value).replace('\\', '\\\\').replace('"', '\\"'))
+    return '{' + ','.join(items) + '}'
+
+##################################################
+# Search terms as query parameters               #
+##################################################
+
+SEARCH_LIMIT = 50           # results per search page
+SEARCH_MAX_LIMIT = 500
+
+def prefix_tsquery(searchterm):
+    """
+    A to_tsquery() string matching titles having every word of searchterm
+    as a word prefix, eg. 'Star Wa' -> 'star:* & wa:*'. Only word characters
+    are kept, so user input can never be a tsquery syntax error.
+    None if searchterm has no words.
+    """
+    words = re.findall(r'[^\W_]+', searchterm.lower())
+    if not words:
+        return None
+    return ' & '.join(word + ':*' for word in words)
+
+def like_pattern(searchterm):
+    """ A LIKE pattern matching searchterm anywhere, taken literally."""
+    escaped = searchterm.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + escaped + '%'
+
+def search_page(limit, offset):
+    """ (limit, offset) clamped to sane values."""
+    limit = SEARCH_LIMIT if limit is None else max(1, min(int(limit), SEARCH_MAX_LIMIT))
+    return limit, max(0, int(offset or 0))
+
 #####################################################
 #   SQL Dictionary Fetch
 #   useful for pulling particular items as a dict
@@ -129,10 +227,12 @@ def print_sql_string(inputstring, params=None):
 #       multiplerow: [{col1name:col1value,col2name:col2value, etc.}, 
 #           {col1name:col1value,col2name:col2value, etc.}, 
 #           etc.]
+#   Rows are Row objects (see rows.py) rather than real dicts: read them
+#   with row['col'] or row.col, use row._asdict() if a dict is needed.
 #####################################################
 
 def dictfetchall(cursor,sqltext,params=None):
-    """ Returns query results as list of dictionaries."""
+    """ Returns query results as list of rows (readable like dictionaries)."""
     
     result = []
     if (params is None):
@@ -142,24 +242,49 @@ def dictfetchall(cursor,sqltext,params=None):
         print_sql_string(sqltext,params)
     
     cursor.execute(sqltext,params)
-    cols = [a[0].decode("utf-8") for a in cursor.description]
-    print(cols)
-    returnres = cursor.fetchall()
-    for row in returnres:
-        result.append({a:b for a,b in zip(cols, row)})
+    row = row_class_for(cursor)
+    print(row._fields)
+    result.extend(map(row, cursor))
     # cursor.close()
     return result
 
 def dictfetchone(cursor,sqltext,params=None):
-    """ Returns query results as list of dictionaries."""
+    """ Returns the first query result as a list holding one row."""
     # cursor = conn.cursor()
     result = []
     cursor.execute(sqltext,params)
-    cols = [a[0].decode("utf-8") for a in cursor.description]
+    row = row_class_for(cursor)
     returnres = cursor.fetchone()
-    result.append({a:b for a,b in zip(cols, returnres)})
+    result.append(row(returnres))
     return result
 
+def pipeline_query(*queries):
+    """
+    Runs several independent (sqltext, params) queries on one connection in
+    a single round trip and returns a list of rows per query, in order.
+    Returns None if the database could not be reached.
+    """
+    conn = database_connect()
+    if(conn is None):
+        return None
+    try:
+        for sqltext, params in queries:
+            if (params is None):
+                print(sqltext)
+            else:
+                print_sql_string(sqltext,params)
+        results = []
+        for cur in conn.pipeline(queries):
+            row = row_class_for(cur)
+            results.append(list(map(row, cur)))
+            cur.close()
+        return results
+    except:
+        print("Unexpected error running pipelined queries:", sys.exc_info()[0])
+        raise
+    finally:
+        conn.close()                    # Close the connection to the db
+
 
 
 #####################################################
@@ -246,6 +371,13 @@ def is_superuser(username):
 #   Query (1 a)
 #   Get user playlists
 #####################################################
+USER_PLAYLISTS_SQL = """SELECT distinct(collection_id), collection_name, COUNT(collection_id)
+                FROM mediaserver.mediacollection JOIN mediaserver.mediacollectioncontents USING(collection_id) 
+                WHERE username = %s
+                GROUP BY collection_id
+                ORDER BY collection_id
+        """
+
 def user_playlists(username):
     """
     Check if user has any playlists
@@ -263,12 +395,7 @@ def user_playlists(username):
         # Fill in the SQL below and make sure you get all the playlists for this user #
         ###############################################################################
 
-        sql = """SELECT distinct(collection_id), collection_name, COUNT(collection_id)
-                FROM mediaserver.mediacollection JOIN mediaserver.mediacollectioncontents USING(collection_id) 
-                WHERE username = %s
-                GROUP BY collection_id
-                ORDER BY collection_id
-        """
+        sql = USER_PLAYLISTS_SQL
 
         print("username is: "+username)
         r = dictfetchall(cur,sql,(username,))
@@ -289,6 +416,13 @@ def user_playlists(username):
 #   Query (1 b)
 #   Get user podcasts
 #####################################################
+USER_PODCAST_SUBSCRIPTIONS_SQL = """
+                SELECT *
+                FROM mediaserver.subscribed_podcasts JOIN mediaserver.podcast USING(podcast_id)
+               WHERE username = %s
+               ORDER BY podcast_id
+        """
+
 def user_podcast_subscriptions(username):
     """
     Get user podcast subscriptions.
@@ -304,12 +438,7 @@ def user_podcast_subscriptions(username):
         # Fill in the SQL below and get all the podcasts that the user is subscribed to #
         #################################################################################
 
-        sql = """
-                SELECT *
-                FROM mediaserver.subscribed_podcasts JOIN mediaserver.podcast USING(podcast_id)
-               WHERE username = %s
-               ORDER BY podcast_id
-        """
+        sql = USER_PODCAST_SUBSCRIPTIONS_SQL
 
         r = dictfetchall(cur,sql,(username,))
         print("return val is:")
@@ -328,6 +457,14 @@ def user_podcast_subscriptions(username):
 #   Query (1 c)
 #   Get user in progress items
 #####################################################
+USER_IN_PROGRESS_ITEMS_SQL = """SELECT U.media_id, U.play_count as playcount, U.progress, U.lastviewed, M.storage_location
+FROM (mediaserver.UserAccount INNER JOIN mediaserver.UserMediaConsumption U USING (username))
+INNER JOIN mediaserver.MediaItem M USING (media_id)
+WHERE username = %s AND U.progress < 100
+ORDER BY U.media_id
+
+        """
+
 def user_in_progress_items(username):
     """
     Get user in progress items that aren't 100%
@@ -343,13 +480,7 @@ def user_in_progress_items(username):
         # Fill in the SQL below with a way to find all the in progress items for the user #
         ###################################################################################
 
-        sql = """SELECT U.media_id, U.play_count as playcount, U.progress, U.lastviewed, M.storage_location
-FROM (mediaserver.UserAccount INNER JOIN mediaserver.UserMediaConsumption U USING (username))
-INNER JOIN mediaserver.MediaItem M USING (media_id)
-WHERE username = %s AND U.progress < 100
-ORDER BY U.media_id
-
-        """
+        sql = USER_IN_PROGRESS_ITEMS_SQL
 
         r = dictfetchall(cur,sql,(username,))
         print("return val is:")
@@ -365,27 +496,240 @@ ORDER BY U.media_id
     return None
 
 
+#####################################################
+#   Keyset pages of the catalogue lists
+#   One page of a list costs the same whatever the
+#   size of the catalogue: the next page starts from
+#   the last row of the previous one (a cursor token)
+#   through an index instead of skipping rows with
+#   OFFSET, and the per-row counts are only worked
+#   out for the rows of the page.
+#####################################################
+
+# kind -> the base table, its id and name columns, the columns listed, its
+# item type in the ItemSummary table (counts kept up to date by triggers,
+# see migrations/0004_item_summaries.sql) and the columns worked out for
+# the page rows only
+LIST_PAGES = {
+    'artists': {
+        'table': 'mediaserver.artist a', 'id': 'artist_id', 'name': 'artist_name',
+        'columns': 'a.artist_id, a.artist_name',
+        'summary': 'artist', 'extra': 'coalesce(isum.item_count, 0) as count',
+    },
+    'songs': {
+        'table': 'mediaserver.song a', 'id': 'song_id', 'name': 'song_title',
+        'columns': 'a.song_id, a.song_title',
+        'extra': """(select string_agg(ar.artist_name, ',')
+                     from mediaserver.song_artists sa
+                         join mediaserver.artist ar on (sa.performing_artist_id = ar.artist_id)
+                     where sa.song_id = page.song_id) as artists""",
+    },
+    'podcasts': {
+        'table': 'mediaserver.podcast a', 'id': 'podcast_id', 'name': 'podcast_title',
+        'columns': 'a.podcast_id, a.podcast_title, a.podcast_uri, a.podcast_last_updated',
+        'summary': 'podcast', 'extra': 'coalesce(isum.item_count, 0) as count',
+    },
+    'albums': {
+        'table': 'mediaserver.album a', 'id': 'album_id', 'name': 'album_title',
+        'columns': 'a.album_id, a.album_title',
+        'summary': 'album',
+        'extra': 'coalesce(isum.item_count, 0) as count, isum.artists',
+    },
+    'tvshows': {
+        'table': 'mediaserver.tvshow a', 'id': 'tvshow_id', 'name': 'tvshow_title',
+        'columns': 'a.tvshow_id, a.tvshow_title',
+        'summary': 'tvshow', 'extra': 'coalesce(isum.item_count, 0) as count',
+    },
+    'movies': {
+        'table': 'mediaserver.movie a', 'id': 'movie_id', 'name': 'movie_title',
+        'columns': 'a.movie_id, a.movie_title, a.release_year',
+        'summary': 'movie', 'extra': 'coalesce(isum.item_count, 0) as count',
+    },
+}
+
+LIST_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 500
+
+def list_page_sql(kind, order_by='id', descending=False, seek=False, search=False):
+    """
+    The SQL of one page of a list, built only from the fixed fragments in
+    LIST_PAGES. Parameters: [search pattern], [seek key...], limit, offset.
+    Ordered by id, or by name then id; names sort as '' when NULL, like
+    the *_keyset_idx indexes.
+    """
+    spec = LIST_PAGES[kind]
+    key_id = 'a.' + spec['id']
+    key_name = "coalesce(a.%s, '')" % spec['name']
+    direction = 'desc' if descending else 'asc'
+    where = []
+    if search:
+        where.append("lower(a.%s) like %%s" % spec['name'])
+    if seek:
+        comparison = '<' if descending else '>'
+        if order_by == 'name':
+            where.append("(%s, %s) %s (%%s, %%s)" % (key_name, key_id, comparison))
+        else:
+            where.append("%s %s %%s" % (key_id, comparison))
+    if order_by == 'name':
+        order = "%s %s, %s %s" % (key_name, direction, key_id, direction)
+        outer_order = "page.sort_name %s, page.%s %s" % (direction, spec['id'], direction)
+    else:
+        order = "%s %s" % (key_id, direction)
+        outer_order = "page.%s %s" % (spec['id'], direction)
+    summary = ''
+    if 'summary' in spec:
+        summary = """ left outer join mediaserver.itemsummary isum
+        on (isum.item_type = '%s' and isum.item_id = page.%s)""" % (spec['summary'], spec['id'])
+    return """with page as (
+        select %s, %s as sort_name
+        from %s
+        where %s
+        order by %s
+        limit %%s offset %%s)
+    select page.*, %s
+    from page%s
+    order by %s""" % (spec['columns'], key_name, spec['table'],
+                      ' and '.join(where) or 'true', order, spec['extra'],
+                      summary, outer_order)
+
+def pack_token(value):
+    """ A JSON value as an opaque, URL safe cursor token."""
+    token = json.dumps(value)
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+def unpack_token(token):
+    """ The value packed in a cursor token, None if it is not a token."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, AttributeError, UnicodeError):
+        return None
+
+def encode_cursor(order_by, descending, row, kind):
+    """ The cursor token of the page after row."""
+    key = [row[LIST_PAGES[kind]['id']]]
+    if order_by == 'name':
+        key.insert(0, row['sort_name'])
+    return pack_token([order_by, bool(descending), key])
+
+def decode_cursor(token, order_by, descending):
+    """
+    The seek key in a cursor token, None if the token is not a valid one
+    for this order (then the list starts from the top).
+    """
+    try:
+        token_order, token_descending, key = unpack_token(token)
+        if token_order != order_by or token_descending != bool(descending):
+            return None
+        if order_by == 'name':
+            name, key_id = key
+            return [str(name), int(key_id)]
+        return [int(key[0])]
+    except (ValueError, TypeError, AttributeError, UnicodeError):
+        return None
+
+def get_list_page(kind, limit=LIST_PAGE_SIZE, after=None, order_by='id',
+                  descending=False, search=None, offset=0):
+    """
+    One page of a catalogue list: (rows, cursor token of the next page).
+    The next cursor is None on the last page.
+        - after: cursor token from the previous page
+        - order_by: 'id' or 'name'
+        - search: only rows whose name contains it
+        - offset: rows to skip when there is no cursor (jumping to a page)
+    """
+    order_by = 'name' if order_by == 'name' else 'id'
+    limit = max(1, min(int(limit), LIST_MAX_PAGE_SIZE))
+    key = decode_cursor(after, order_by, descending) if after else None
+    params = []
+    if search:
+        params.append(like_pattern(search))
+    if key is not None:
+        params.extend(key)
+        offset = 0
+    params.extend([limit + 1, max(0, int(offset or 0))])
+    sql = list_page_sql(kind, order_by, descending, key is not None, bool(search))
+
+    conn = database_connect()
+    if(conn is None):
+        return None, None
+    cur = conn.cursor()
+    try:
+        r = dictfetchall(cur,sql,tuple(params))
+        next_cursor = None
+        if len(r) > limit:                  # one more row than asked: not the last page
+            r = r[:limit]
+            next_cursor = encode_cursor(order_by, descending, r[-1], kind)
+        cur.close()                     # Close the cursor
+        conn.close()                    # Close the connection to the db
+        return r, next_cursor
+    except:
+        # If there were any errors, return a NULL row printing an error to the debug
+        print("Unexpected error getting a page of", kind, sys.exc_info()[0])
+        raise
+    cur.close()                     # Close the cursor
+    conn.close()                    # Close the connection to the db
+    return None, None
+
+def count_list(kind, search=None, exact_below=10000):
+    """
+    Rows in a list. Large tables are counted from the planner's estimate
+    and searches stop counting at exact_below, so this stays cheap too.
+    """
+    spec = LIST_PAGES[kind]
+    conn = database_connect()
+    if(conn is None):
+        return None
+    cur = conn.cursor()
+    try:
+        table = spec['table'].split()[0]
+        if search:
+            cur.execute("""select count(*) from (select 1 from %s
+                               where lower(a.%s) like %%s limit %%s) c"""
+                        % (spec['table'], spec['name']),
+                        (like_pattern(search), exact_below))
+            return cur.fetchone()[0]
+        cur.execute("select reltuples::bigint from pg_class where oid = %s::regclass",
+                    (table,))
+        estimate = cur.fetchone()[0]
+        if estimate < exact_below:
+            cur.execute("select count(*) from %s" % table)
+            return cur.fetchone()[0]
+        return estimate
+    except:
+        print("Unexpected error counting", kind, sys.exc_info()[0])
+        raise
+    finally:
+        cur.close()                     # Close the cursor
+        conn.close()                    # Close the connection to the db
+
+
 #####################################################
 #   Get all artists
 #####################################################
-def get_allartists():
+ARTISTS_SQL = """select 
+        a.artist_id, a.artist_name, coalesce(isum.item_count, 0) as count
+    from 
+        mediaserver.artist a left outer join mediaserver.itemsummary isum
+            on (isum.item_type = 'artist' and isum.item_id = a.artist_id)
+    order by a.artist_name;"""
+
+def get_allartists(limit=None, after=None, order_by='id'):
     """
     Get all the artists in your media server
+    With limit set returns one keyset page instead (see get_list_page).
     """
 
+    if limit is not None:
+        return get_list_page('artists', limit, after, order_by)
+
+    sql = ARTISTS_SQL
+
     conn = database_connect()
     if(conn is None):
         return None
     cur = conn.cursor()
     try:
         # Try executing the SQL and get from the database
-        sql = """select 
-            a.artist_id, a.artist_name, count(amd.md_id) as count
-        from 
-            mediaserver.artist a left outer join mediaserver.artistmetadata amd on (a.artist_id=amd.artist_id)
-        group by a.artist_id, a.artist_name
-        order by a.artist_name;"""
-
         r = dictfetchall(cur,sql)
         print("return val is:")
         print(r)
@@ -404,26 +748,32 @@ def get_allartists():
 #####################################################
 #   Get all songs
 #####################################################
-def get_allsongs():
+SONGS_SQL = """select 
+        s.song_id, s.song_title, string_agg(saa.artist_name,',') as artists
+    from 
+        mediaserver.song s left outer join 
+        (mediaserver.Song_Artists sa join mediaserver.Artist a on (sa.performing_artist_id=a.artist_id)
+        ) as saa  on (s.song_id=saa.song_id)
+    group by s.song_id, s.song_title
+    order by s.song_id"""
+
+def get_allsongs(limit=None, after=None, order_by='id'):
     """
     Get all the songs in your media server
+    With limit set returns one keyset page instead (see get_list_page).
     """
 
+    if limit is not None:
+        return get_list_page('songs', limit, after, order_by)
+
+    sql = SONGS_SQL
+
     conn = database_connect()
     if(conn is None):
         return None
     cur = conn.cursor()
     try:
         # Try executing the SQL and get from the database
-        sql = """select 
-            s.song_id, s.song_title, string_agg(saa.artist_name,',') as artists
-        from 
-            mediaserver.song s left outer join 
-            (mediaserver.Song_Artists sa join mediaserver.Artist a on (sa.performing_artist_id=a.artist_id)
-            ) as saa  on (s.song_id=saa.song_id)
-        group by s.song_id, s.song_title
-        order by s.song_id"""
-
         r = dictfetchall(cur,sql)
         print("return val is:")
         print(r)
@@ -442,28 +792,29 @@ def get_allsongs():
 #####################################################
 #   Get all podcasts
 #####################################################
-def get_allpodcasts():
+PODCASTS_SQL = """select 
+            p.*, coalesce(isum.item_count, 0) as count
+        from 
+            mediaserver.podcast p left outer join mediaserver.itemsummary isum
+                on (isum.item_type = 'podcast' and isum.item_id = p.podcast_id);"""
+
+def get_allpodcasts(limit=None, after=None, order_by='id'):
     """
     Get all the podcasts in your media server
+    With limit set returns one keyset page instead (see get_list_page).
     """
 
+    if limit is not None:
+        return get_list_page('podcasts', limit, after, order_by)
+
+    sql = PODCASTS_SQL
+
     conn = database_connect()
     if(conn is None):
         return None
     cur = conn.cursor()
     try:
         # Try executing the SQL and get from the database
-        sql = """select 
-                p.*, pnew.count as count  
-            from 
-                mediaserver.podcast p, 
-                (select 
-                    p1.podcast_id, count(*) as count 
-                from 
-                    mediaserver.podcast p1 left outer join mediaserver.podcastepisode pe1 on (p1.podcast_id=pe1.podcast_id) 
-                    group by p1.podcast_id) pnew 
-            where p.podcast_id = pnew.podcast_id;"""
-
         r = dictfetchall(cur,sql)
         print("return val is:")
         print(r)
@@ -483,32 +834,29 @@ def get_allpodcasts():
 #####################################################
 #   Get all albums
 #####################################################
-def get_allalbums():
+ALBUMS_SQL = """select 
+            a.album_id, a.album_title, coalesce(isum.item_count, 0) as count, isum.artists
+        from 
+            mediaserver.album a left outer join mediaserver.itemsummary isum
+                on (isum.item_type = 'album' and isum.item_id = a.album_id);"""
+
+def get_allalbums(limit=None, after=None, order_by='id'):
     """
     Get all the Albums in your media server
+    With limit set returns one keyset page instead (see get_list_page).
     """
 
+    if limit is not None:
+        return get_list_page('albums', limit, after, order_by)
+
+    sql = ALBUMS_SQL
+
     conn = database_connect()
     if(conn is None):
         return None
     cur = conn.cursor()
     try:
         # Try executing the SQL and get from the database
-        sql = """select 
-                a.album_id, a.album_title, anew.count as count, anew.artists
-            from 
-                mediaserver.album a, 
-                (select 
-                    a1.album_id, count(distinct as1.song_id) as count, array_to_string(array_agg(distinct ar1.artist_name),',') as artists
-                from 
-                    mediaserver.album a1 
-			left outer join mediaserver.album_songs as1 on (a1.album_id=as1.album_id) 
-			left outer join mediaserver.song s1 on (as1.song_id=s1.song_id)
-			left outer join mediaserver.Song_Artists sa1 on (s1.song_id=sa1.song_id)
-			left outer join mediaserver.artist ar1 on (sa1.performing_artist_id=ar1.artist_id)
-                group by a1.album_id) anew 
-            where a.album_id = anew.album_id;"""
-
         r = dictfetchall(cur,sql)
         print("return val is:")
         print(r)
@@ -529,27 +877,33 @@ def get_allalbums():
 #   Query (3 a,b c)
 #   Get all tvshows
 #####################################################
-def get_alltvshows():
+TVSHOWS_SQL = """
+            SELECT t.tvshow_id, t.tvshow_title, COALESCE(isum.item_count, 0) AS count
+            FROM mediaserver.tvshow t LEFT OUTER JOIN mediaserver.itemsummary isum
+                ON (isum.item_type = 'tvshow' AND isum.item_id = t.tvshow_id)
+            ORDER BY t.tvshow_id
+    """
+
+def get_alltvshows(limit=None, after=None, order_by='id'):
     """
     Get all the TV Shows in your media server
+    With limit set returns one keyset page instead (see get_list_page).
     """
 
+    if limit is not None:
+        return get_list_page('tvshows', limit, after, order_by)
+
+    #############################################################################
+    # Fill in the SQL below with a query to get all tv shows and episode counts #
+    #############################################################################
+    sql = TVSHOWS_SQL
+
     conn = database_connect()
     if(conn is None):
         return None
     cur = conn.cursor()
     try:
-
-        #############################################################################
-        # Fill in the SQL below with a query to get all tv shows and episode counts #
-        #############################################################################
-        sql = """
-                SELECT tvshow_id, tvshow_title, COUNT(tvshow_id)
-                FROM mediaserver.tvshow JOIN mediaserver.tvepisode USING(tvshow_id)
-                GROUP BY tvshow_id
-                ORDER BY tvshow_id
-        """
-
+        # Try executing the SQL and get from the database
         r = dictfetchall(cur,sql)
         print("return val is:")
         print(r)
@@ -568,11 +922,16 @@ def get_alltvshows():
 #####################################################
 #   Get all movies
 #####################################################
-def get_allmovies():
+def get_allmovies(limit=None, after=None, order_by='id'):
     """
-    Get all the Movies in your media server
+    Get all the Movies in your media server (the ones with ratings)
+    With limit set returns one keyset page of every movie instead (see
+    get_list_page).
     """
 
+    if limit is not None:
+        return get_list_page('movies', limit, after, order_by)
+
     conn = database_connect()
     if(conn is None):
         return None
@@ -580,24 +939,17 @@ def get_allmovies():
     try:
         # Try executing the SQL and get from the database
         sql = """select 
-            m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count, last_updated
+            m.movie_id, m.movie_title, m.release_year, coalesce(isum.item_count, 0) as count, last_updated
         from 
-            mediaserver.movie m left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-            join mediaserver.movieratings using(movie_id)
-        group by m.movie_id, m.movie_title, m.release_year, last_updated
+            mediaserver.movie m join mediaserver.movieratings using(movie_id)
+            left outer join mediaserver.itemsummary isum
+                on (isum.item_type = 'movie' and isum.item_id = m.movie_id)
         order by movie_id;"""
 
         r = dictfetchall(cur,sql)
         print("return val is:")
         print(r)
 
-        # New functionality: populate recently_scanned dictionary
-        
-        for entry in r:
-            if entry['last_updated'] != None:
-                if date.today() - entry['last_updated'] <= datetime.timedelta(days=7): # add to recently_scanned if scanned within 7 days
-                    recently_scanned[entry['movie_id']] = True        
-
         cur.close()                     # Close the cursor
         conn.close()                    # Close the connection to the db
 
@@ -613,246 +965,153 @@ def get_allmovies():
 #######################################################   NEW FUNCTIONALITY ###############################################################
 
 #####################################################
-#   Get all movies with ratings
-#####################################################
-def get_allmovies_ratings():
-    """
-    Get all the Movies in your media server
-    """
-
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
+#   Movies with ratings
+#   One query for every ratings view: a filter, a sort
+#   key and a page. Each filter and sort pair has an
+#   index in that order (migrations/0005), so a page
+#   is read off the index, and the metadata counts
+#   come from ItemSummary for the page rows only.
+#####################################################
+
+# filter -> the movies it keeps
+RATINGS_FILTERS = {
+    'all': 'true',
+    'top250': 'r.top250',
+    'top100': 'r.top100',
+    'both': 'r.top250 and r.top100',
+}
+
+# sort -> (the sort keys, best first, and their types in a cursor). Missing
+# ratings sort last, as -1; ties are resolved by the next ratings and then
+# the movie id. The expressions are the ones in the movieratings_*_idx
+# indexes, so keep the two in step.
+RATINGS_SORTS = {
+    'id': ([('r.movie_id', 'int')], 'asc'),
+    'imdb': ([('coalesce(r.imdb_score, -1)', 'numeric'),
+              ('coalesce(r.imdb_votes, -1)', 'int'),
+              ('coalesce(r.rt_score, -1)', 'numeric'),
+              ('r.movie_id', 'int')], 'desc'),
+    'rt': ([('coalesce(r.rt_score, -1)', 'numeric'),
+            ('coalesce(r.imdb_score, -1)', 'numeric'),
+            ('coalesce(r.imdb_votes, -1)', 'int'),
+            ('r.movie_id', 'int')], 'desc'),
+}
+
+def decode_ratings_cursor(token, sort_by):
+    """
+    The seek key in a ratings cursor token, as strings checked against the
+    types of the sort's keys. None if the token is not a valid one for this
+    sort (then the list starts from the top).
+    """
+    keys = RATINGS_SORTS[sort_by][0]
     try:
-        # Try executing the SQL and get from the database
-        sql = """select 
-            m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count
-        from 
-            mediaserver.movie m left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-        group by m.movie_id, m.movie_title, m.release_year
-        order by movie_id;"""
-
-        r = dictfetchall(cur,sql)
-        print("return val is:")
-        print(r)
-
-        # NEW FUNCTIONALITY: MOVIE RATINGS
-
-        # Loop over all entries in 'r'
-
-        for entry in r:
-            
-            # Check if already scanned
-
-            if recently_scanned.get(entry['movie_id']):
-                continue
-
-            # Get new values from API
-
-            movie_info = get_rating_info(entry, '6d184c23') # MIGHT NEED NEW APIKEY AT SOME STAGE
-            
-            # Wrap in try-catch blocks in case attribute doesn't exist
-
-            try:
-                imdb_score = float(movie_info['imdbRating'])
-            except:
-                imdb_score = None
-            try:
-                imdb_votes = int(movie_info['imdbVotes'].replace(",", ""))
-            except:
-                imdb_votes = None
-            try:
-                rt_score = float(movie_info['Ratings'][1]['Value'].strip("%"))
-            except:
-                rt_score = None
-
-            in_top100 = get_in_top100(entry['movie_title'])
-            in_top250 = get_in_top250(entry['movie_title'])
-            
-            # RUN PROCEDURE TO INSERT VALUES INTO TABLE
-
-            cur.execute("SELECT mediaserver.addMovieRatings(%s::int, %s::decimal, %s::int, %s::decimal, %s::boolean, %s::boolean);", (entry['movie_id'], imdb_score, imdb_votes, rt_score, in_top100, in_top250))
-            conn.commit()
-
-            recently_scanned[entry['movie_id']] = True
-
-
-        sql = """select 
-            m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count, imdb_score, rt_score, top250, top100
-        from 
-            mediaserver.movie m join mediaserver.movieratings using(movie_id)
-            left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-            
-        group by m.movie_id, m.movie_title, m.release_year, imdb_score, rt_score, top250, top100
-        order by movie_id;"""
-
-        r = dictfetchall(cur,sql)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Movies:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
+        key = unpack_token(token)
+        if not (isinstance(key, list) and len(key) == len(keys) + 1 and key[0] == sort_by):
+            return None
+        values = []
+        for (_, cast), value in zip(keys, key[1:]):
+            if cast == 'int':
+                value = int(value)
+                if not -2**31 <= value < 2**31:
+                    return None
+            else:
+                value = Decimal(value)
+                # Nothing a rating can be: NaN, infinity, or digits
+                # beyond what numeric takes
+                if not value.is_finite() or abs(value.adjusted()) > 100:
+                    return None
+            values.append(str(value))
+        return values
+    except (ValueError, TypeError, AttributeError, UnicodeError, ArithmeticError):
+        return None
 
-#####################################################
-#   Get all movies sorted by imdb rating or rotten tomateos rating
-#####################################################
-def sort_by_rating(rating_type):
-    """
-    Get all the Movies in your media server
-    """
+def movie_ratings_sql(filter_by, sort_by, seek=False):
+    """
+    The SQL of one page of movies with ratings, built only from the fixed
+    fragments above. Parameters: [seek key...], limit.
+    """
+    keys, direction = RATINGS_SORTS[sort_by]
+    where = [RATINGS_FILTERS[filter_by]]
+    if seek:
+        where.append("(%s) %s (%s)" % (
+            ', '.join(expression for expression, _ in keys),
+            '<' if direction == 'desc' else '>',
+            ', '.join('%%s::%s' % cast for _, cast in keys)))
+    return """with page as (
+        select r.movie_id, r.imdb_score, r.imdb_votes, r.rt_score, r.top250, r.top100, %s
+        from mediaserver.movieratings r
+        where %s
+        order by %s
+        limit %%s)
+    select m.movie_id, m.movie_title, m.release_year, coalesce(isum.item_count, 0) as count,
+        page.*
+    from page join mediaserver.movie m using (movie_id)
+        left outer join mediaserver.itemsummary isum
+            on (isum.item_type = 'movie' and isum.item_id = page.movie_id)
+    order by %s""" % (
+        ', '.join('%s as sort_key_%d' % (expression, i) for i, (expression, _) in enumerate(keys)),
+        ' and '.join(where),
+        ', '.join('%s %s' % (expression, direction) for expression, _ in keys),
+        ', '.join('page.sort_key_%d %s' % (i, direction) for i in range(len(keys))))
+
+def get_movie_ratings(filter_by='all', sort_by='id', limit=LIST_PAGE_SIZE, after=None):
+    """
+    One page of the movies with ratings: (rows, cursor token of the next
+    page). The next cursor is None on the last page.
+        - filter_by: 'all', 'top250', 'top100' or 'both'
+        - sort_by: 'id', 'imdb' (IMDb score, then votes) or 'rt' (Rotten
+          Tomatoes score, then IMDb score)
+        - after: cursor token from the previous page
+    """
+    if filter_by not in RATINGS_FILTERS or sort_by not in RATINGS_SORTS:
+        return None, None
+    limit = max(1, min(int(limit), LIST_MAX_PAGE_SIZE))
+    keys = RATINGS_SORTS[sort_by][0]
+    key = decode_ratings_cursor(after, sort_by) if after else None
+    params = list(key) if key else []
+    params.append(limit + 1)
 
     conn = database_connect()
     if(conn is None):
-        return None
+        return None, None
     cur = conn.cursor()
     try:
-        
-        if rating_type == "IMDB":
-
-            sql = """select 
-                m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count, imdb_score, imdb_votes, rt_score, top250, top100
-            from 
-                mediaserver.movie m join mediaserver.movieratings using(movie_id)
-                left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-                
-            group by m.movie_id, m.movie_title, m.release_year, imdb_score, imdb_votes, rt_score, top250, top100
-            order by case when imdb_score is null then 1 else 0 end, imdb_score desc, imdb_votes desc, rt_score desc;"""
-        
-        elif rating_type == "RT":
-
-            sql = """select 
-                m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count, imdb_score, imdb_votes, rt_score, top250, top100
-            from 
-                mediaserver.movie m join mediaserver.movieratings using(movie_id)
-                left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-                
-            group by m.movie_id, m.movie_title, m.release_year, imdb_score, imdb_votes, rt_score, top250, top100
-            order by case when rt_score is null then 1 else 0 end, rt_score desc, imdb_score desc, imdb_votes desc;"""            
-        
-        else:
-            return None
-
-        r = dictfetchall(cur,sql,)
-        print("return val is:")
-        print(r)
-
+        r = dictfetchall(cur,movie_ratings_sql(filter_by, sort_by, key is not None),tuple(params))
+        next_cursor = None
+        if len(r) > limit:                  # one more row than asked: not the last page
+            r = r[:limit]
+            next_cursor = pack_token([sort_by] + [
+                str(r[-1]['sort_key_%d' % i]) for i in range(len(keys))])
         cur.close()                     # Close the cursor
         conn.close()                    # Close the connection to the db
-
-        return r
+        return r, next_cursor
     except:
         # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Movies:", sys.exc_info()[0])
+        print("Unexpected error getting movie ratings:", sys.exc_info()[0])
         raise
     cur.close()                     # Close the cursor
     conn.close()                    # Close the connection to the db
-    return None
+    return None, None
 
-
-#####################################################
-#   Get all movies in the imdb top 250 or top 100, sorted by imdb or rt rating
-#####################################################
-def get_in_top(top250_or_100, order_type):
+def refresh_stale_ratings():
     """
-    Get all the Movies in your media server
+    Sends the movies whose ratings are missing or older than the TTL to
+    OMDb in a background job; the ratings pages show the ratings stored
+    so far.
     """
-
     conn = database_connect()
     if(conn is None):
         return None
     cur = conn.cursor()
     try:
-        
-        if top250_or_100 == "top250":
-            
-            if order_type == "IMDB":
-
-                sql = """select 
-                    m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count, imdb_score, imdb_votes, rt_score, top250, top100
-                from 
-                    mediaserver.movie m join mediaserver.movieratings using(movie_id)
-                    left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-                where top250 = true
-                group by m.movie_id, m.movie_title, m.release_year, imdb_score, imdb_votes, rt_score, top250, top100
-                order by case when imdb_score is null then 1 else 0 end, imdb_score desc, imdb_votes desc, rt_score desc;"""
-
-            elif order_type == "RT":
-
-                sql = """select 
-                    m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count, imdb_score, imdb_votes, rt_score, top250, top100
-                from 
-                    mediaserver.movie m join mediaserver.movieratings using(movie_id)
-                    left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-                where top250 = true
-                group by m.movie_id, m.movie_title, m.release_year, imdb_score, imdb_votes, rt_score, top250, top100
-                order by case when rt_score is null then 1 else 0 end, rt_score desc, imdb_score desc, imdb_votes desc;"""
-        
-        elif top250_or_100 == "top100":
-
-            if order_type == "IMDB":
-
-                sql = """select 
-                    m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count, imdb_score, imdb_votes, rt_score, top250, top100
-                from 
-                    mediaserver.movie m join mediaserver.movieratings using(movie_id)
-                    left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-                where top100 = true
-                group by m.movie_id, m.movie_title, m.release_year, imdb_score, imdb_votes, rt_score, top250, top100
-                order by case when imdb_score is null then 1 else 0 end, imdb_score desc, imdb_votes desc, rt_score desc;"""
-
-            elif order_type == "RT":
-
-                sql = """select 
-                    m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count, imdb_score, imdb_votes, rt_score, top250, top100
-                from 
-                    mediaserver.movie m join mediaserver.movieratings using(movie_id)
-                    left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-                where top100 = true
-                group by m.movie_id, m.movie_title, m.release_year, imdb_score, imdb_votes, rt_score, top250, top100
-                order by case when rt_score is null then 1 else 0 end, rt_score desc, imdb_score desc, imdb_votes desc;"""            
-
-        elif top250_or_100 == "both":
-
-            if order_type == "IMDB":
-
-                sql = """select 
-                    m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count, imdb_score, imdb_votes, rt_score, top250, top100
-                from 
-                    mediaserver.movie m join mediaserver.movieratings using(movie_id)
-                    left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-                where top250 = true and top100 = true
-                group by m.movie_id, m.movie_title, m.release_year, imdb_score, imdb_votes, rt_score, top250, top100
-                order by case when imdb_score is null then 1 else 0 end, imdb_score desc, imdb_votes desc, rt_score desc;"""
-
-            elif order_type == "RT":
-
-                sql = """select 
-                    m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count, imdb_score, imdb_votes, rt_score, top250, top100
-                from 
-                    mediaserver.movie m join mediaserver.movieratings using(movie_id)
-                    left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
-                where top250 = true and top100 = true
-                group by m.movie_id, m.movie_title, m.release_year, imdb_score, imdb_votes, rt_score, top250, top100
-                order by case when rt_score is null then 1 else 0 end, rt_score desc, imdb_score desc, imdb_votes desc;"""
-
-        r = dictfetchall(cur,sql,)
-        print("return val is:")
-        print(r)
-
+        stale = dictfetchall(cur,STALE_MOVIES_SQL,(ratings_ttl_days(), ratings_max_refresh()))
+        if stale:
+            start_ratings_enrichment(stale)
         cur.close()                     # Close the cursor
         conn.close()                    # Close the connection to the db
-
-        return r
+        return len(stale)
     except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Movies:", sys.exc_info()[0])
+        print("Unexpected error finding stale ratings:", sys.exc_info()[0])
         raise
     cur.close()                     # Close the cursor
     conn.close()                    # Close the connection to the db
@@ -898,6 +1157,17 @@ def get_artist(artist_id):
 #   Query (2 a,b,c)
 #   Get one song
 #####################################################
+SONG_SQL = """
+
+                SELECT song_title, STRING_AGG(artist_name, ', ') as artists, length
+                FROM
+                mediaserver.song JOIN mediaserver.song_artists USING(song_id)
+                    JOIN mediaserver.artist ON(artist_id = performing_artist_id)
+                WHERE song_id = %s
+                GROUP BY song_title, length
+
+        """
+
 def get_song(song_id):
     """
     Get a song by their ID in your media server
@@ -913,16 +1183,7 @@ def get_song(song_id):
         # Fill in the SQL below with a query to get all information about a song    #
         # and the artists that performed it                                         #
         #############################################################################
-        sql = """
-
-                SELECT song_title, STRING_AGG(artist_name, ', ') as artists, length
-                FROM
-                mediaserver.song JOIN mediaserver.song_artists USING(song_id)
-                    JOIN mediaserver.artist ON(artist_id = performing_artist_id)
-                WHERE song_id = %s
-                GROUP BY song_title, length
-
-        """
+        sql = SONG_SQL
 
         r = dictfetchall(cur,sql,(song_id,))
         print("return val is:")
@@ -940,24 +1201,9 @@ def get_song(song_id):
 
 #####################################################
 #   Query (2 d)
-#   Get metadata for one song
-#####################################################
-def get_song_metadata(song_id):
-    """
-    Get the meta for a song by their ID in your media server
-    """
-
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
-
-        #############################################################################
-        # Fill in the SQL below with a query to get all metadata about a song       #
-        #############################################################################
-
-        sql = """
+#   Get metadata for one song
+#####################################################
+SONG_METADATA_SQL = """
                 SELECT md_value, md_type_name
                 FROM mediaserver.song JOIN mediaserver.mediaitem ON(media_id = song_id)
                     JOIN mediaserver.mediaitemmetadata USING(media_id)
@@ -978,6 +1224,23 @@ def get_song_metadata(song_id):
                                     WHERE song_id = %s)
         """
 
+def get_song_metadata(song_id):
+    """
+    Get the meta for a song by their ID in your media server
+    """
+
+    conn = database_connect()
+    if(conn is None):
+        return None
+    cur = conn.cursor()
+    try:
+
+        #############################################################################
+        # Fill in the SQL below with a query to get all metadata about a song       #
+        #############################################################################
+
+        sql = SONG_METADATA_SQL
+
         r = dictfetchall(cur,sql,(song_id, song_id))
         print("return val is:")
         print(r)
@@ -1122,6 +1385,15 @@ def get_podcastep(podcastep_id):
 #   Query (5 a,b)
 #   Get one album
 #####################################################
+ALBUM_SQL = """
+                SELECT album_title, md_value, md_type_name
+                FROM mediaserver.album JOIN mediaserver.albummetadata USING(album_id)
+                    JOIN mediaserver.mediaitem ON(media_id = album_id)
+                    JOIN mediaserver.metadata USING(md_id)
+                    JOIN mediaserver.metadatatype USING(md_type_id)
+                WHERE album_id = %s
+        """
+
 def get_album(album_id):
     """
     Get an album by their ID in your media server
@@ -1136,14 +1408,7 @@ def get_album(album_id):
         # Fill in the SQL below with a query to get all information about an album  #
         # including all relevant metadata                                           #
         #############################################################################
-        sql = """
-                SELECT album_title, md_value, md_type_name
-                FROM mediaserver.album JOIN mediaserver.albummetadata USING(album_id)
-                    JOIN mediaserver.mediaitem ON(media_id = album_id)
-                    JOIN mediaserver.metadata USING(md_id)
-                    JOIN mediaserver.metadatatype USING(md_type_id)
-                WHERE album_id = %s
-        """
+        sql = ALBUM_SQL
 
         r = dictfetchall(cur,sql,(album_id,))
         print("return val is:")
@@ -1164,6 +1429,17 @@ def get_album(album_id):
 #   Query (5 c)
 #   Get all songs for one album
 #####################################################
+ALBUM_SONGS_SQL = """
+                SELECT song_id, song_title, STRING_AGG(artist_name, ', ') as artists
+                FROM mediaserver.album_songs JOIN mediaserver.song USING(song_id)
+                    JOIN mediaserver.song_artists USING(song_id)
+                    JOIN mediaserver.artist ON(artist_id = performing_artist_id)
+                WHERE album_id = %s
+                GROUP BY song_id, song_title, track_num
+                ORDER BY track_num
+
+        """
+
 def get_album_songs(album_id):
     """
     Get all songs for an album by the album ID in your media server
@@ -1179,16 +1455,7 @@ def get_album_songs(album_id):
         # Fill in the SQL below with a query to get all information about all       #
         # songs in an album, including their artists                                #
         #############################################################################
-        sql = """
-                SELECT song_id, song_title, STRING_AGG(artist_name, ', ') as artists
-                FROM mediaserver.album_songs JOIN mediaserver.song USING(song_id)
-                    JOIN mediaserver.song_artists USING(song_id)
-                    JOIN mediaserver.artist ON(artist_id = performing_artist_id)
-                WHERE album_id = %s
-                GROUP BY song_id, song_title, track_num
-                ORDER BY track_num
-
-        """
+        sql = ALBUM_SONGS_SQL
 
         r = dictfetchall(cur,sql,(album_id,))
         print("return val is:")
@@ -1209,6 +1476,19 @@ def get_album_songs(album_id):
 #   Query (6)
 #   Get all genres for one album
 #####################################################
+ALBUM_GENRES_SQL = """
+                SELECT DISTINCT(md_value), md_type_name 
+                FROM mediaserver.song JOIN mediaserver.mediaitem ON(media_id = song_id)
+                    JOIN mediaserver.mediaitemmetadata USING(media_id)
+                    JOIN mediaserver.metadata USING(md_id)
+                    JOIN mediaserver.metadatatype USING(md_type_id)
+                WHERE md_type_id = 1 
+                    AND song_id IN (SELECT song_id
+                                    FROM mediaserver.album_songs 
+                                    WHERE album_id = %s)
+                ORDER BY md_value
+        """
+
 def get_album_genres(album_id):
     """
     Get all genres for an album by the album ID in your media server
@@ -1224,18 +1504,7 @@ def get_album_genres(album_id):
         # Fill in the SQL below with a query to get all information about all       #
         # genres in an album (based on all the genres of the songs in that album)   #
         #############################################################################
-        sql = """
-                SELECT DISTINCT(md_value), md_type_name 
-                FROM mediaserver.song JOIN mediaserver.mediaitem ON(media_id = song_id)
-                    JOIN mediaserver.mediaitemmetadata USING(media_id)
-                    JOIN mediaserver.metadata USING(md_id)
-                    JOIN mediaserver.metadatatype USING(md_type_id)
-                WHERE md_type_id = 1 
-                    AND song_id IN (SELECT song_id
-                                    FROM mediaserver.album_songs 
-                                    WHERE album_id = %s)
-                ORDER BY md_value
-        """
+        sql = ALBUM_GENRES_SQL
 
         r = dictfetchall(cur,sql,(album_id,))
         print("return val is:")
@@ -1256,6 +1525,17 @@ def get_album_genres(album_id):
 #   Query (4 a,b)
 #   Get one tvshow
 #####################################################
+TVSHOW_SQL = """
+SELECT A.tvshow_title, B.md_type_name, C.md_value 
+            FROM ((mediaserver.TVShow A INNER JOIN mediaserver.TVShowMetaData USING (tvshow_id))
+                INNER JOIN mediaserver.MetaData C USING (md_id)) 
+                INNER JOIN mediaserver.MetaDataType B USING (md_type_id)
+            WHERE A.tvshow_id = %s
+            ORDER BY A.tvshow_id
+
+
+        """
+
 def get_tvshow(tvshow_id):
     """
     Get one tvshow in your media server
@@ -1271,16 +1551,7 @@ def get_tvshow(tvshow_id):
         # Fill in the SQL below with a query to get all information about a tv show #
         # including all relevant metadata       #
         #############################################################################
-        sql = """
-SELECT A.tvshow_title, B.md_type_name, C.md_value 
-            FROM ((mediaserver.TVShow A INNER JOIN mediaserver.TVShowMetaData USING (tvshow_id))
-                INNER JOIN mediaserver.MetaData C USING (md_id)) 
-                INNER JOIN mediaserver.MetaDataType B USING (md_type_id)
-            WHERE A.tvshow_id = %s
-            ORDER BY A.tvshow_id
-
-
-        """
+        sql = TVSHOW_SQL
 
         r = dictfetchall(cur,sql,(tvshow_id,))
         print("return val is:")
@@ -1301,6 +1572,14 @@ SELECT A.tvshow_title, B.md_type_name, C.md_value
 #   Query (4 c)
 #   Get all tv show episodes for one tv show
 #####################################################
+TVSHOW_EPISODES_SQL = """
+        SELECT media_id, tvshow_episode_title, season, episode, air_date
+            FROM mediaserver.TVEpisode
+            WHERE tvshow_id = %s
+            ORDER BY season, episode
+
+        """
+
 def get_all_tvshoweps_for_tvshow(tvshow_id):
     """
     Get all tvshow episodes for one tv show in your media server
@@ -1316,13 +1595,7 @@ def get_all_tvshoweps_for_tvshow(tvshow_id):
         # Fill in the SQL below with a query to get all information about all       #
         # tv episodes in a tv show                                                  #
         #############################################################################
-        sql = """
-        SELECT media_id, tvshow_episode_title, season, episode, air_date
-            FROM mediaserver.TVEpisode
-            WHERE tvshow_id = %s
-            ORDER BY season, episode
-
-        """
+        sql = TVSHOW_EPISODES_SQL
 
         r = dictfetchall(cur,sql,(tvshow_id,))
         print("return val is:")
@@ -1339,6 +1612,51 @@ def get_all_tvshoweps_for_tvshow(tvshow_id):
     return None
 
 
+#####################################################
+#   Page queries
+#   The queries behind one page, sent together with
+#   pipeline_query() so the page costs one round trip.
+#   Each returns one value per query, None on failure.
+#####################################################
+
+def get_user_home(username):
+    """
+    Playlists, podcast subscriptions and in progress items of a user
+    (Queries 1 a, b and c).
+    """
+    r = pipeline_query((USER_PLAYLISTS_SQL, (username,)),
+                       (USER_PODCAST_SUBSCRIPTIONS_SQL, (username,)),
+                       (USER_IN_PROGRESS_ITEMS_SQL, (username,)))
+    if r is None:
+        return None, None, None
+    return tuple(r)
+
+def load_song_page(song_id):
+    """
+    A song and its metadata (Queries 2 a-d).
+    """
+    r = pipeline_query((SONG_SQL, (song_id,)),
+                       (SONG_METADATA_SQL, (song_id, song_id)))
+    return None if r is None else tuple(r)
+
+def load_album_page(album_id):
+    """
+    An album, its songs and its genres (Queries 5 a-c and 6).
+    """
+    r = pipeline_query((ALBUM_SQL, (album_id,)),
+                       (ALBUM_SONGS_SQL, (album_id,)),
+                       (ALBUM_GENRES_SQL, (album_id,)))
+    return None if r is None else tuple(r)
+
+def load_tvshow_page(tvshow_id):
+    """
+    A tv show and its episodes (Queries 4 a-c).
+    """
+    r = pipeline_query((TVSHOW_SQL, (tvshow_id,)),
+                       (TVSHOW_EPISODES_SQL, (tvshow_id,)))
+    return None if r is None else tuple(r)
+
+
 #####################################################
 #   Get one tvshow episode
 #####################################################
@@ -1391,44 +1709,18 @@ def get_movie(movie_id):
         
         # NEW FUNCTIONALITY: MOVIE RATINGS
 
-        # Scan only if not already scanned
+        # Ratings missing or older than the TTL are fetched in the
+        # background; the page shows the ratings stored so far
 
-        if recently_scanned.get('movie_id') == False:
-                
-            # Get new values from API
-
-            movie_info = get_rating_info(r[0], '6d184c23') # MIGHT NEED NEW APIKEY AT SOME STAGE
-
-            # Wrap in try-catch blocks in case attribute doesn't exist            
-
-            try:
-                imdb_score = float(movie_info['imdbRating'])
-            except:
-                imdb_score = None
-            try:
-                imdb_votes = int(movie_info['imdbVotes'].replace(",", ""))
-            except:
-                imdb_votes = None
-            try:
-                rt_score = float(movie_info['Ratings'][1]['Value'].strip("%"))
-            except:
-                rt_score = None
-
-            in_top100 = get_in_top100(r[0]['movie_title'])
-            in_top250 = get_in_top250(r[0]['movie_title'])
-
-            # RUN PROCEDURE TO INSERT VALUES INTO TABLE
-
-            cur.execute("SELECT mediaserver.addMovieRatings(%s::int, %s::decimal, %s::int, %s::decimal, %s::boolean, %s::boolean);", (movie_id, imdb_score, imdb_votes, rt_score, in_top100, in_top250))
-            conn.commit()
-
-            recently_scanned[movie_id] = True
+        stale = dictfetchall(cur,STALE_MOVIE_SQL,(movie_id, ratings_ttl_days()))
+        if stale:
+            start_ratings_enrichment(stale)
 
         sql = """select *
         from mediaserver.movie m left outer join 
             (mediaserver.mediaitemmetadata natural join mediaserver.metadata natural join mediaserver.MetaDataType) mmd
         on (m.movie_id=mmd.media_id)
-        join mediaserver.movieratings using(movie_id)
+        left outer join mediaserver.movieratings using(movie_id)
         where m.movie_id=%s;"""
 
         r = dictfetchall(cur,sql,(movie_id,))
@@ -1450,12 +1742,149 @@ def get_movie(movie_id):
     return None
 
 
+#####################################################
+#   Cached item pages
+#   The data of single item pages comes from
+#   entity_cache (see entitycache.py) when it can.
+#####################################################
+
+# Catalogue parts (page_cache generations) each kind of entity is built from
+ENTITY_DEPENDS = {
+    'artist': ('artists',),
+    'song': ('songs', 'artists', 'albums'),
+    'song_summary': ('songs', 'artists'),
+    'album': ('albums', 'songs', 'artists'),
+    'podcast': ('podcasts',),
+    'podcastep': ('podcasts',),
+    'movie': ('movies',),
+    'movie_summary': ('movies',),
+    'tvshow': ('tvshows',),
+    'tvshowep': ('tvshows',),
+    'list_total': tuple(LIST_PAGES),    # each list's row count
+}
+
+entity_cache = entitycache.EntityCache(
+    max_entries=read_config()['CACHE'].getint('entity_max_entries', 1000),
+    ttl=read_config()['CACHE'].getint('entity_ttl', 60),
+    depends=ENTITY_DEPENDS,
+    generation=page_cache.generation)
+
+def get_artist_page(artist_id):
+    return entity_cache.get('artist', artist_id, get_artist)
+
+def get_song_page(song_id):
+    """ A song and its metadata."""
+    return entity_cache.get('song', song_id, load_song_page) or (None, None)
+
+def get_album_page(album_id):
+    """ An album, its songs and its genres."""
+    return entity_cache.get('album', album_id, load_album_page) or (None, None, None)
+
+def get_podcast_page(podcast_id):
+    """ A podcast and its episodes."""
+    def load(podcast_id):
+        podcast = get_podcast(podcast_id)
+        podcasteps = get_all_podcasteps_for_podcast(podcast_id)
+        if podcast is None or podcasteps is None:
+            return None
+        return podcast, podcasteps
+    return entity_cache.get('podcast', podcast_id, load) or (None, None)
+
+def get_podcastep_page(media_id):
+    return entity_cache.get('podcastep', media_id, get_podcastep)
+
+def get_movie_page(movie_id):
+    return entity_cache.get('movie', movie_id, get_movie)
+
+def get_tvshow_page(tvshow_id):
+    """ A tv show and its episodes."""
+    return entity_cache.get('tvshow', tvshow_id, load_tvshow_page) or (None, None)
+
+def get_tvshowep_page(tvshowep_id):
+    return entity_cache.get('tvshowep', tvshowep_id, get_tvshowep)
+
+def list_total(kind):
+    """ Rows in a list (see count_list), counted once per catalogue generation."""
+    return entity_cache.get('list_total', kind, count_list)
+
+SONG_SUMMARIES_SQL = """select s.song_id, s.song_title, s.length,
+        string_agg(a.artist_name, ', ' order by a.artist_name) as artists
+    from mediaserver.song s
+        left outer join mediaserver.song_artists sa on (s.song_id = sa.song_id)
+        left outer join mediaserver.artist a on (sa.performing_artist_id = a.artist_id)
+    where s.song_id = any(%s::int[])
+    group by s.song_id, s.song_title, s.length"""
+
+MOVIE_SUMMARIES_SQL = """select m.movie_id, m.movie_title, m.release_year
+    from mediaserver.movie m
+    where m.movie_id = any(%s::int[])"""
+
+def _load_summaries(sql, id_column):
+    """ A get_many loader: one query for every id missing from the cache."""
+    def load(ids):
+        conn = database_connect()
+        if(conn is None):
+            return None
+        cur = conn.cursor()
+        try:
+            ids = [int(i) for i in ids if str(i).isdigit()]
+            rows = dictfetchall(cur,sql,(pg_array(ids),))
+            return {str(row[id_column]): row for row in rows}
+        except:
+            print("Unexpected error getting summaries:", sys.exc_info()[0])
+            raise
+        finally:
+            cur.close()                 # Close the cursor
+            conn.close()                # Close the connection to the db
+    return load
+
+def get_song_summaries(song_ids):
+    """ {song_id: row of song_title, length and artists}, for many songs at once."""
+    return entity_cache.get_many('song_summary', song_ids,
+                                 _load_summaries(SONG_SUMMARIES_SQL, 'song_id'))
+
+def get_movie_summaries(movie_ids):
+    """ {movie_id: row of movie_title and release_year}, for many movies at once."""
+    return entity_cache.get_many('movie_summary', movie_ids,
+                                 _load_summaries(MOVIE_SUMMARIES_SQL, 'movie_id'))
+
+
 #####################################################
 #   Find all matching tvshows
 #####################################################
-def find_matchingtvshows(searchterm):
-    """
-    Get all the matching TV Shows in your media server
+
+# Word search, best matches first. Episode counts come from the ItemSummary
+# table. The to_tsvector() expression is the one indexed by
+# tvshow_title_fts_idx.
+TVSHOW_SEARCH_SQL = """with hits as (
+        select t.*, ts_rank(to_tsvector('simple', coalesce(t.tvshow_title, '')), q, 1) as rank
+        from mediaserver.tvshow t, to_tsquery('simple', %s) q
+        where to_tsvector('simple', coalesce(t.tvshow_title, '')) @@ q
+        order by rank desc, t.tvshow_id
+        limit %s offset %s)
+    select h.*, coalesce(isum.item_count, 0) as count
+    from hits h left outer join mediaserver.itemsummary isum
+        on (isum.item_type = 'tvshow' and isum.item_id = h.tvshow_id)
+    order by h.rank desc, h.tvshow_id"""
+
+# Literal search, earliest and then shortest matches first (served by
+# tvshow_title_trgm_idx when pg_trgm is installed)
+TVSHOW_SEARCH_LITERAL_SQL = """with hits as (
+        select t.*, strpos(lower(t.tvshow_title), %s) as rank
+        from mediaserver.tvshow t
+        where lower(t.tvshow_title) like %s
+        order by rank, length(t.tvshow_title), t.tvshow_id
+        limit %s offset %s)
+    select h.*, coalesce(isum.item_count, 0) as count
+    from hits h left outer join mediaserver.itemsummary isum
+        on (isum.item_type = 'tvshow' and isum.item_id = h.tvshow_id)
+    order by h.rank, length(h.tvshow_title), h.tvshow_id"""
+
+def find_matchingtvshows(searchterm, literal=False, limit=SEARCH_LIMIT, offset=0):
+    """
+    Get the TV Shows in your media server matching searchterm, best first:
+    titles with every word of searchterm as a word prefix, or with
+    literal=True titles containing searchterm as typed.
     """
 
     conn = database_connect()
@@ -1463,21 +1892,16 @@ def find_matchingtvshows(searchterm):
         return None
     cur = conn.cursor()
     try:
-        # Try executing the SQL and get from the database
-        sql = """
-            select 
-                t.*, tnew.count as count  
-            from 
-                mediaserver.tvshow t, 
-                (select 
-                    t1.tvshow_id, count(te1.media_id) as count 
-                from 
-                    mediaserver.tvshow t1 left outer join mediaserver.TVEpisode te1 on (t1.tvshow_id=te1.tvshow_id) 
-                    group by t1.tvshow_id) tnew 
-            where t.tvshow_id = tnew.tvshow_id and lower(tvshow_title) ~ lower(%s)
-            order by t.tvshow_id;"""
-
-        r = dictfetchall(cur,sql,(searchterm,))
+        limit, offset = search_page(limit, offset)
+        query = None if literal else prefix_tsquery(searchterm)
+        if query is None:
+            sql = TVSHOW_SEARCH_LITERAL_SQL
+            params = (searchterm.lower(), like_pattern(searchterm), limit, offset)
+        else:
+            sql = TVSHOW_SEARCH_SQL
+            params = (query, limit, offset)
+
+        r = dictfetchall(cur,sql,params)
         print("return val is:")
         print(r)
         cur.close()                     # Close the cursor
@@ -1496,9 +1920,25 @@ def find_matchingtvshows(searchterm):
 #   Query (10)
 #   Find all matching Movies
 #####################################################
-def find_matchingmovies(searchterm):
+
+# Word search, best matches first (movie_title_fts_idx)
+MOVIE_SEARCH_SQL = """select m.*, ts_rank(to_tsvector('simple', coalesce(m.movie_title, '')), q, 1) as rank
+    from mediaserver.movie m, to_tsquery('simple', %s) q
+    where to_tsvector('simple', coalesce(m.movie_title, '')) @@ q
+    order by rank desc, m.movie_id
+    limit %s offset %s"""
+
+# Literal search, earliest and then shortest matches first (movie_title_trgm_idx)
+MOVIE_SEARCH_LITERAL_SQL = """select m.*, strpos(lower(m.movie_title), %s) as rank
+    from mediaserver.movie m
+    where lower(m.movie_title) like %s
+    order by rank, length(m.movie_title), m.movie_id
+    limit %s offset %s"""
+
+def find_matchingmovies(searchterm, literal=False, limit=SEARCH_LIMIT, offset=0):
     """
-    Get all the matching Movies in your media server
+    Get the Movies in your media server matching searchterm, best first
+    (see find_matchingtvshows)
     """
 
     conn = database_connect()
@@ -1506,22 +1946,69 @@ def find_matchingmovies(searchterm):
         return None
     cur = conn.cursor()
     try:
-        #########
-        # TODO  #  
-        #########
+        limit, offset = search_page(limit, offset)
+        query = None if literal else prefix_tsquery(searchterm)
+        if query is None:
+            sql = MOVIE_SEARCH_LITERAL_SQL
+            params = (searchterm.lower(), like_pattern(searchterm), limit, offset)
+        else:
+            sql = MOVIE_SEARCH_SQL
+            params = (query, limit, offset)
 
-        #############################################################################
-        # Fill in the SQL below with a query to get all information about movies    #
-        # that match a given search term                                            #
-        #############################################################################
-        sql = """
-                SELECT *
-                FROM mediaserver.movie
-                WHERE LOWER(movie_title) ~ LOWER(%s)
-                ORDER BY movie_id
-        """
+        r = dictfetchall(cur,sql,params)
+        print("return val is:")
+        print(r)
+        cur.close()                     # Close the cursor
+        conn.close()                    # Close the connection to the db
+        return r
+    except:
+        # If there were any errors, return a NULL row printing an error to the debug
+        print("Unexpected error getting All Movies:", sys.exc_info()[0])
+        raise
+    cur.close()                     # Close the cursor
+    conn.close()                    # Close the connection to the db
+    return None
+
+
+
+#####################################################
+#   Search everything
+#####################################################
+
+# Kinds of item in mediaserver.SearchDocument
+SEARCH_TYPES = ['song', 'album', 'artist', 'podcast', 'podcastep',
+                'movie', 'tvshow', 'tvepisode']
+
+# One indexed query over every kind of item (searchdocument_document_idx).
+# Title words weigh more than description and genre words.
+SEARCH_SQL = """select d.item_type, d.item_id, d.title, ts_rank(d.document, q, 1) as rank
+    from mediaserver.searchdocument d, to_tsquery('simple', %s) q
+    where d.document @@ q
+      and d.item_type = any(%s::varchar[])
+    order by rank desc, d.item_type, d.item_id
+    limit %s offset %s"""
+
+def search_all(searchterm, types=None, limit=SEARCH_LIMIT, offset=0):
+    """
+    Search songs, albums, artists, podcasts, podcast episodes, movies,
+    TV shows and TV episodes at once, by title, description and genre.
+    Returns rows of item_type, item_id, title and rank, best first.
+    types limits the search to some kinds of item (see SEARCH_TYPES).
+    """
+
+    query = prefix_tsquery(searchterm)
+    if query is None:
+        return []
+    conn = database_connect()
+    if(conn is None):
+        return None
+    cur = conn.cursor()
+    try:
+        limit, offset = search_page(limit, offset)
+        types = [t for t in (types or SEARCH_TYPES) if t in SEARCH_TYPES]
+        sql = SEARCH_SQL
 
-        r = dictfetchall(cur,sql,(searchterm,))
+        r = dictfetchall(cur,sql,(query, pg_array(types), limit, offset))
         print("return val is:")
         print(r)
         cur.close()                     # Close the cursor
@@ -1529,13 +2016,89 @@ def find_matchingmovies(searchterm):
         return r
     except:
         # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All TV Shows:", sys.exc_info()[0])
+        print("Unexpected error searching:", sys.exc_info()[0])
         raise
     cur.close()                     # Close the cursor
     conn.close()                    # Close the connection to the db
     return None
 
 
+#####################################################
+#   Autocomplete
+#####################################################
+
+# Titles of every kind of item, for suggestions as you type. Items added
+# by this process are indexed at once; a write in another process bumps
+# the catalogue generation, and the index is then built again.
+title_index = autocomplete.TitleIndex()
+_title_index_lock = threading.Lock()
+_title_index_generation = None          # catalogue generation it was built from
+_title_index_rebuild = None             # thread rebuilding it, if any
+_title_index_checked = 0                # unix time a rebuild was last started
+TITLE_INDEX_REBUILD = read_config()['CACHE'].getfloat('title_index_rebuild', 10)
+
+TITLE_INDEX_SQL = """select item_type, item_id, title
+    from mediaserver.searchdocument
+    where title is not null"""
+
+def load_title_index():
+    """
+    Builds the autocomplete index from the search documents with one query.
+    Returns False (leaving the index as it was) if they cannot be read.
+    """
+    global _title_index_generation
+    # Read first: a write while the query runs leaves the index a
+    # generation behind, so it is built again
+    generation = page_cache.generation('catalogue')
+    conn = database_connect()
+    if(conn is None):
+        return False
+    cur = conn.cursor()
+    try:
+        cur.execute(TITLE_INDEX_SQL)
+        title_index.build(cur.fetchall())
+        _title_index_generation = generation
+        print("Autocomplete index built:", title_index.stats())
+        return True
+    except Exception as e:
+        print("Autocomplete index not built:", e)
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+def autocomplete_titles(prefix, limit=10, types=None):
+    """
+    Suggestions for prefix as rows of item_type, item_id and title. The
+    index is built on first use if it was not built at startup.
+    """
+    if title_index.built is None:
+        with _title_index_lock:
+            if title_index.built is None:
+                load_title_index()
+    else:
+        refresh_title_index()
+    return title_index.lookup(prefix, limit=limit, types=types)
+
+def refresh_title_index():
+    """
+    Rebuilds the autocomplete index in a background thread if the
+    catalogue changed since it was built, at most once every [CACHE]
+    title_index_rebuild seconds. Lookups use the old index meanwhile.
+    """
+    global _title_index_rebuild, _title_index_checked
+    if page_cache.generation('catalogue') == _title_index_generation:
+        return
+    with _title_index_lock:
+        if (_title_index_rebuild is not None and _title_index_rebuild.is_alive()) \
+                or time.time() - _title_index_checked < TITLE_INDEX_REBUILD:
+            return
+        _title_index_checked = time.time()
+        _title_index_rebuild = threading.Thread(target=load_title_index,
+                                                name='title-index-rebuild')
+        _title_index_rebuild.daemon = True
+        _title_index_rebuild.start()
+
 
 #####################################################
 #   Add a new Movie
@@ -1559,6 +2122,8 @@ def add_movie_to_db(title,release_year,description,storage_location,genre):
         cur.execute(sql,(storage_location,description,title,release_year,genre))
         conn.commit()                   # Commit the transaction
         r = cur.fetchone()
+        page_cache.bump('movies')
+        title_index.add('movie', r[0], title)
         print("return val is:")
         print(r)
         cur.close()                     # Close the cursor
@@ -1604,6 +2169,8 @@ def add_song_to_db(storage_location, description, title, length, genre, artist_i
                           title, length, genre, artist_id))
         conn.commit()                   # Commit the transaction
         r = cur.fetchone()
+        page_cache.bump('songs')
+        title_index.add('song', r[0], title)
         print("return val is:")
         print(r)
         cur.close()                     # Close the cursor
@@ -1682,28 +2249,318 @@ def get_last_movie():
     conn.close()                    # Close the connection to the db
     return None
 
+#####################################################
+#   Media files
+#   /stream/<media_id> serves the file a media item's
+#   storage_location names, under the [MEDIA] root.
+#####################################################
+
+MEDIA_LOCATION_SQL = """SELECT storage_location FROM mediaserver.mediaItem WHERE media_id = %s"""
+
+def media_root():
+    return os.path.realpath(read_config()['MEDIA'].get('root', 'media'))
+
+def resolve_media_path(storage_location, root=None):
+    """
+    The file storage_location names: a path under the media root (a
+    leading / is ignored). None if it leads outside the root.
+    """
+    root = media_root() if root is None else root
+    path = os.path.realpath(os.path.join(root, storage_location.lstrip('/\\')))
+    if not path.startswith(root.rstrip(os.sep) + os.sep):
+        return None
+    return path
+
+def load_media_path(media_id):
+    """
+    The file of a media item, '' if the item does not exist or its
+    storage_location is outside the media root.
+    """
+    conn = database_connect()
+    if(conn is None):
+        return None
+    cur = conn.cursor()
+    try:
+        r = dictfetchall(cur, MEDIA_LOCATION_SQL, (media_id,))
+        cur.close()                     # Close the cursor
+        conn.close()                    # Close the connection to the db
+        if not r:
+            return ''
+        return resolve_media_path(r[0]['storage_location']) or ''
+    except:
+        # If there were any errors, return a NULL row printing an error to the debug
+        print("Unexpected error getting a media item's location:", sys.exc_info()[0])
+        raise
+
+def get_media_path(media_id):
+    """ The file of a media item (see load_media_path), resolved once and cached."""
+    return entity_cache.get('media_path', media_id, load_media_path)
+
 #####################################################
 #   Helper function for new functionality
 #####################################################
 
-def get_rating_info(entry, apikey):
+#####################################################
+#   OMDb ratings enrichment (see enrichment.py)
+#####################################################
+
+_omdb_client = None
+_enrichment_job = None
+_enrichment_queue = {}          # movie_id -> movie, for the job after the running one
+_enrichment_lock = threading.Lock()
+_enrichment_retry_at = 0        # when to try for the enrichment lock again
+_enrichment_backoff_until = 0   # no jobs before this, OMDb's daily limit was hit
+_enrichment_claim = None        # lock connection kept while backing off
+
+# Only one process (of all the server.py workers) fetches ratings at a time:
+# the one holding this advisory lock, on a connection of its own that stays
+# open while its job runs. Closing the connection lets the lock go.
+ENRICHMENT_LOCK_ID = 2121
+# Seconds a process that found the lock taken waits before trying again
+ENRICHMENT_CLAIM_RETRY = 10
+
+# Movies with no ratings, or ratings last updated more than %s days ago,
+# at most %s of them. Finds them in one query whatever process scanned
+# them last (movieratings_last_updated_idx serves the freshness test).
+STALE_MOVIES_SQL = """select m.movie_id, m.movie_title, m.release_year
+    from mediaserver.movie m
+    where not exists (select 1 from mediaserver.movieratings r
+                      where r.movie_id = m.movie_id
+                        and r.last_updated >= current_date - %s::int)
+    order by m.movie_id
+    limit %s"""
+
+# The same for one movie
+STALE_MOVIE_SQL = """select m.movie_id, m.movie_title, m.release_year
+    from mediaserver.movie m
+    where m.movie_id = %s
+      and not exists (select 1 from mediaserver.movieratings r
+                      where r.movie_id = m.movie_id
+                        and r.last_updated >= current_date - %s::int)"""
+
+# Which of the given movies are still stale, once the lock is held: another
+# process may have fetched them while this one was queueing them
+STALE_OF_MOVIES_SQL = """select m.movie_id, m.movie_title, m.release_year
+    from mediaserver.movie m
+    where m.movie_id = any(%s::int[])
+      and not exists (select 1 from mediaserver.movieratings r
+                      where r.movie_id = m.movie_id
+                        and r.last_updated >= current_date - %s::int)
+    order by m.movie_id"""
+
+def ratings_ttl_days():
+    """ Days movie ratings stay fresh ([OMDB] ttl_days, default 7)."""
+    return read_config()['OMDB'].getint('ttl_days', 7)
+
+def ratings_limit_backoff():
+    """ Seconds without jobs once OMDb's daily limit is hit ([OMDB] limit_backoff)."""
+    return read_config()['OMDB'].getfloat('limit_backoff', 3600)
+
+def ratings_max_refresh():
+    """ Most movies one enrichment job refreshes ([OMDB] max_refresh)."""
+    return read_config()['OMDB'].getint('max_refresh', 1000)
+
+def omdb_client():
+    """
+    The shared OMDb client, set up from the [OMDB] section of config.ini.
+    """
+    global _omdb_client
+    with _enrichment_lock:
+        if _omdb_client is None:
+            omdb_config = read_config()['OMDB']
+            _omdb_client = enrichment.OmdbClient(
+                omdb_config.get('base_url', 'http://www.omdbapi.com/'),
+                omdb_config.get('apikey', '6d184c23'), # MIGHT NEED NEW APIKEY AT SOME STAGE
+                timeout=omdb_config.getfloat('timeout', 10),
+                retries=omdb_config.getint('retries', 3),
+                backoff=omdb_config.getfloat('backoff', 0.5),
+                pool_size=omdb_config.getint('workers', 8))
+        return _omdb_client
+
+def claim_ratings_enrichment(movies):
+    """
+    Takes the enrichment lock on a new connection. Returns the connection
+    and which of movies are still stale, or (None, None) if another process
+    holds the lock or the database cannot be reached.
+    """
+    try:
+        conn = open_connection()
+    except (pg8000.OperationalError, pg8000.InterfaceError) as operation_error:
+        print("Error connecting to claim the ratings enrichment:", operation_error)
+        return None, None
+    try:
+        cur = conn.cursor()
+        cur.execute("select pg_try_advisory_lock(%s)", (ENRICHMENT_LOCK_ID,))
+        if not cur.fetchone()[0]:
+            conn.close()
+            return None, None
+        stale = dictfetchall(cur,STALE_OF_MOVIES_SQL,
+                             (pg_array([m['movie_id'] for m in movies]), ratings_ttl_days()))
+        conn.commit()               # The lock outlives the transaction
+        cur.close()
+        return conn, stale
+    except:
+        print("Unexpected error claiming the ratings enrichment:", sys.exc_info()[0])
+        conn.close()
+        raise
+
+def release_ratings_enrichment(conn):
+    """ Lets the enrichment lock go by closing the connection holding it."""
+    try:
+        conn.close()
+    except (pg8000.OperationalError, pg8000.InterfaceError):
+        pass                        # The lock went with the connection anyway
+
+def finish_ratings_enrichment(job, conn):
+    """
+    Lets the enrichment lock go and starts the job for the queued movies.
+    If the job hit OMDb's daily limit, backs off instead, keeping the lock
+    so the other processes do not ask OMDb either.
+    """
+    global _enrichment_backoff_until, _enrichment_claim
+    if job.limit_reached:
+        with _enrichment_lock:
+            _enrichment_backoff_until = time.time() + ratings_limit_backoff()
+            _enrichment_claim = conn
+        return
+    release_ratings_enrichment(conn)
+    start_ratings_enrichment([])
+
+def start_ratings_enrichment(movies):
+    """
+    Starts a background job fetching the OMDb ratings of movies. If one is
+    already running, the movies it does not have are queued for the job
+    started when it finishes. A job only starts in the process holding the
+    enrichment lock; the others keep their queue and try again after
+    ENRICHMENT_CLAIM_RETRY seconds. Nothing starts while backing off from
+    OMDb's daily limit. Returns the running job.
+    """
+    global _enrichment_job, _enrichment_retry_at, _enrichment_claim
+    client = omdb_client()
+    with _enrichment_lock:
+        running = _enrichment_job is not None and _enrichment_job.running
+        for movie in movies:
+            if not (running and movie['movie_id'] in _enrichment_job.movie_ids):
+                _enrichment_queue[movie['movie_id']] = movie
+        if running or not _enrichment_queue or time.time() < _enrichment_retry_at:
+            return _enrichment_job
+        if time.time() < _enrichment_backoff_until:
+            return _enrichment_job
+        if _enrichment_claim is not None:
+            # Backed off long enough, the lock is claimed again below
+            release_ratings_enrichment(_enrichment_claim)
+            _enrichment_claim = None
+        claim, stale = claim_ratings_enrichment(list(_enrichment_queue.values()))
+        if claim is None:
+            _enrichment_retry_at = time.time() + ENRICHMENT_CLAIM_RETRY
+            return _enrichment_job
+        _enrichment_queue.clear()
+        if not stale:
+            release_ratings_enrichment(claim)
+            return _enrichment_job
+        omdb_config = read_config()['OMDB']
+        rate = omdb_config.getfloat('rate', 10)
+        _enrichment_job = enrichment.EnrichmentJob(
+            stale, client, store_movie_ratings,
+            workers=omdb_config.getint('workers', 8),
+            limiter=enrichment.TokenBucket(rate, omdb_config.getfloat('burst', rate)),
+            batch_size=omdb_config.getint('batch_size', 100),
+            on_finished=lambda job: finish_ratings_enrichment(job, claim))
+        # Counted as running before the thread gets going, so a second page
+        # load does not start another job
+        _enrichment_job.started = time.time()
+        return _enrichment_job.start()
+
+def enrichment_progress():
+    """ Progress of the last enrichment job, None if there was none."""
+    if _enrichment_job is None:
+        return None
+    return _enrichment_job.progress()
+
+# One statement upserting a whole batch of ratings: each column is sent as
+# an array and unnest() turns them back into rows. Counts the movies whose
+# ratings are new or differ from the stored ones (old is read from the
+# snapshot the statement started with, before the upsert).
+MOVIE_RATINGS_UPSERT_SQL = """WITH r AS (
+        SELECT * FROM unnest(%s::int[], %s::numeric[], %s::int[], %s::numeric[], %s::boolean[], %s::boolean[])
+            AS r(movie_id, imdb_score, imdb_votes, rt_score, top100, top250)),
+    old AS (
+        SELECT o.* FROM mediaserver.MovieRatings o JOIN r USING (movie_id)),
+    stored AS (
+        INSERT INTO mediaserver.MovieRatings
+            (movie_id, imdb_score, imdb_votes, rt_score, top100, top250, last_updated)
+        SELECT movie_id, imdb_score, imdb_votes, rt_score, top100, top250, current_date
+        FROM r
+        ON CONFLICT (movie_id) DO UPDATE
+            SET imdb_score = excluded.imdb_score,
+                imdb_votes = excluded.imdb_votes,
+                rt_score = excluded.rt_score,
+                top100 = excluded.top100,
+                top250 = excluded.top250,
+                last_updated = excluded.last_updated
+        RETURNING movie_id, imdb_score, imdb_votes, rt_score, top100, top250)
+    SELECT count(*)
+    FROM stored LEFT JOIN old USING (movie_id)
+    WHERE old.movie_id IS NULL
+       OR (stored.imdb_score, stored.imdb_votes, stored.rt_score, stored.top100, stored.top250)
+          IS DISTINCT FROM (old.imdb_score, old.imdb_votes, old.rt_score, old.top100, old.top250)"""
+
+def upsert_movie_ratings(cur, ratings):
+    """
+    Inserts or updates many MovieRatings rows with one statement, setting
+    last_updated to today. ratings are (movie_id, imdb_score, imdb_votes,
+    rt_score, top100, top250) tuples. Does not commit. Returns how many
+    movies' ratings changed.
+    """
+    # A movie may only appear once per statement, the last result wins
+    latest = {}
+    for rating in ratings:
+        latest[rating[0]] = rating
+    if not latest:
+        return 0
+    columns = zip(*latest.values())
+    cur.execute(MOVIE_RATINGS_UPSERT_SQL, tuple(pg_array(c) for c in columns))
+    return cur.fetchone()[0]
+
+def store_movie_ratings(results):
+    """
+    Saves a batch of (movie, (imdb_score, imdb_votes, rt_score)) results
+    from an enrichment job, with the movie's IMDb chart flags, in one
+    statement and one commit.
+    """
+    conn = database_connect()
+    if(conn is None):
+        raise pg8000.InterfaceError("no database connection to store ratings")
+    cur = conn.cursor()
+    try:
+        ratings = []
+        for entry, (imdb_score, imdb_votes, rt_score) in results:
+            in_top100 = get_in_top100(entry['movie_title'])
+            in_top250 = get_in_top250(entry['movie_title'])
+            ratings.append((entry['movie_id'], imdb_score, imdb_votes, rt_score, in_top100, in_top250))
+        changed = upsert_movie_ratings(cur, ratings)
+        conn.commit()
+        if changed:
+            page_cache.bump('movies')   # movies are listed once they have ratings
+    except:
+        print("Unexpected error storing movie ratings:", sys.exc_info()[0])
+        raise
+    finally:
+        cur.close()                     # Close the cursor
+        conn.close()                    # Close the connection to the db
 
-    title_no_spaces = entry['movie_title'].replace(' ', '+')
-    year = entry['release_year']
-    response = requests.get("http://www.omdbapi.com/?t={}&y={}&apikey={}".format(title_no_spaces, year, apikey))
-    return response.json()
+def get_rating_info(entry, apikey=None):
+    """ The OMDb record of one movie (row with movie_title and release_year)."""
+    client = omdb_client()
+    if apikey is not None and apikey != client.apikey:
+        client = enrichment.OmdbClient(client.base_url, apikey, client.timeout)
+    return client.get(entry['movie_title'], entry['release_year'])
 
 def get_in_top250(title):
-    if top250_dict.get(title) == None:
-        return False
-    else:
-        return True
+    return imdb_charts.contains('top250', title)
 
 def get_in_top100(title):
-    if top100_dict.get(title) == None:
-        return False
-    else:
-        return True
+    return imdb_charts.contains('top100', title)
 
 #  FOR MARKING PURPOSES ONLY
 #  DO NOT CHANGE
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+MediaServer Database connection pool.
+Keeps a bounded set of open pg8000 connections that the query functions in
+database.py borrow and hand back, instead of opening a new connection (and
+re-running the startup/auth handshake) for every query.
+"""
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from modules import pg8000
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the checkout timeout."""
+    pass
+
+
+class StatementRegistry(object):
+    """
+    The set of statements (SQL text + parameter types) every pooled
+    connection should have prepared. It learns statements from connections
+    as they are returned to the pool and prepares them on the other
+    connections when they are checked out, so each physical connection
+    parses a statement once rather than once per request.
+
+    The registry keeps the `max_statements` most recently used statements
+    and caps every connection at the same number of prepared statements,
+    so statements that fall out of use are closed on the server. A
+    statement that cannot be prepared ahead of time (eg. pg8000 cannot
+    with date or list parameters) is remembered and never learned again.
+    """
+
+    def __init__(self, max_statements=100):
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._statements = OrderedDict()
+        self._unpreparable = set()
+        self._version = 0
+        self._warmed = weakref.WeakKeyDictionary()
+
+    def register(self, sql, param_types=()):
+        """ Adds a statement to the set that is prepared on every connection."""
+        key = (sql, tuple(param_types))
+        with self._lock:
+            if key in self._unpreparable:
+                return
+            if key in self._statements:
+                self._statements.move_to_end(key)
+                return
+            self._statements[key] = True
+            while len(self._statements) > self.max_statements:
+                self._statements.popitem(last=False)
+            self._version += 1
+
+    def forget(self, sql, param_types=(), unpreparable=False):
+        key = (sql, tuple(param_types))
+        with self._lock:
+            if unpreparable:
+                self._unpreparable.add(key)
+            if self._statements.pop(key, None):
+                self._version += 1
+
+    def learn(self, conn):
+        """ Registers every statement currently prepared on `conn`."""
+        for sql, param_types in conn.prepared_statements():
+            self.register(sql, param_types)
+
+    def warm(self, conn):
+        """ Prepares any registered statement `conn` does not have yet."""
+        conn.max_prepared_statements = self.max_statements
+        with self._lock:
+            if self._warmed.get(conn) == self._version:
+                return
+            version = self._version
+            statements = list(self._statements)
+        for sql, param_types in statements:
+            try:
+                conn.prepare_statement(sql, param_types)
+            except pg8000.NotSupportedError:
+                self.forget(sql, param_types, unpreparable=True)
+            except pg8000.ProgrammingError:
+                # The statement no longer parses (eg. the schema changed)
+                self.forget(sql, param_types, unpreparable=True)
+        self._warmed[conn] = version
+
+    def __len__(self):
+        return len(self._statements)
+
+
+class PooledConnection(object):
+    """
+    Thin wrapper around a pg8000 connection that has been checked out of a
+    ConnectionPool. Behaves like the connection itself, except that close()
+    hands the connection back to the pool instead of closing the socket.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        # If the borrower forgets to call close() (for example when an
+        # exception escapes a query function) the connection still finds its
+        # way back to the pool once the wrapper is garbage collected.
+        self._finalizer = weakref.finalize(self, pool.putconn, conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def close(self):
+        """ Returns the connection to the pool. Safe to call twice."""
+        self._finalizer()
+
+    def discard(self):
+        """ Closes the underlying connection instead of reusing it."""
+        if self._finalizer.detach() is not None:
+            self._pool.putconn(self._conn, discard=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe, bounded pool of pg8000 connections.
+
+        - min_size: connections kept open even when idle
+        - max_size: hard limit on open connections (idle + in use)
+        - idle_timeout: seconds an idle connection above min_size may linger
+        - checkout_timeout: seconds getconn() waits for a free connection
+        - health_check_interval: connections idle for longer than this are
+          pinged with SELECT 1 before being handed out
+        - registry: optional StatementRegistry used to prepare the known
+          statements on every connection at checkout
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, idle_timeout=300,
+                 checkout_timeout=10, health_check_interval=30, registry=None):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("pool size must satisfy 0 <= min_size <= max_size, max_size >= 1")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.registry = registry
+
+        self._lock = threading.Condition()
+        self._idle = []             # [(connection, time it was returned)]
+        self._in_use = set()
+        self._opening = 0           # connections being opened right now
+        self._closed = False
+
+        self._stats = {
+            'created': 0,
+            'discarded': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+        # Protocol counters of connections that have been closed
+        self._retired = {'parse_count': 0, 'bind_count': 0,
+                         'close_statement_count': 0}
+
+    #####################################################
+    #   Checkout / return
+    #####################################################
+
+    def getconn(self, timeout=None):
+        """
+        Borrow a connection from the pool. Waits up to `timeout` seconds
+        (default: checkout_timeout) if all max_size connections are in use.
+        """
+        if timeout is None:
+            timeout = self.checkout_timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            # Closing can block on the network, so not under the lock
+            for reaped in self._reap_idle():
+                self._close_quietly(reaped)
+            with self._lock:
+                if self._closed:
+                    raise PoolTimeout("connection pool is closed")
+                conn = None
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    self._in_use.add(conn)
+                elif self._size() < self.max_size:
+                    self._opening += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            "no database connection free after %.1fs" % timeout)
+                    waited = True
+                    self._lock.wait(remaining)
+                    continue
+
+            if conn is None:
+                # Open the new connection outside the lock, a handshake can
+                # take a while.
+                try:
+                    conn = self._connect()
+                finally:
+                    with self._lock:
+                        self._opening -= 1
+                        if conn is not None:
+                            self._in_use.add(conn)
+                            self._stats['created'] += 1
+                        else:
+                            self._lock.notify()
+            elif time.time() - returned_at > self.health_check_interval \
+                    and not self._healthy(conn):
+                self.putconn(conn, discard=True)
+                continue
+
+            if self.registry is not None:
+                try:
+                    self.registry.warm(conn)
+                except Exception:
+                    self.putconn(conn, discard=True)
+                    raise
+
+            self._record_checkout(time.monotonic() - started, waited)
+            return PooledConnection(self, conn)
+
+    def putconn(self, conn, discard=False):
+        """
+        Hand a raw connection back to the pool. Any open transaction is
+        rolled back so the next borrower starts from a clean state.
+        """
+        if not discard and conn._sock is not None:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                if self.registry is not None:
+                    self.registry.learn(conn)
+            except Exception:
+                discard = True
+        else:
+            discard = True
+
+        with self._lock:
+            self._in_use.discard(conn)
+            if discard or self._closed:
+                self._stats['discarded'] += 1
+                self._retire(conn)
+            else:
+                self._idle.append((conn, time.time()))
+                conn = None
+            self._lock.notify()
+
+        if conn is not None:
+            self._close_quietly(conn)
+
+    #####################################################
+    #   Maintenance
+    #####################################################
+
+    def fill(self):
+        """ Opens connections until min_size are available."""
+        while True:
+            with self._lock:
+                if self._size() >= self.min_size:
+                    return
+                self._opening += 1
+            conn = None
+            try:
+                conn = self._connect()
+            finally:
+                with self._lock:
+                    self._opening -= 1
+                    if conn is not None:
+                        self._idle.append((conn, time.time()))
+                        self._stats['created'] += 1
+                        self._lock.notify()
+
+    def closeall(self):
+        """ Closes every idle connection and refuses further checkouts."""
+        with self._lock:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle = []
+            self._lock.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """ Snapshot of the pool usage counters."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_use'] = len(self._in_use)
+            stats['idle'] = len(self._idle)
+            stats['size'] = self._size()
+            stats['max_size'] = self.max_size
+            # Parse vs Bind shows how many statement round trips were saved
+            stats.update(self._retired)
+            for conn in [c for c, _ in self._idle] + list(self._in_use):
+                for counter in self._retired:
+                    stats[counter] += getattr(conn, counter, 0)
+        if self.registry is not None:
+            stats['registered_statements'] = len(self.registry)
+        stats['wait_time_avg'] = (stats['wait_time_total'] / stats['waits']
+                                  if stats['waits'] else 0.0)
+        return stats
+
+    #####################################################
+    #   Internals (call with self._lock held where noted)
+    #####################################################
+
+    def _size(self):
+        # lock held
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _reap_idle(self):
+        # Drops idle connections past idle_timeout, oldest first, while
+        # keeping at least min_size connections open. Returns them for the
+        # caller to close once the lock is released.
+        reaped = []
+        with self._lock:
+            now = time.time()
+            self._idle.sort(key=lambda item: item[1])
+            while self._idle and self._size() > self.min_size \
+                    and now - self._idle[0][1] > self.idle_timeout:
+                conn, _ = self._idle.pop(0)
+                self._stats['discarded'] += 1
+                self._retire(conn)
+                reaped.append(conn)
+        return reaped
+
+    def _retire(self, conn):
+        # lock held
+        for counter in self._retired:
+            self._retired[counter] += getattr(conn, counter, 0)
+
+    def _record_checkout(self, wait_time, waited):
+        with self._lock:
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += wait_time
+                self._stats['wait_time_max'] = max(
+                    self._stats['wait_time_max'], wait_time)
+
+    @staticmethod
+    def _healthy(conn):
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchall()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
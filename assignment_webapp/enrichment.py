@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+MediaServer movie ratings enrichment.
+Fetches the IMDb / Rotten Tomatoes ratings of many movies from OMDb at once:
+a bounded thread pool shares one keep-alive HTTP session, a token bucket
+keeps the request rate under the API limit and failed requests are retried
+with exponential backoff. A job runs in a background thread, hands its
+results to a store function in batches and reports its progress.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class OmdbError(Exception):
+    """Raised when OMDb gives an error that retrying will not fix."""
+    pass
+
+
+class OmdbLimitError(OmdbError):
+    """Raised when the API key has used up its daily requests."""
+    pass
+
+
+class _Retry(Exception):
+    pass
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket: acquire() returns at most `rate` times per
+    second on average, allowing bursts of up to `burst` calls.
+    A rate of 0 means no limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class OmdbClient(object):
+    """
+    OMDb API client. One requests.Session (and its connection pool) is
+    shared by every thread, so connections to OMDb are kept alive.
+
+        - base_url: OMDb endpoint, point it at a local stand-in for testing
+        - retries: extra attempts after a timeout, connection error,
+          HTTP 429 or 5xx
+        - backoff: first retry delay in seconds, doubled on every retry
+    """
+
+    def __init__(self, base_url, apikey, timeout=10, retries=3, backoff=0.5,
+                 pool_size=10):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self._requests = requests
+        self.base_url = base_url
+        self.apikey = apikey
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, title, year):
+        """ The OMDb record of a movie as a dict."""
+        params = {'t': title, 'y': year, 'apikey': self.apikey}
+        attempt = 0
+        while True:
+            try:
+                return self._get(params)
+            except (self._requests.ConnectionError, self._requests.Timeout,
+                    _Retry) as e:
+                if attempt >= self.retries:
+                    raise OmdbError("giving up on %r after %d attempts: %s"
+                                    % (title, attempt + 1, e))
+            # Exponential backoff with jitter, so throttled workers do not
+            # all come back at the same moment
+            time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+
+    def _get(self, params):
+        response = self.session.get(self.base_url, params=params,
+                                    timeout=self.timeout)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise _Retry("HTTP %d" % response.status_code)
+        if response.status_code != 200:
+            raise OmdbError("HTTP %d from OMDb" % response.status_code)
+        try:
+            movie_info = response.json()
+        except ValueError:
+            raise _Retry("response is not JSON")
+        if movie_info.get('Error') == 'Request limit reached!':
+            raise OmdbLimitError(movie_info['Error'])
+        return movie_info
+
+    def close(self):
+        self.session.close()
+
+
+def parse_ratings(movie_info):
+    """
+    (imdb_score, imdb_votes, rt_score) from an OMDb record, None for any
+    rating it does not have.
+    """
+    try:
+        imdb_score = float(movie_info['imdbRating'])
+    except (KeyError, TypeError, ValueError):
+        imdb_score = None
+    try:
+        imdb_votes = int(movie_info['imdbVotes'].replace(",", ""))
+    except (KeyError, AttributeError, ValueError):
+        imdb_votes = None
+
+    ratings = movie_info.get('Ratings') or []
+    rt_value = None
+    for rating in ratings:
+        if rating.get('Source') == 'Rotten Tomatoes':
+            rt_value = rating.get('Value')
+    if rt_value is None and len(ratings) > 1 and 'Source' not in ratings[1]:
+        rt_value = ratings[1].get('Value')
+    try:
+        rt_score = float(rt_value.strip("%"))
+    except (AttributeError, ValueError):
+        rt_score = None
+    return imdb_score, imdb_votes, rt_score
+
+
+class EnrichmentJob(object):
+    """
+    Fetches the ratings of `movies` (rows with movie_id, movie_title and
+    release_year) and passes them to store() in batches, as a list of
+    (movie, (imdb_score, imdb_votes, rt_score)) pairs.
+    Call start() to run it in a background thread, or run() to block.
+    on_finished(job), if given, is called once it has finished; the job
+    stops early, with limit_reached set, when OMDb says the daily limit is
+    used up.
+    """
+
+    def __init__(self, movies, client, store, workers=8, limiter=None,
+                 batch_size=100, on_finished=None):
+        self.movies = list(movies)
+        self.movie_ids = set(movie['movie_id'] for movie in self.movies)
+        self.client = client
+        self.store = store
+        self.workers = workers
+        self.limiter = limiter or TokenBucket(0)
+        self.batch_size = batch_size
+        self.on_finished = on_finished
+
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._thread = None
+        self.started = None
+        self.finished = None
+        self.fetched = 0
+        self.failed = 0
+        self.stored = 0
+        self.limit_reached = False
+        self.errors = []                # last few error messages
+
+    #####################################################
+    #   Running
+    #####################################################
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='omdb-enrichment')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def run(self):
+        self.started = time.time()
+        pending = []
+        try:
+            with ThreadPoolExecutor(self.workers) as executor:
+                futures = [executor.submit(self._fetch, movie)
+                           for movie in self.movies]
+                try:
+                    for future in as_completed(futures):
+                        result = future.result()
+                        if result is None:
+                            continue
+                        pending.append(result)
+                        if len(pending) >= self.batch_size:
+                            self._store(pending)
+                            pending = []
+                except BaseException:
+                    # Leaving the block waits for the fetches: only for
+                    # the ones already running, not the whole queue
+                    self.cancel()
+                    for future in futures:
+                        future.cancel()
+                    raise
+            if pending:
+                self._store(pending)
+        except Exception as e:
+            self._error(e)
+            raise
+        finally:
+            self.finished = time.time()
+            if self.on_finished is not None:
+                self.on_finished(self)
+
+    def _fetch(self, movie):
+        if self._cancelled.is_set():
+            return None
+        self.limiter.acquire()
+        try:
+            movie_info = self.client.get(movie['movie_title'], movie['release_year'])
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            self._error(e)
+            if isinstance(e, OmdbLimitError):
+                # No point in asking again today
+                self.limit_reached = True
+                self.cancel()
+            return None
+        with self._lock:
+            self.fetched += 1
+        return movie, parse_ratings(movie_info)
+
+    def _store(self, results):
+        self.store(results)
+        with self._lock:
+            self.stored += len(results)
+
+    def _error(self, error):
+        with self._lock:
+            self.errors = (self.errors + [str(error)])[-5:]
+        print("OMDb enrichment error:", error)
+
+    def cancel(self):
+        """ Skips the movies that have not been requested yet."""
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self.started is not None and self.finished is None
+
+    #####################################################
+    #   Progress
+    #####################################################
+
+    def progress(self):
+        """ Counters, throughput (movies/s) and estimated seconds left."""
+        with self._lock:
+            done = self.fetched + self.failed
+            progress = {
+                'total': len(self.movies),
+                'fetched': self.fetched,
+                'failed': self.failed,
+                'stored': self.stored,
+                'running': self.running,
+                'cancelled': self._cancelled.is_set(),
+                'limit_reached': self.limit_reached,
+                'errors': list(self.errors),
+            }
+        if self.started is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.finished or time.time()) - self.started
+        progress['elapsed'] = elapsed
+        progress['throughput'] = done / elapsed if elapsed > 0 else 0.0
+        if progress['running'] and progress['throughput'] > 0:
+            progress['eta'] = (len(self.movies) - done) / progress['throughput']
+        else:
+            progress['eta'] = None
+        return progress
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+MediaServer entity cache.
+A bounded, in-process, read-through cache of the data behind single item
+pages, keyed by (kind, id). Entries leave the cache when they are the least
+recently used one and the cache is full, when they are older than the TTL,
+when they are invalidated, or when the parts of the catalogue they were
+built from change generation (see pagecache.py), which other processes see
+as well.
+"""
+
+import collections
+import threading
+import time
+
+
+class EntityCache(object):
+    """
+    LRU + TTL cache of assembled entities.
+
+        - max_entries: entries kept at most (0 turns the cache off)
+        - ttl: seconds an entry is used for at most
+        - depends: kind -> names of the catalogue parts it is built from
+        - generation: function giving the current generation of a part
+    """
+
+    def __init__(self, max_entries=1000, ttl=60, depends=None, generation=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.depends = dict(depends or {})
+        self.generation = generation
+        self._entries = collections.OrderedDict()   # (kind, id) -> (expires, generations, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def _generations(self, kind):
+        if self.generation is None:
+            return ()
+        return tuple(self.generation(part) for part in self.depends.get(kind, ()))
+
+    #####################################################
+    #   Lookups
+    #####################################################
+
+    def lookup(self, kind, key, generations=None):
+        """ (True, value) if (kind, key) is cached and current, else (False, None)."""
+        if generations is None:
+            generations = self._generations(kind)
+        key = (kind, str(key))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, entry_generations, value = entry
+                if expires > now and entry_generations == generations:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.stale += 1
+            self.misses += 1
+        return False, None
+
+    def get(self, kind, key, load):
+        """
+        The value of (kind, key), calling load(key) on a miss. A None from
+        load (a failed query) is returned but not cached.
+        """
+        generations = self._generations(kind)
+        found, value = self.lookup(kind, key, generations)
+        if found:
+            return value
+        value = load(key)
+        if value is not None:
+            self.put(kind, key, value, generations)
+        return value
+
+    def get_many(self, kind, keys, load_many):
+        """
+        {key: value} for every key found, calling load_many(missing keys)
+        once for all the misses. load_many returns a {key: value} dict.
+        Keys are compared as strings.
+        """
+        generations = self._generations(kind)
+        values, missing = {}, []
+        for key in keys:
+            found, value = self.lookup(kind, key, generations)
+            if found:
+                values[str(key)] = value
+            elif str(key) not in missing:
+                missing.append(str(key))
+        if missing:
+            loaded = load_many(missing) or {}
+            for key, value in loaded.items():
+                self.put(kind, key, value, generations)
+                values[str(key)] = value
+        return values
+
+    #####################################################
+    #   Updates
+    #####################################################
+
+    def put(self, kind, key, value, generations=None):
+        if self.max_entries <= 0:
+            return
+        if generations is None:
+            generations = self._generations(kind)
+        with self._lock:
+            self._entries[(kind, str(key))] = (time.time() + self.ttl, generations, value)
+            self._entries.move_to_end((kind, str(key)))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, kind, key=None):
+        """ Drops (kind, key), or every entry of kind if key is None."""
+        with self._lock:
+            if key is not None:
+                self._entries.pop((kind, str(key)), None)
+                return
+            for cached in [k for k in self._entries if k[0] == kind]:
+                del self._entries[cached]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'stale': self.stale,
+            }
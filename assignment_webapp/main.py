@@ -1,5 +1,7 @@
+import os
 from modules import *
 from routes import *
+import database
 
 # Starting the python applicaiton
 if __name__ == '__main__':
@@ -11,5 +13,16 @@ if __name__ == '__main__':
              Please open your browser to:
              http://127.0.0.1:{}""".format(PORT_NUMBER))
     print("-"*70)
+    DEBUG = True
+
+    # Keep the IMDb charts up to date in the background and build the
+    # autocomplete index. With the debug reloader only the child process
+    # (the one serving requests) does it.
+    if not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        database.imdb_charts.start()
+        database.load_title_index()
+
     # Note, you're going to have to change the PORT number
-    app.run(debug=True, host='0.0.0.0', port=PORT_NUMBER)
+    # Each request runs in its own thread: nothing about a visitor is kept
+    # in module globals (see the top of routes.py).
+    app.run(debug=DEBUG, host='0.0.0.0', port=PORT_NUMBER, threaded=True)
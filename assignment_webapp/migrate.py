@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+MediaServer schema migrations.
+Applies the numbered SQL files in ../migrations (NNNN_name.sql) that the
+database has not had yet, oldest first, and records each one in
+mediaserver.schema_version. Forward only: an applied migration is never
+undone or run again, a change to the schema is a new file.
+
+A migration runs in one transaction, unless it has the line
+
+    -- migrate: no-transaction
+
+for statements that cannot run inside one, such as CREATE INDEX
+CONCURRENTLY (which builds an index without blocking writes to the
+table). Those statements run one at a time.
+
+    python3 migrate.py            apply the pending migrations
+    python3 migrate.py --status   list the applied and pending migrations
+    python3 migrate.py --check    EXPLAIN the app's queries (see checks())
+
+Run it from the assignment_webapp folder so config.ini is found.
+"""
+
+import contextlib
+import glob
+import hashlib
+import io
+import os
+import re
+import sys
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import database
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'migrations')
+
+# Only one runner at a time, whichever process starts it
+LOCK_ID = 2120
+
+SCHEMA_VERSION_SQL = """CREATE TABLE IF NOT EXISTS mediaserver.schema_version(
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT now()
+)"""
+
+# An index left behind by a failed CREATE INDEX CONCURRENTLY is never used,
+# and IF NOT EXISTS would skip building it again.
+INVALID_INDEXES_SQL = """select n.nspname || '.' || c.relname
+    from pg_index i join pg_class c on (c.oid = i.indexrelid)
+        join pg_namespace n on (n.oid = c.relnamespace)
+    where not i.indisvalid and n.nspname = 'mediaserver'"""
+
+
+#####################################################
+#   Migration files
+#####################################################
+
+class Migration(object):
+    """ One migrations/NNNN_name.sql file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)[:-len('.sql')]
+        self.version = int(self.name.split('_', 1)[0])
+        with open(path, encoding='utf-8') as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha1(self.sql.encode('utf-8')).hexdigest()
+        self.transactional = not re.search(r'^--\s*migrate:\s*no-transaction\s*$',
+                                           self.sql, re.MULTILINE)
+
+    def statements(self):
+        return split_statements(self.sql)
+
+
+def find_migrations(directory=MIGRATIONS_DIR):
+    migrations = [Migration(path)
+                  for path in glob.glob(os.path.join(directory, '[0-9]*.sql'))]
+    migrations.sort(key=lambda m: m.version)
+    for before, after in zip(migrations, migrations[1:]):
+        if before.version == after.version:
+            raise ValueError("two migrations numbered %d: %s and %s"
+                             % (before.version, before.name, after.name))
+    return migrations
+
+
+def split_statements(sql):
+    """
+    The statements of a SQL script, without the trailing semicolons.
+    Semicolons inside quotes, dollar quoted bodies ($$ ... $$) and comments
+    do not end a statement. Statements that are only comments are dropped.
+    """
+    statements, current = [], []
+    i, n = 0, len(sql)
+    while i < n:
+        c = sql[i]
+        if sql.startswith('--', i):
+            end = sql.find('\n', i)
+            end = n if end == -1 else end
+            current.append(sql[i:end])
+            i = end
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            current.append(sql[i:end])
+            i = end
+        elif c in ("'", '"'):
+            end = i + 1
+            while end < n:
+                if sql[end] == c:
+                    if sql.startswith(c * 2, end):  # '' inside a string
+                        end += 2
+                        continue
+                    break
+                end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+        elif c == '$' and re.match(r'\$\w*\$', sql[i:]):
+            tag = re.match(r'\$\w*\$', sql[i:]).group(0)
+            end = sql.find(tag, i + len(tag))
+            end = n if end == -1 else end + len(tag)
+            current.append(sql[i:end])
+            i = end
+        elif c == ';':
+            statements.append(''.join(current))
+            current = []
+            i += 1
+        else:
+            current.append(c)
+            i += 1
+    statements.append(''.join(current))
+    code = [re.sub(r'--[^\n]*|/\*.*?\*/', '', s, flags=re.DOTALL).strip()
+            for s in statements]
+    return [s.strip() for s, c in zip(statements, code) if c]
+
+
+#####################################################
+#   Applying migrations
+#####################################################
+
+def execute(cur, sql):
+    # pg8000 treats % as a parameter marker even without parameters
+    cur.execute(sql.replace('%', '%%'), ())
+
+
+def applied_versions(cur):
+    """ version -> (name, checksum) of the migrations already applied."""
+    cur.execute(SCHEMA_VERSION_SQL)
+    cur.execute("select version, name, checksum from mediaserver.schema_version")
+    return {version: (name, checksum) for version, name, checksum in cur.fetchall()}
+
+
+def apply(conn, migration):
+    cur = conn.cursor()
+    record = ("insert into mediaserver.schema_version(version, name, checksum) "
+              "values (%s, %s, %s)", (migration.version, migration.name, migration.checksum))
+    if migration.transactional:
+        conn.autocommit = False
+        try:
+            for statement in migration.statements():
+                execute(cur, statement)
+            cur.execute(*record)
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        return
+
+    conn.autocommit = True
+    try:
+        cur.execute(INVALID_INDEXES_SQL)
+        for (index,) in cur.fetchall():
+            print("  dropping invalid index", index)
+            execute(cur, 'DROP INDEX CONCURRENTLY IF EXISTS %s' % index)
+        for statement in migration.statements():
+            execute(cur, statement)
+        cur.execute(INVALID_INDEXES_SQL)
+        invalid = [index for (index,) in cur.fetchall()]
+        if invalid:
+            raise RuntimeError("indexes left invalid: %s" % ', '.join(invalid))
+        cur.execute(*record)
+    finally:
+        conn.autocommit = False
+
+
+def migrate(conn, migrations):
+    """ Applies the migrations not applied yet. Returns how many ran."""
+    cur = conn.cursor()
+    cur.execute("select pg_advisory_lock(%s)", (LOCK_ID,))
+    try:
+        applied = applied_versions(cur)
+        conn.commit()
+        pending = [m for m in migrations if m.version not in applied]
+        for migration in pending:
+            print("applying", migration.name,
+                  "" if migration.transactional else "(no transaction)")
+            apply(conn, migration)
+        return len(pending)
+    finally:
+        cur.execute("select pg_advisory_unlock(%s)", (LOCK_ID,))
+        conn.commit()
+
+
+def status(conn, migrations):
+    cur = conn.cursor()
+    applied = applied_versions(cur)
+    conn.commit()
+    for migration in migrations:
+        if migration.version not in applied:
+            state = 'pending'
+        elif applied[migration.version][1] != migration.checksum:
+            state = 'applied, file changed since'
+        else:
+            state = 'applied'
+        print("%-40s %s" % (migration.name, state))
+    for version in sorted(set(applied) - set(m.version for m in migrations)):
+        print("%-40s applied, file missing" % applied[version][0])
+
+
+#####################################################
+#   Query plan checks
+#   Each query the pages run often, EXPLAINed with
+#   sequential scans (and hash and merge joins) off. The tables here are
+#   small enough that a scan is the cheapest plan, so
+#   this asks the planner whether an index *could*
+#   serve the query, as it would at scale: a Seq Scan,
+#   or an index scan with no Index Cond (reading the
+#   whole index), means no index fits.
+#
+#   The plans are made against copies of the tables
+#   (with their indexes) in a scratch schema, filled
+#   with generated rows and ANALYZEd, so they do not
+#   depend on how much data the database holds or when
+#   it was last analyzed. The copies go with the
+#   check's transaction.
+#####################################################
+
+# Tables small whatever the size of the catalogue
+SMALL_TABLES = ('metadatatype', 'contacttype')
+
+CHECK_SCHEMA = 'mediaserver_check'
+CHECK_ROWS = 10000
+
+CHECK_TABLES_SQL = """select table_name from information_schema.tables
+    where table_schema = 'mediaserver' and table_type = 'BASE TABLE'
+      and table_name <> 'schema_version'"""
+
+CHECK_COLUMNS_SQL = """select column_name, data_type from information_schema.columns
+    where table_schema = 'mediaserver' and table_name = %s
+    order by ordinal_position"""
+
+# Row g's value for a column of each type: every key matches about one
+# row, as a lookup in a large catalogue does
+CHECK_VALUES = {
+    'smallint': 'g',
+    'integer': 'g',
+    'bigint': 'g',
+    'numeric': 'mod(g, 10)',
+    'boolean': 'mod(g, 2) = 0',
+    'date': 'current_date - mod(g, 3650)',
+    'timestamp without time zone': "now() - g * interval '1 minute'",
+    'tsvector': "to_tsvector('simple', 'w' || g)",
+}
+
+
+def checks():
+    """ (name, sql, params) of the queries to check."""
+    user, item = 'alice', 1
+    found = [
+        ('user playlists', database.USER_PLAYLISTS_SQL, (user,)),
+        ('user podcast subscriptions', database.USER_PODCAST_SUBSCRIPTIONS_SQL, (user,)),
+        ('user in progress items', database.USER_IN_PROGRESS_ITEMS_SQL, (user,)),
+        ('song', database.SONG_SQL, (item,)),
+        ('song metadata', database.SONG_METADATA_SQL, (item, item)),
+        ('album', database.ALBUM_SQL, (item,)),
+        ('album songs', database.ALBUM_SONGS_SQL, (item,)),
+        ('album genres', database.ALBUM_GENRES_SQL, (item,)),
+        ('tv show', database.TVSHOW_SQL, (item,)),
+        ('tv show episodes', database.TVSHOW_EPISODES_SQL, (item,)),
+        ('song summaries', database.SONG_SUMMARIES_SQL, (database.pg_array([item]),)),
+        ('movie summaries', database.MOVIE_SUMMARIES_SQL, (database.pg_array([item]),)),
+        ('stale movie', database.STALE_MOVIE_SQL, (item, 7)),
+        ('tv show search', database.TVSHOW_SEARCH_SQL, ('star:*', 50, 0)),
+        ('movie search', database.MOVIE_SEARCH_SQL, ('star:*', 50, 0)),
+        ('search', database.SEARCH_SQL,
+         ('star:*', database.pg_array(list(database.SEARCH_TYPES)), 50, 0)),
+    ]
+    for kind in database.LIST_PAGES:
+        found.append(('%s page by id' % kind,
+                      database.list_page_sql(kind, 'id', seek=True), (item, 51, 0)))
+        found.append(('%s page by name' % kind,
+                      database.list_page_sql(kind, 'name', seek=True), ('m', item, 51, 0)))
+    for filter_by in database.RATINGS_FILTERS:
+        for sort_by, (keys, _) in database.RATINGS_SORTS.items():
+            found.append(('ratings %s by %s' % (filter_by, sort_by),
+                          database.movie_ratings_sql(filter_by, sort_by, seek=True),
+                          tuple(['1'] * len(keys)) + (51,)))
+    return found
+
+
+SCAN_NODE = re.compile(r'(Seq Scan|Index Scan|Index Only Scan|Bitmap Index Scan)'
+                       r'(?: Backward)?(?: using (\w+))? on (\w+)')
+
+
+def full_scans(plan):
+    """ The tables (or indexes) a plan reads in full."""
+    lines = plan.split('\n')
+    found = []
+    for number, line in enumerate(lines):
+        match = SCAN_NODE.search(line)
+        if not match:
+            continue
+        kind, _, name = match.groups()
+        if name.lower() in SMALL_TABLES:
+            continue
+        if kind == 'Seq Scan':
+            found.append(name)
+            continue
+        # The node's own details are the lines up to the next node
+        indent = len(line) - len(line.lstrip(' ->'))
+        details = []
+        for detail in lines[number + 1:]:
+            if '->' in detail or len(detail) - len(detail.lstrip()) <= indent - 4:
+                break
+            details.append(detail)
+        if not any('Index Cond:' in detail for detail in details):
+            found.append(name)
+    return found
+
+
+def create_check_tables(cur):
+    """
+    Copies the mediaserver tables into CHECK_SCHEMA, fills and ANALYZEs
+    them. Returns the names of the tables copied.
+    """
+    cur.execute("create schema %s" % CHECK_SCHEMA)
+    cur.execute(CHECK_TABLES_SQL)
+    tables = [row[0] for row in cur.fetchall()]
+    for table in tables:
+        cur.execute("create table %s.%s (like mediaserver.%s including all)"
+                    % (CHECK_SCHEMA, table, table))
+        cur.execute(CHECK_COLUMNS_SQL, (table,))
+        columns = cur.fetchall()
+        cur.execute("insert into %s.%s (%s) select %s from generate_series(1, %d) g"
+                    % (CHECK_SCHEMA, table,
+                       ', '.join('"%s"' % name for name, _ in columns),
+                       ', '.join(CHECK_VALUES.get(kind, "'v' || g") for _, kind in columns),
+                       10 if table in SMALL_TABLES else CHECK_ROWS))
+        cur.execute("analyze %s.%s" % (CHECK_SCHEMA, table))
+    return set(tables)
+
+
+def in_check_schema(sql, tables):
+    """ sql reading the CHECK_SCHEMA copies of tables."""
+    def copy(match):
+        if match.group(1).lower() in tables:
+            return CHECK_SCHEMA + '.' + match.group(1)
+        return match.group(0)
+    return re.sub(r'\bmediaserver\.(\w+)', copy, sql, flags=re.IGNORECASE)
+
+
+def check(conn):
+    """ Prints every query's verdict. Returns how many read a table in full."""
+    cur = conn.cursor()
+    # Small tables make full scans and hash or merge joins the cheapest
+    # plans; at scale the page queries, which each touch a few rows, use
+    # nested loops over index lookups.
+    for setting in ('enable_seqscan', 'enable_hashjoin', 'enable_mergejoin'):
+        cur.execute("set %s = off" % setting)
+    failed = 0
+    try:
+        tables = create_check_tables(cur)
+        for name, sql, params in checks():
+            cur.execute("explain " + in_check_schema(sql, tables), params)
+            plan = '\n'.join(row[0] for row in cur.fetchall())
+            scans = full_scans(plan)
+            if scans:
+                failed += 1
+                print("%-32s FULL SCAN of %s" % (name, ', '.join(scans)))
+                print('    ' + plan.replace('\n', '\n    '))
+            else:
+                print("%-32s ok" % name)
+    finally:
+        conn.rollback()
+    return failed
+
+
+def main(args):
+    migrations = find_migrations()
+    conn = database.open_connection()
+    try:
+        if '--status' in args:
+            status(conn, migrations)
+        elif '--check' in args:
+            failed = check(conn)
+            print("%d of %d queries read a whole table" % (failed, len(checks())))
+            return 1 if failed else 0
+        else:
+            count = migrate(conn, migrations)
+            print("%d migration(s) applied" % count)
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,243 @@
+"""asyncio support for pg8000.
+
+:func:`connect` returns an :class:`AsyncConnection`, whose queries are
+awaited instead of blocking on the socket.  Messages are still built and
+parsed by :class:`pg8000.core.Connection` (statement cache, type
+conversion, row decoders), only the network I/O goes through asyncio
+streams.
+
+The startup and authentication exchange is done by the blocking
+:func:`pg8000.connect` in the loop's default executor, after which the
+socket is handed to asyncio.  SSL and COPY are not supported.
+
+This module is a pg8000 extension and needs Python 3.5 or later.
+"""
+
+import asyncio
+import functools
+
+import pg8000
+
+from . import connect as _blocking_connect
+from .core import (
+    Cursor, InterfaceError, NotSupportedError, OperationalError, ci_unpack,
+    i_pack, NULL_BYTE, EXECUTE, SYNC_MSG, TERMINATE_MSG, READY_FOR_QUERY,
+    COMMAND_COMPLETE, EMPTY_QUERY_RESPONSE)
+
+
+async def connect(
+        user=None, host='localhost', unix_sock=None, port=5432,
+        database=None, password=None, ssl=False, timeout=None, loop=None,
+        **kwargs):
+    """Creates an :class:`AsyncConnection`.  Takes the same arguments as
+    :func:`pg8000.connect`, plus the event loop to use.
+    """
+    if ssl:
+        raise NotSupportedError("SSL is not supported by pg8000.aio")
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    conn = await loop.run_in_executor(None, functools.partial(
+        _blocking_connect, user=user, host=host, unix_sock=unix_sock,
+        port=port, database=database, password=password, timeout=timeout,
+        **kwargs))
+    try:
+        reader, writer = await asyncio.open_connection(sock=conn._usock)
+    except Exception:
+        conn.close()
+        raise
+    return AsyncConnection(conn, reader, writer)
+
+
+class AsyncConnection(object):
+    """A PostgreSQL connection driven by asyncio.
+
+    Statements are sent with the extended query protocol on the unnamed
+    portal and all of their rows are read before the call returns, so the
+    returned :class:`pg8000.Cursor` objects only hand out cached rows.
+
+    Transactions work as in :class:`pg8000.Connection`: unless
+    :attr:`autocommit` is set a transaction is begun by the first statement
+    and lasts until :meth:`commit` or :meth:`rollback`.
+
+    One statement (or pipeline) runs at a time per connection, use several
+    connections (eg. from a pool) to run queries concurrently.
+    """
+
+    def __init__(self, conn, reader, writer):
+        self._conn = conn
+        self._reader = reader
+        self._writer = writer
+        self._lock = asyncio.Lock()
+
+        # The blocking connection only ever writes into this buffer now,
+        # any attempt to use its blocking I/O fails loudly.
+        self._buffer = bytearray()
+        conn._write = self._buffer.extend
+        conn._flush = conn._read = self._blocking_io
+
+    @staticmethod
+    def _blocking_io(*args):
+        raise InterfaceError(
+            "blocking I/O on a pg8000.aio connection, use its async methods")
+
+    @property
+    def autocommit(self):
+        return self._conn.autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self._conn.autocommit = value
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    @property
+    def closed(self):
+        return self._writer is None
+
+    @property
+    def max_prepared_statements(self):
+        return self._conn.max_prepared_statements
+
+    @max_prepared_statements.setter
+    def max_prepared_statements(self, value):
+        self._conn.max_prepared_statements = value
+
+    def __getattr__(self, name):
+        # Protocol counters and other read only attributes
+        if name in ('parse_count', 'bind_count', 'close_statement_count'):
+            return getattr(self._conn, name)
+        raise AttributeError(name)
+
+    async def execute(self, operation, args=None):
+        """Executes one statement and returns a :class:`pg8000.Cursor`
+        holding all of its rows.
+        """
+        cursors = await self.pipeline([(operation, args)])
+        return cursors[0]
+
+    async def fetchall(self, operation, args=None):
+        """Executes one statement and returns its rows."""
+        cursor = await self.execute(operation, args)
+        return cursor.fetchall()
+
+    async def pipeline(self, queries):
+        """Executes several statements in one round trip, see
+        :meth:`pg8000.Connection.pipeline`.  Returns one cursor per
+        statement.
+        """
+        conn = self._conn
+        async with self._lock:
+            if self._writer is None:
+                raise InterfaceError("connection is closed")
+            queries = list(queries)
+            if not conn.in_transaction and not conn.autocommit:
+                queries.insert(0, ("begin transaction", None))
+                skip = 1
+            else:
+                skip = 0
+            cursors = [Cursor(conn) for q in queries]
+
+            binds = []
+            for cursor, (operation, args) in zip(cursors, queries):
+                args = await self._lookup_ps(cursor, operation, args)
+                binds.append((cursor, args))
+                cursor._cached_rows.clear()
+                cursor._row_count = -1
+                cursor.portal_suspended = False
+
+            for cursor, args in binds:
+                conn._send_BIND(NULL_BYTE, cursor.ps, args)
+                conn._send_message(EXECUTE, NULL_BYTE + i_pack(0))
+            conn._write(SYNC_MSG)
+            await self._flush()
+            await self._handle_messages(cursors)
+            conn._evict_statements(conn._caches[pg8000.paramstyle]['ps'])
+            return cursors[skip:]
+
+    async def commit(self):
+        await self.execute("commit")
+
+    async def rollback(self):
+        await self.execute("rollback")
+
+    async def close(self):
+        """Closes the connection.  Safe to call twice."""
+        if self._writer is None:
+            return
+        writer, self._writer = self._writer, None
+        try:
+            self._buffer.extend(TERMINATE_MSG)
+            writer.write(bytes(self._buffer))
+            await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            del self._buffer[:]
+            writer.close()
+            self._conn._sock = None
+
+    async def _lookup_ps(self, cursor, operation, vals):
+        # Async version of Connection._lookup_ps, see there.
+        conn = self._conn
+        if vals is None:
+            vals = ()
+        cache = conn._caches[pg8000.paramstyle]
+        statement, make_args = conn._get_statement(cache, operation)
+        args = make_args(vals)
+        params = conn.make_params(args)
+        key = operation, params
+
+        try:
+            ps = cache['ps'].pop(key)
+            cursor.ps = ps
+        except KeyError:
+            ps = conn._send_PREPARE(
+                cursor, statement, params, tuple(type(a) for a in args))
+            await self._flush()
+            await self._handle_messages([cursor])
+            conn._finish_prepare(ps, params)
+        cache['ps'][key] = ps
+        return args
+
+    async def _flush(self):
+        data = bytes(self._buffer)
+        del self._buffer[:]
+        try:
+            self._writer.write(data)
+            await self._writer.drain()
+        except (ConnectionError, OSError) as e:
+            self._abort()
+            raise OperationalError(str(e))
+
+    async def _handle_messages(self, cursors):
+        # Async version of Connection.handle_pipeline_messages.
+        conn = self._conn
+        code = conn.error = None
+        pending = iter(cursors)
+        cursor = next(pending)
+        readexactly = self._reader.readexactly
+
+        try:
+            while code != READY_FOR_QUERY:
+                code, data_len = ci_unpack(await readexactly(5))
+                conn.message_types[code](
+                    await readexactly(data_len - 4), cursor)
+                if code == COMMAND_COMPLETE or code == EMPTY_QUERY_RESPONSE:
+                    cursor = next(pending, cursor)
+        except BaseException as e:
+            # Includes cancellation: the protocol state is unknown now.
+            self._abort()
+            if isinstance(e, (asyncio.IncompleteReadError, ConnectionError)):
+                raise OperationalError(str(e))
+            raise
+
+        if conn.error is not None:
+            raise conn.error
+
+    def _abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._conn._sock = None
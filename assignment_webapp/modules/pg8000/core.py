@@ -6,7 +6,7 @@ import threading
 from struct import pack
 from hashlib import md5
 from decimal import Decimal
-from collections import deque, defaultdict
+from collections import deque, defaultdict, OrderedDict
 from itertools import count, islice
 from six.moves import map
 from six import b, PY2, integer_types, next, text_type, u, binary_type
@@ -740,6 +740,24 @@ def float8_recv(data, offset, length):
     return d_unpack(data, offset)[0]
 
 
+def decode_data_row(data, input_funcs):
+    """
+    Decodes a DataRow message one column at a time. Reference version of
+    the decoders generated by Connection._row_decoder().
+    """
+    data_idx = 2
+    row = []
+    for func in input_funcs:
+        vlen = i_unpack(data, data_idx)[0]
+        data_idx += 4
+        if vlen == -1:
+            row.append(None)
+        else:
+            row.append(func(data, data_idx, vlen))
+            data_idx += vlen
+    return row
+
+
 def bytea_send(v):
     return v
 
@@ -1248,10 +1266,28 @@ class Connection(object):
         self.autocommit = False
         self._xid = None
 
-        self._caches = defaultdict(lambda: defaultdict(dict))
+        self._caches = defaultdict(lambda: defaultdict(OrderedDict))
         self.statement_number = 0
         self.portal_number = 0
 
+        ##
+        # Upper bound on the number of prepared statements kept open on the
+        # server for this connection.  When it is exceeded the least recently
+        # used statements are closed.  None means no limit.
+        # <p>
+        # Stability: pg8000 extension.
+        self.max_prepared_statements = None
+        self._statements_to_close = []
+
+        ##
+        # Protocol counters: Parse messages sent (statements prepared), Bind
+        # messages sent (statements executed) and prepared statements closed.
+        # <p>
+        # Stability: pg8000 extension.
+        self.parse_count = 0
+        self.bind_count = 0
+        self.close_statement_count = 0
+
         try:
             if unix_sock is None and host is not None:
                 self._usock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -1515,6 +1551,19 @@ class Connection(object):
             UUID: (2950, FC_BINARY, uuid_send),  # uuid
         }
 
+        # Binary recv functions of fixed width types, with the struct code
+        # that decodes them. Used to build the per statement row decoders.
+        self._fixed_width_recv = {
+            bool_recv: '?',
+            int2_recv: 'h',
+            int4_recv: 'i',
+            int8_recv: 'q',
+            float4_recv: 'f',
+            float8_recv: 'd',
+        }
+        self._text_recv = text_recv
+        self._row_decoders = {}
+
         self.inspect_funcs = {
             datetime.datetime: self.inspect_datetime,
             list: self.array_inspect,
@@ -1877,113 +1926,44 @@ class Connection(object):
             field['pg8000_fc'], field['func'] = \
                 self.pg_types[field['type_oid']]
 
-    def execute(self, cursor, operation, vals):
+    def _get_statement(self, cache, operation):
+        try:
+            return cache['statement'][operation]
+        except KeyError:
+            statement, make_args = convert_paramstyle(
+                pg8000.paramstyle, operation)
+            cache['statement'][operation] = statement, make_args
+            return statement, make_args
+
+    def _lookup_ps(self, cursor, operation, vals, evict=True):
+        # Finds (or parses) the prepared statement for operation and the
+        # types of vals, sets it as cursor.ps and returns the bind arguments.
         if vals is None:
             vals = ()
         paramstyle = pg8000.paramstyle
         cache = self._caches[paramstyle]
 
-        try:
-            statement, make_args = cache['statement'][operation]
-        except KeyError:
-            statement, make_args = convert_paramstyle(paramstyle, operation)
-            cache['statement'][operation] = statement, make_args
+        statement, make_args = self._get_statement(cache, operation)
 
         args = make_args(vals)
         params = self.make_params(args)
         key = operation, params
 
         try:
-            ps = cache['ps'][key]
+            # Re-insert so that the statement cache is kept in least recently
+            # used order.
+            ps = cache['ps'].pop(key)
+            cache['ps'][key] = ps
             cursor.ps = ps
         except KeyError:
-            statement_name = "pg8000_statement_" + str(self.statement_number)
-            self.statement_number += 1
-            statement_name_bin = statement_name.encode('ascii') + NULL_BYTE
-            ps = {
-                'row_desc': [],
-                'param_funcs': tuple(x[2] for x in params),
-            }
-            cursor.ps = ps
-
-            param_fcs = tuple(x[1] for x in params)
-
-            # Byte1('P') - Identifies the message as a Parse command.
-            # Int32 -   Message length, including self.
-            # String -  Prepared statement name. An empty string selects the
-            #           unnamed prepared statement.
-            # String -  The query string.
-            # Int16 -   Number of parameter data types specified (can be zero).
-            # For each parameter:
-            #   Int32 - The OID of the parameter data type.
-            val = bytearray(statement_name_bin)
-            val.extend(statement.encode(self._client_encoding) + NULL_BYTE)
-            val.extend(h_pack(len(params)))
-            for oid, fc, send_func in params:
-                # Parse message doesn't seem to handle the -1 type_oid for NULL
-                # values that other messages handle.  So we'll provide type_oid
-                # 705, the PG "unknown" type.
-                val.extend(i_pack(705 if oid == -1 else oid))
-
-            # Byte1('D') - Identifies the message as a describe command.
-            # Int32 - Message length, including self.
-            # Byte1 - 'S' for prepared statement, 'P' for portal.
-            # String - The name of the item to describe.
-            self._send_message(PARSE, val)
-            self._send_message(DESCRIBE, STATEMENT + statement_name_bin)
-            self._write(SYNC_MSG)
-
-            try:
-                self._flush()
-            except AttributeError as e:
-                if self._sock is None:
-                    raise InterfaceError("connection is closed")
-                else:
-                    raise e
-            except socket.error as e:
-                raise OperationalError(str(e))
-
-            self.handle_messages(cursor)
-
-            # We've got row_desc that allows us to identify what we're
-            # going to get back from this statement.
-            output_fc = tuple(
-                self.pg_types[f['type_oid']][0] for f in ps['row_desc'])
-
-            ps['input_funcs'] = tuple(f['func'] for f in ps['row_desc'])
-            # Byte1('B') - Identifies the Bind command.
-            # Int32 - Message length, including self.
-            # String - Name of the destination portal.
-            # String - Name of the source prepared statement.
-            # Int16 - Number of parameter format codes.
-            # For each parameter format code:
-            #   Int16 - The parameter format code.
-            # Int16 - Number of parameter values.
-            # For each parameter value:
-            #   Int32 - The length of the parameter value, in bytes, not
-            #           including this length.  -1 indicates a NULL parameter
-            #           value, in which no value bytes follow.
-            #   Byte[n] - Value of the parameter.
-            # Int16 - The number of result-column format codes.
-            # For each result-column format code:
-            #   Int16 - The format code.
-            ps['bind_1'] = statement_name_bin + h_pack(len(params)) + \
-                pack("!" + "h" * len(param_fcs), *param_fcs) + \
-                h_pack(len(params))
-
-            ps['bind_2'] = h_pack(len(output_fc)) + \
-                pack("!" + "h" * len(output_fc), *output_fc)
-
+            ps = self._prepare(
+                cursor, statement, params, tuple(type(a) for a in args))
             cache['ps'][key] = ps
+            if evict:
+                self._evict_statements(cache['ps'])
+        return args
 
-        cursor._cached_rows.clear()
-        cursor._row_count = -1
-        cursor.portal_name = "pg8000_portal_" + str(self.portal_number)
-        self.portal_number += 1
-        cursor.portal_name_bin = cursor.portal_name.encode('ascii') + NULL_BYTE
-        cursor.execute_msg = cursor.portal_name_bin + \
-            Connection._row_cache_size_bin
-
+    def _send_BIND(self, portal_name_bin, ps, args):
         # Byte1('B') - Identifies the Bind command.
         # Int32 - Message length, including self.
         # String - Name of the destination portal.
@@ -2000,7 +1980,7 @@ class Connection(object):
         # Int16 - The number of result-column format codes.
         # For each result-column format code:
         #   Int16 - The format code.
-        retval = bytearray(cursor.portal_name_bin + ps['bind_1'])
+        retval = bytearray(portal_name_bin + ps['bind_1'])
         for value, send_func in zip(args, ps['param_funcs']):
             if value is None:
                 val = NULL
@@ -2011,6 +1991,21 @@ class Connection(object):
         retval.extend(ps['bind_2'])
 
         self._send_message(BIND, retval)
+        self.bind_count += 1
+
+    def execute(self, cursor, operation, vals):
+        args = self._lookup_ps(cursor, operation, vals)
+        ps = cursor.ps
+
+        cursor._cached_rows.clear()
+        cursor._row_count = -1
+        cursor.portal_name = "pg8000_portal_" + str(self.portal_number)
+        self.portal_number += 1
+        cursor.portal_name_bin = cursor.portal_name.encode('ascii') + NULL_BYTE
+        cursor.execute_msg = cursor.portal_name_bin + \
+            Connection._row_cache_size_bin
+
+        self._send_BIND(cursor.portal_name_bin, ps, args)
         self.send_EXECUTE(cursor)
         self._write(SYNC_MSG)
         self._flush()
@@ -2025,6 +2020,241 @@ class Connection(object):
         else:
             self.close_portal(cursor)
 
+    def _prepare(self, cursor, statement, params, param_types):
+        ps = self._send_PREPARE(cursor, statement, params, param_types)
+
+        try:
+            self._flush()
+        except AttributeError as e:
+            if self._sock is None:
+                raise InterfaceError("connection is closed")
+            else:
+                raise e
+        except socket.error as e:
+            raise OperationalError(str(e))
+
+        self.handle_messages(cursor)
+        return self._finish_prepare(ps, params)
+
+    def _send_PREPARE(self, cursor, statement, params, param_types):
+        # Writes Parse/Describe/Sync for a new statement and returns its ps,
+        # which is completed by _finish_prepare() once the replies are read.
+        statement_name = "pg8000_statement_" + str(self.statement_number)
+        self.statement_number += 1
+        statement_name_bin = statement_name.encode('ascii') + NULL_BYTE
+        ps = {
+            'row_desc': [],
+            'param_funcs': tuple(x[2] for x in params),
+            'param_types': param_types,
+            'name_bin': statement_name_bin,
+        }
+        cursor.ps = ps
+
+        # Statements evicted from the cache since the last Parse are closed
+        # in the same round trip.
+        self._send_CLOSE_STATEMENTS()
+
+        # Byte1('P') - Identifies the message as a Parse command.
+        # Int32 -   Message length, including self.
+        # String -  Prepared statement name. An empty string selects the
+        #           unnamed prepared statement.
+        # String -  The query string.
+        # Int16 -   Number of parameter data types specified (can be zero).
+        # For each parameter:
+        #   Int32 - The OID of the parameter data type.
+        val = bytearray(statement_name_bin)
+        val.extend(statement.encode(self._client_encoding) + NULL_BYTE)
+        val.extend(h_pack(len(params)))
+        for oid, fc, send_func in params:
+            # Parse message doesn't seem to handle the -1 type_oid for NULL
+            # values that other messages handle.  So we'll provide type_oid
+            # 705, the PG "unknown" type.
+            val.extend(i_pack(705 if oid == -1 else oid))
+
+        # Byte1('D') - Identifies the message as a describe command.
+        # Int32 - Message length, including self.
+        # Byte1 - 'S' for prepared statement, 'P' for portal.
+        # String - The name of the item to describe.
+        self._send_message(PARSE, val)
+        self._send_message(DESCRIBE, STATEMENT + statement_name_bin)
+        self._write(SYNC_MSG)
+        self.parse_count += 1
+        return ps
+
+    def _finish_prepare(self, ps, params):
+        param_fcs = tuple(x[1] for x in params)
+
+        # We've got row_desc that allows us to identify what we're
+        # going to get back from this statement.
+        output_fc = tuple(
+            self.pg_types[f['type_oid']][0] for f in ps['row_desc'])
+
+        ps['input_funcs'] = tuple(f['func'] for f in ps['row_desc'])
+        ps['row_decoder'] = self._row_decoder(ps['input_funcs'])
+        # Byte1('B') - Identifies the Bind command.
+        # Int32 - Message length, including self.
+        # String - Name of the destination portal.
+        # String - Name of the source prepared statement.
+        # Int16 - Number of parameter format codes.
+        # For each parameter format code:
+        #   Int16 - The parameter format code.
+        # Int16 - Number of parameter values.
+        # For each parameter value:
+        #   Int32 - The length of the parameter value, in bytes, not
+        #           including this length.  -1 indicates a NULL parameter
+        #           value, in which no value bytes follow.
+        #   Byte[n] - Value of the parameter.
+        # Int16 - The number of result-column format codes.
+        # For each result-column format code:
+        #   Int16 - The format code.
+        ps['bind_1'] = ps['name_bin'] + h_pack(len(params)) + \
+            pack("!" + "h" * len(param_fcs), *param_fcs) + \
+            h_pack(len(params))
+
+        ps['bind_2'] = h_pack(len(output_fc)) + \
+            pack("!" + "h" * len(output_fc), *output_fc)
+        return ps
+
+    def _evict_statements(self, ps_cache):
+        if self.max_prepared_statements is None:
+            return
+        while len(ps_cache) > self.max_prepared_statements:
+            key, ps = ps_cache.popitem(last=False)
+            self._statements_to_close.append(ps['name_bin'])
+
+    # Byte1('C') - Identifies the message as a close command.
+    # Int32 - Message length, including self.
+    # Byte1 - 'S' for prepared statement, 'P' for portal.
+    # String - The name of the item to close.
+    def _send_CLOSE_STATEMENTS(self):
+        for statement_name_bin in self._statements_to_close:
+            self._send_message(CLOSE, STATEMENT + statement_name_bin)
+            self.close_statement_count += 1
+        del self._statements_to_close[:]
+
+    def pipeline(self, queries):
+        """Executes several statements in a single round trip, and returns
+        one :class:`Cursor` per statement holding its result set.
+
+        A Bind/Execute pair is sent for every statement followed by one
+        Sync, instead of a Bind/Execute/Sync exchange (and a Close of the
+        portal) per statement.  Statements this connection has not prepared
+        yet are parsed first, which costs one extra round trip each.  All
+        rows of every statement are read, so keep it to queries with
+        modest results.
+
+        If a statement fails the server skips the rest of the pipeline and
+        the error is raised.
+
+        This function is a pg8000 extension.
+
+        :param queries:
+            A sequence of ``(operation, args)`` pairs, as they would be
+            passed to :meth:`Cursor.execute`.
+
+        :rtype: list of :class:`Cursor`
+        """
+        with self._lock:
+            queries = list(queries)
+            if not self.in_transaction and not self.autocommit:
+                queries.insert(0, ("begin transaction", None))
+                skip = 1
+            else:
+                skip = 0
+            cursors = [Cursor(self) for q in queries]
+
+            # Parse anything missing first, eviction waits until the end so
+            # no statement of this pipeline is closed before it runs.
+            binds = []
+            for cursor, (operation, args) in zip(cursors, queries):
+                args = self._lookup_ps(cursor, operation, args, evict=False)
+                binds.append((cursor, args))
+                cursor._cached_rows.clear()
+                cursor._row_count = -1
+                cursor.portal_suspended = False
+
+            # Every statement uses the unnamed portal and fetches all its
+            # rows, so there are no portals to close afterwards.
+            for cursor, args in binds:
+                self._send_BIND(NULL_BYTE, cursor.ps, args)
+                self._send_message(EXECUTE, NULL_BYTE + i_pack(0))
+            self._write(SYNC_MSG)
+            try:
+                self._flush()
+            except AttributeError as e:
+                if self._sock is None:
+                    raise InterfaceError("connection is closed")
+                else:
+                    raise e
+            except socket.error as e:
+                raise OperationalError(str(e))
+
+            self.handle_pipeline_messages(cursors)
+            self._evict_statements(self._caches[pg8000.paramstyle]['ps'])
+            return cursors[skip:]
+
+    def handle_pipeline_messages(self, cursors):
+        # Like handle_messages, but each statement's messages go to its own
+        # cursor. A statement's output ends with CommandComplete (or
+        # EmptyQueryResponse).
+        code = self.error = None
+        pending = iter(cursors)
+        cursor = next(pending)
+
+        try:
+            while code != READY_FOR_QUERY:
+                code, data_len = ci_unpack(self._read(5))
+                self.message_types[code](self._read(data_len - 4), cursor)
+                if code == COMMAND_COMPLETE or code == EMPTY_QUERY_RESPONSE:
+                    cursor = next(pending, cursor)
+        except:
+            self._close()
+            raise
+
+        if self.error is not None:
+            raise self.error
+
+    def prepare_statement(self, operation, param_types=()):
+        """Prepares a statement on the server without executing it, so that a
+        later :meth:`Cursor.execute` of the same operation with parameters of
+        the given Python types only needs to send Bind/Execute.
+
+        This function is a pg8000 extension.
+
+        :param operation:
+            The SQL statement, in the current :data:`paramstyle`.
+
+        :param param_types:
+            A sequence of the Python types of the parameters, eg.
+            ``(str, int)``.
+        """
+        with self._lock:
+            cache = self._caches[pg8000.paramstyle]
+            statement, make_args = self._get_statement(cache, operation)
+            try:
+                params = tuple(self.py_types[typ] for typ in param_types)
+            except KeyError as e:
+                raise NotSupportedError(
+                    "type " + str(e) + " not mapped to pg type")
+            key = operation, params
+            if key in cache['ps']:
+                return
+            cache['ps'][key] = self._prepare(
+                Cursor(self), statement, params, tuple(param_types))
+            self._evict_statements(cache['ps'])
+
+    def prepared_statements(self):
+        """Returns a list of ``(operation, param_types)`` tuples for the
+        statements currently prepared on this connection, in least recently
+        used order.  Each one can be passed to :meth:`prepare_statement`.
+
+        This function is a pg8000 extension.
+        """
+        with self._lock:
+            return [
+                (key[0], ps['param_types']) for key, ps in
+                self._caches[pg8000.paramstyle]['ps'].items()]
+
     def _send_message(self, code, data):
         try:
             self._write(code)
@@ -2064,20 +2294,70 @@ class Connection(object):
 
         if command in DDL_COMMANDS:
             for k in self._caches:
+                for ps in self._caches[k]['ps'].values():
+                    self._statements_to_close.append(ps['name_bin'])
                 self._caches[k]['ps'].clear()
 
     def handle_DATA_ROW(self, data, cursor):
-        data_idx = 2
-        row = []
-        for func in cursor.ps['input_funcs']:
-            vlen = i_unpack(data, data_idx)[0]
-            data_idx += 4
-            if vlen == -1:
-                row.append(None)
+        cursor._cached_rows.append(
+            cursor.ps['row_decoder'](data, self._client_encoding))
+
+    def _row_decoder(self, input_funcs):
+        """
+        Returns a function decoding the DataRow message of a statement whose
+        columns are read by input_funcs, building it the first time that
+        column layout is seen on this connection.
+
+        The generic loop in decode_data_row() costs an i_unpack plus a recv
+        call per column. The generated decoder is unrolled instead:
+            - fixed width binary columns (bool, int2/4/8, float4/8) are
+              unpacked in place, and if every column is fixed width a row
+              without NULLs is unpacked by a single fused struct;
+            - text columns are decoded in place;
+            - any other type still calls its recv function.
+        """
+        try:
+            return self._row_decoders[input_funcs]
+        except KeyError:
+            pass
+
+        fixed = self._fixed_width_recv
+        namespace = {'i_unpack': i_unpack}
+        lines = ['def decode(data, encoding):']
+
+        if len(input_funcs) > 0 and all(f in fixed for f in input_funcs):
+            # Layout of a row without NULLs: Int16 count, then for every
+            # column Int32 length + value. Any NULL makes the message
+            # shorter, so the size check routes those rows to the slow path.
+            fused = Struct(
+                '!h' + ''.join('i' + fixed[f] for f in input_funcs))
+            namespace['fused_unpack'] = fused.unpack
+            lines.append('    if len(data) == %d:' % fused.size)
+            lines.append('        return list(fused_unpack(data)[2::2])')
+
+        lines.append('    idx = 2')
+        for i, func in enumerate(input_funcs):
+            lines.append('    vlen = i_unpack(data, idx)[0]')
+            lines.append('    idx += 4')
+            lines.append('    if vlen == -1:')
+            lines.append('        v%d = None' % i)
+            lines.append('    else:')
+            if func in fixed:
+                namespace['u%d' % i] = Struct('!' + fixed[func]).unpack_from
+                lines.append('        v%d = u%d(data, idx)[0]' % (i, i))
+            elif func is self._text_recv and not PY2:
+                lines.append('        v%d = str(data[idx:idx + vlen], encoding)' % i)
             else:
-                row.append(func(data, data_idx, vlen))
-                data_idx += vlen
-        cursor._cached_rows.append(row)
+                namespace['f%d' % i] = func
+                lines.append('        v%d = f%d(data, idx, vlen)' % (i, i))
+            lines.append('        idx += vlen')
+        lines.append('    return [%s]' % ', '.join(
+            'v%d' % i for i in range(len(input_funcs))))
+
+        exec(compile('\n'.join(lines), '<pg8000 row decoder>', 'exec'),
+             namespace)
+        decoder = self._row_decoders[input_funcs] = namespace['decode']
+        return decoder
 
     def handle_messages(self, cursor):
         code = self.error = None
@@ -37,10 +37,13 @@
 """
 from __future__ import with_statement
 
+import io
 import os
 import socket
+import stat
 import sys
 import signal
+import time
 
 
 can_fork = hasattr(os, "fork")
@@ -91,20 +94,105 @@ from werkzeug._internal import _log
 from werkzeug._compat import PY2, WIN, reraise, wsgi_encoding_dance
 from werkzeug.urls import url_parse, url_unquote
 from werkzeug.exceptions import InternalServerError
+from werkzeug.wsgi import FileWrapper, LimitedStream, _RangeWrapper
 
 
 LISTEN_QUEUE = 128
 can_open_by_fd = not WIN and hasattr(socket, 'fromfd')
 
 
+class _HeaderDeadlineReader(object):
+
+    """Wraps ``rfile`` while the request line and headers are read, so a
+    client trickling them in a byte at a time still has to finish by
+    `deadline`.  Lines are put together from ``rfile.peek``, which receives
+    at most once when the buffer is empty (a byte at a time if ``rfile``
+    is unbuffered), and the deadline is checked before each of those
+    receives.  Whatever follows the headers stays in ``rfile``.
+    """
+
+    def __init__(self, rfile, connection, deadline):
+        self.rfile = rfile
+        self.connection = connection
+        self.deadline = deadline
+
+    def _wait(self):
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout('timed out reading the request headers')
+        self.connection.settimeout(remaining)
+
+    def readline(self, limit=-1):
+        if limit is None:
+            limit = -1
+        buffered = hasattr(self.rfile, 'peek')
+        line = b''
+        while limit < 0 or len(line) < limit:
+            self._wait()
+            chunk = self.rfile.peek(1) if buffered else self.rfile.read(1)
+            if not chunk:
+                break
+            if limit >= 0:
+                chunk = chunk[:limit - len(line)]
+            end = chunk.find(b'\n') + 1
+            if buffered:
+                chunk = self.rfile.read(end or len(chunk))
+            line += chunk
+            if end:
+                break
+        return line
+
+    def __getattr__(self, name):
+        return getattr(self.rfile, name)
+
+
 class WSGIRequestHandler(BaseHTTPRequestHandler, object):
 
-    """A request handler that implements WSGI dispatching."""
+    """A request handler that implements WSGI dispatching.
+
+    If the server has `keep_alive` set it speaks HTTP/1.1 and serves more
+    than one request per connection.  Responses without a Content-Length
+    are then sent with chunked transfer encoding.
+    """
+
+    #: Seconds a kept alive connection may sit idle waiting for its next
+    #: request before it is closed.
+    keep_alive_timeout = 5
+
+    #: Seconds a client gets to send the whole request line and headers,
+    #: however slowly it sends them.
+    request_header_timeout = 10
+
+    #: Seconds any one read of the request body or write of the response
+    #: may block.
+    timeout = 30
+
+    #: Requests served on one connection before it is closed.
+    max_keep_alive_requests = 100
+
+    #: Unread request body bytes that are read and thrown away to keep the
+    #: connection open; with more left the connection is closed instead.
+    max_drain = 64 * 1024
+
+    requests_handled = 0
 
     @property
     def server_version(self):
         return 'Werkzeug/' + werkzeug.__version__
 
+    @property
+    def protocol_version(self):
+        return getattr(self.server, 'keep_alive', False) and 'HTTP/1.1' or 'HTTP/1.0'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # A response goes out in a few small writes.  Closing the connection
+        # flushes them; on a kept alive one Nagle's algorithm would hold the
+        # last back until the client's delayed ACK, some 40ms later.
+        if getattr(self.server, 'keep_alive', False) and \
+                self.connection.family in (socket.AF_INET, getattr(socket, 'AF_INET6', None)):
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
     def make_environ(self):
         request_url = url_parse(self.path)
 
@@ -114,10 +202,25 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
         url_scheme = self.server.ssl_context is None and 'http' or 'https'
         path_info = url_unquote(request_url.path)
 
+        # On a kept alive connection the next request follows this one's
+        # body, so the application may only read up to the end of the body.
+        # Chunked request bodies are not decoded: those connections close.
+        if self.headers.get('Transfer-Encoding', '').lower().strip() == 'chunked':
+            self.close_connection = True
+            input_stream = self.rfile
+        else:
+            try:
+                content_length = max(0, int(self.headers.get('Content-Length') or 0))
+            except ValueError:
+                content_length = 0
+                self.close_connection = True
+            input_stream = LimitedStream(self.rfile, content_length)
+
         environ = {
             'wsgi.version':         (1, 0),
             'wsgi.url_scheme':      url_scheme,
-            'wsgi.input':           self.rfile,
+            'wsgi.input':           input_stream,
+            'wsgi.file_wrapper':    FileWrapper,
             'wsgi.errors':          sys.stderr,
             'wsgi.multithread':     self.server.multithread,
             'wsgi.multiprocess':    self.server.multiprocess,
@@ -153,6 +256,8 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
         self.environ = environ = self.make_environ()
         headers_set = []
         headers_sent = []
+        # [has a body, is chunked], set when the headers are sent
+        framing = [True, False]
 
         def write(data):
             assert headers_set, 'write() before start_response'
@@ -162,15 +267,26 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
                     code, msg = status.split(None, 1)
                 except ValueError:
                     code, msg = status, ""
-                self.send_response(int(code), msg)
+                code = int(code)
+                self.send_response(code, msg)
                 header_keys = set()
                 for key, value in response_headers:
                     self.send_header(key, value)
                     key = key.lower()
                     header_keys.add(key)
-                if 'content-length' not in header_keys:
-                    self.close_connection = True
+                framing[0] = self.command != 'HEAD' and \
+                    code >= 200 and code not in (204, 304)
+                if 'content-length' not in header_keys and framing[0]:
+                    if self.close_connection or self.request_version < 'HTTP/1.1' \
+                            or self.protocol_version < 'HTTP/1.1':
+                        self.close_connection = True
+                    else:
+                        framing[1] = True
+                        self.send_header('Transfer-Encoding', 'chunked')
+                if self.close_connection:
                     self.send_header('Connection', 'close')
+                elif self.request_version < 'HTTP/1.1':
+                    self.send_header('Connection', 'keep-alive')
                 if 'server' not in header_keys:
                     self.send_header('Server', self.version_string())
                 if 'date' not in header_keys:
@@ -178,7 +294,12 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
                 self.end_headers()
 
             assert isinstance(data, bytes), 'applications must write bytes'
-            self.wfile.write(data)
+            if not framing[0] or not data:
+                pass
+            elif framing[1]:
+                self.wfile.write(('%X\r\n' % len(data)).encode('ascii') + data + b'\r\n')
+            else:
+                self.wfile.write(data)
             self.wfile.flush()
 
         def start_response(status, response_headers, exc_info=None):
@@ -196,10 +317,29 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
         def execute(app):
             application_iter = app(environ, start_response)
             try:
-                for data in application_iter:
-                    write(data)
+                sendfile = headers_set and self.sendfile_args(application_iter)
+                if sendfile:
+                    write(b'')
+                if sendfile and framing[0] and not framing[1]:
+                    # Straight from the file to the socket (os.sendfile)
+                    file, offset, count = sendfile
+                    for key, value in headers_sent[1]:
+                        if key.lower() == 'content-length':
+                            count = int(value)
+                    if count != 0:
+                        sent = self.connection.sendfile(file, offset, count)
+                        if count is not None and sent != count:
+                            # The file ended early: the client still waits
+                            # for the rest, only closing ends the response
+                            self.close_connection = True
+                else:
+                    for data in application_iter:
+                        write(data)
                 if not headers_sent:
                     write(b'')
+                if framing[1]:
+                    self.wfile.write(b'0\r\n\r\n')
+                    self.wfile.flush()
             finally:
                 if hasattr(application_iter, 'close'):
                     application_iter.close()
@@ -207,9 +347,13 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
 
         try:
             execute(self.server.app)
+            self.drain_request_body(environ['wsgi.input'])
         except (socket.error, socket.timeout) as e:
+            self.close_connection = True
             self.connection_dropped(e, environ)
         except Exception:
+            # Whatever was sent, the connection is in no state to reuse
+            self.close_connection = True
             if self.server.passthrough_errors:
                 raise
             from werkzeug.debug.tbtools import get_current_traceback
@@ -225,6 +369,41 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
             self.server.log('error', 'Error on request:\n%s',
                             traceback.plaintext)
 
+    def sendfile_args(self, iterable):
+        """``(file, offset, count)`` if the response iterable is a
+        :class:`FileWrapper` over a regular file, or a range of one, which
+        can then be sent without reading it into Python.  `count` is
+        ``None`` for the rest of the file.
+        """
+        offset = count = None
+        if isinstance(iterable, _RangeWrapper):
+            offset, count = iterable.start_byte, iterable.byte_range
+            iterable = iterable.iterable
+        if type(iterable) is not FileWrapper or \
+                not hasattr(self.connection, 'sendfile'):
+            return None
+        file = iterable.file
+        try:
+            if not stat.S_ISREG(os.fstat(file.fileno()).st_mode):
+                return None
+            if offset is None:
+                offset = file.tell()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+        return file, offset, count
+
+    def drain_request_body(self, stream):
+        """Reads what the application left of the request body, so the next
+        request on the connection starts where it should.  Closes the
+        connection instead if more than `max_drain` bytes are left.
+        """
+        if not isinstance(stream, LimitedStream) or stream.is_exhausted:
+            return
+        if stream.limit - stream._pos > self.max_drain:
+            self.close_connection = True
+        else:
+            stream.exhaust()
+
     def handle(self):
         """Handles a request ignoring dropped connections."""
         rv = None
@@ -260,11 +439,38 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
 
     def handle_one_request(self):
         """Handle a single HTTP request."""
-        self.raw_requestline = self.rfile.readline()
-        if not self.raw_requestline:
+        # Wait for the request to start: no longer than keep_alive_timeout
+        # between requests on one connection.  A timeout ends up in handle()
+        # as a dropped connection.
+        if self.requests_handled:
+            self.connection.settimeout(self.keep_alive_timeout)
+            if hasattr(self.rfile, 'peek') and not self.rfile.peek(1):
+                self.close_connection = 1
+                return
+
+        rfile = self.rfile
+        self.rfile = _HeaderDeadlineReader(
+            rfile, self.connection, time.time() + self.request_header_timeout)
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+            if not self.raw_requestline:
+                self.close_connection = 1
+                return
+            if not self.parse_request():
+                return
+        finally:
+            self.rfile = rfile
+        self.connection.settimeout(self.timeout)
+
+        self.requests_handled += 1
+        if self.requests_handled >= self.max_keep_alive_requests or \
+                not self.server.can_keep_alive():
             self.close_connection = 1
-        elif self.parse_request():
-            return self.run_wsgi()
+        return self.run_wsgi()
+
+    def handle_expect_100(self):
+        # run_wsgi sends the 100 Continue
+        return True
 
     def send_response(self, code, message=None):
         """Send the response header and log the response code."""
@@ -273,7 +479,13 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
             message = code in self.responses and self.responses[code][0] or ''
         if self.request_version != 'HTTP/0.9':
             hdr = "%s %d %s\r\n" % (self.protocol_version, code, message)
-            self.wfile.write(hdr.encode('ascii'))
+            # Sent along with the headers where the base class buffers them
+            if hasattr(BaseHTTPRequestHandler, 'flush_headers'):
+                if not hasattr(self, '_headers_buffer'):
+                    self._headers_buffer = []
+                self._headers_buffer.append(hdr.encode('ascii'))
+            else:
+                self.wfile.write(hdr.encode('ascii'))
 
     def version_string(self):
         return BaseHTTPRequestHandler.version_string(self).strip()
@@ -490,6 +702,11 @@ class BaseWSGIServer(HTTPServer, object):
     multiprocess = False
     request_queue_size = LISTEN_QUEUE
 
+    #: Whether to speak HTTP/1.1 and keep connections open between requests.
+    #: Off for the single threaded server, where a connection waiting for
+    #: its next request would hold up every other client.
+    keep_alive = False
+
     def __init__(self, host, port, app, handler=None,
                  passthrough_errors=False, ssl_context=None, fd=None):
         if handler is None:
@@ -551,18 +768,26 @@ class BaseWSGIServer(HTTPServer, object):
         con, info = self.socket.accept()
         return con, info
 
+    def can_keep_alive(self):
+        """Whether the connection of the request about to be served may be
+        kept open after it.
+        """
+        return self.keep_alive and not self.shutdown_signal
+
 
 class ThreadedWSGIServer(ThreadingMixIn, BaseWSGIServer):
 
     """A WSGI server that does threading."""
     multithread = True
     daemon_threads = True
+    keep_alive = True
 
 
 class ForkingWSGIServer(ForkingMixIn, BaseWSGIServer):
 
     """A WSGI server that does forking."""
     multiprocess = True
+    keep_alive = True
 
     def __init__(self, host, port, app, processes=40, handler=None,
                  passthrough_errors=False, ssl_context=None, fd=None):
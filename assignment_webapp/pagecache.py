@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+MediaServer page cache.
+Keeps rendered catalogue pages in a werkzeug cache: SimpleCache in the
+process, or FileSystemCache so every worker process shares one cache.
+
+Each cached page names the parts of the catalogue it shows ('songs',
+'movies', ...). Every part has a generation counter stored in the cache
+itself, and the counters of a page are part of its cache key: bumping a
+generation after a write makes every page showing that part miss without
+finding or deleting the old entries (they expire). Only processes sharing
+the counters see the bump, so with more than one process the backend has
+to be filesystem (server.py switches to it by setting
+$MEDIASERVER_CACHE_BACKEND); with simple, the other processes serve their
+old pages, 304s and entity cache entries until they expire.
+
+The same generations give pages an ETag and a Last-Modified date, so a
+browser asking again with If-None-Match gets a 304 before the view (and
+its queries) runs. 'catalogue' is bumped with every other part.
+"""
+
+import configparser
+import datetime
+import functools
+import hashlib
+import os
+import threading
+import time
+
+from flask import Response, make_response, request, session
+from flask.globals import _request_ctx_stack
+from werkzeug.contrib.cache import FileSystemCache, NullCache, SimpleCache
+from werkzeug.http import is_resource_modified
+
+
+class PageCache(object):
+    """
+    Rendered responses of GET requests, per path and per anonymous or
+    logged in variant. Hit and miss counters are per process.
+    logged_in() tells the variants apart, by default from the Flask session.
+    The generations are kept in `counters`, `cache` itself unless given
+    (a NullCache keeps nothing, so it needs a store of its own).
+    """
+
+    def __init__(self, cache, timeout=300, logged_in=None, counters=None):
+        self.cache = cache
+        self.counters = counters if counters is not None else cache
+        self.timeout = timeout
+        self.logged_in = logged_in or (lambda: bool(session.get('logged_in')))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.not_modified = 0
+
+    #####################################################
+    #   Generations
+    #####################################################
+
+    def generation(self, name):
+        """ The current generation of a part of the catalogue."""
+        key = 'gen:' + name
+        value = self.counters.get(key)
+        if value is None:
+            # Start from the clock, not 0: a counter lost from the cache
+            # must never come back with a value it already had.
+            self.counters.add(key, int(time.time() * 1000), timeout=0)
+            value = self.counters.get(key)
+        return value or 0
+
+    def generations(self, names):
+        return tuple(self.generation(name) for name in names)
+
+    def bump(self, *names):
+        """ Call after writing to these parts of the catalogue."""
+        for name in names + ('catalogue',):
+            # Moving to the clock as well makes two processes bumping at
+            # once (neither backend increments atomically) very unlikely
+            # to end on the same value.
+            value = max(self.generation(name) + 1, int(time.time() * 1000))
+            self.counters.set('gen:' + name, value, timeout=0)
+
+    #####################################################
+    #   Cached views
+    #####################################################
+
+    def _cacheable(self):
+        return request.method in ('GET', 'HEAD') and not session.get('_flashes')
+
+    def key(self, depends, logged_in):
+        return 'page:%s:%s:%s' % (
+            request.full_path, 'user' if logged_in else 'anon',
+            '.'.join(str(g) for g in self.generations(depends)))
+
+    def validators(self, depends):
+        """
+        (ETag, Last-Modified) of the current request's page. Generations
+        start from and move to the clock in milliseconds, so the latest one
+        is when the page last changed. Changes made behind the app's back
+        are picked up when the ETag rolls over every `timeout` seconds.
+        """
+        generations = self.generations(depends)
+        window = int(time.time() // self.timeout) if self.timeout > 0 else 0
+        tag = '%s|%s|%s|%d' % (request.full_path, self.logged_in(),
+                               '.'.join(str(g) for g in generations), window)
+        etag = hashlib.sha1(tag.encode('utf-8')).hexdigest()
+        last_modified = datetime.datetime.utcfromtimestamp(max(generations) / 1000.0)
+        return etag, last_modified
+
+    def conditional(self, *depends):
+        """
+        Decorator adding an ETag and Last-Modified to the responses of a
+        view showing the given parts of the catalogue, and answering a
+        request for a page the browser already has with 304 Not Modified
+        without calling the view.
+        """
+        depends = depends or ('catalogue',)
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self._cacheable():
+                    return view(*args, **kwargs)
+                etag, last_modified = self.validators(depends)
+                if not is_resource_modified(request.environ, etag=etag,
+                                            last_modified=last_modified):
+                    self._count('not_modified')
+                    response = Response(status=304)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                # Pages differ for logged in users: browsers only, and
+                # always ask before reusing a page.
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+    def cached(self, *depends):
+        """
+        Decorator caching the responses of a view showing the given parts
+        of the catalogue (and making them conditional, see conditional()).
+        Requests with flashed messages waiting are not cached, as the
+        messages are part of the page.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self._cacheable():
+                    self._count('bypassed')
+                    return view(*args, **kwargs)
+                key = self.key(depends, self.logged_in())
+                entry = self.cache.get(key)
+                if entry is not None:
+                    self._count('hits')
+                    return Response(entry['body'], mimetype=entry['mimetype'])
+                self._count('misses')
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    body = response.get_data()
+                    if not getattr(_request_ctx_stack.top, 'flashes', None):
+                        self.cache.set(key, {'body': body, 'mimetype': response.mimetype},
+                                       timeout=self.timeout)
+                return response
+            return self.conditional(*depends)(wrapper)
+        return decorator
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses,
+                     'bypassed': self.bypassed, 'not_modified': self.not_modified}
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+        stats['backend'] = type(self.cache).__name__
+        stats['timeout'] = self.timeout
+        return stats
+
+
+def from_config(path='config.ini'):
+    """ A PageCache set up from the [CACHE] section of config.ini."""
+    config = configparser.ConfigParser()
+    config.read(path)
+    if 'CACHE' not in config:
+        config['CACHE'] = {}
+    section = config['CACHE']
+    backend = os.environ.get('MEDIASERVER_CACHE_BACKEND') or section.get('backend', 'simple')
+    threshold = section.getint('threshold', 500)
+    if backend == 'filesystem':
+        cache = FileSystemCache(section.get('dir', 'page_cache'), threshold=threshold)
+    elif backend == 'null':
+        # Pages are not kept, but ETags and the entity cache still need
+        # generations that move
+        return PageCache(NullCache(), timeout=section.getint('timeout', 300),
+                         counters=SimpleCache(threshold=threshold))
+    else:
+        cache = SimpleCache(threshold=threshold)
+    return PageCache(cache, timeout=section.getint('timeout', 300))
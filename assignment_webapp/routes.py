@@ -12,19 +12,58 @@ You will have to make
 # Importing the required packages
 from modules import *
 from flask import *
+from werkzeug.local import LocalProxy
+from werkzeug.wsgi import wrap_file
 import database
-import requests
+import base64
 import json
+import mimetypes
+import os
+import time
 
-user_details = {}                   # User details kept for us
-session = {}                        # Session information (logged in state)
-page = {}                           # Determines the page information
+# Everything kept about a visitor lives in their own request: the logged
+# in state and user details in Flask's session (a signed cookie), the page
+# information in flask.g. Requests can then be served side by side.
+
+def _page():
+    if not hasattr(g, 'page'):
+        g.page = {}
+    return g.page
+
+user_details = LocalProxy(lambda: session.get('user', {}))  # User details kept for us
+page = LocalProxy(_page)            # Determines the page information
+
+def load_secret_key():
+    """
+    The key the session cookie is signed with. Whoever has it can sign a
+    cookie saying they are logged in as anyone, so it is never in the
+    repository: it comes from $MEDIASERVER_SECRET_KEY, or from the
+    [SESSION] secret_key_file, which is generated (readable by its owner
+    only) the first time. Every process serving the app must use the same key.
+    """
+    if os.environ.get('MEDIASERVER_SECRET_KEY'):
+        return os.environ['MEDIASERVER_SECRET_KEY'].encode('utf-8')
+    path = database.read_config()['SESSION'].get('secret_key_file', 'secret_key')
+    try:
+        # O_EXCL: of several workers starting at once, one writes the key
+        # and the others read it
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            with open(path, 'rb') as f:
+                key = f.read()
+            if key:
+                return key
+            time.sleep(0.1)             # still being written
+        raise RuntimeError("secret key file %s is empty" % path)
+    key = base64.b64encode(os.urandom(48))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
 
 # Initialise the application
 app = Flask(__name__)
-app.secret_key = """U29tZWJvZHkgb25jZSB0b2xkIG1lIFRoZSB3b3JsZCBpcyBnb25uYSBy
-b2xsIG1lIEkgYWluJ3QgdGhlIHNoYXJwZXN0IHRvb2wgaW4gdGhlIHNoZWQgU2hlIHdhcyBsb29r
-aW5nIGtpbmRhIGR1bWIgV2l0aCBoZXIgZmluZ2VyIGFuZCBoZXIgdGh1bWIK"""
+app.secret_key = load_secret_key()
 
 
 #####################################################
@@ -40,20 +79,15 @@ def index():
         - Shows superUser status
     """
     # Check if the user is logged in, if not: back to login.
-    if('logged_in' not in session or not session['logged_in']):
+    if('logged_in' not in session or not session['logged_in'] or 'user' not in session):
         return redirect(url_for('login'))
 
     page['title'] = 'User Management'
 
-    # Get a list of user playlists
-    user_playlists = None
-    user_playlists = database.user_playlists(user_details['username'])
-    # Get a list of subscribed podcasts
-    user_subscribed_podcasts = None
-    user_subscribed_podcasts = database.user_podcast_subscriptions(user_details['username'])
-    # Get a list of in-progress items
-    user_in_progress_items = None
-    user_in_progress_items = database.user_in_progress_items(user_details['username'])
+    # Get the user's playlists, subscribed podcasts and in-progress items
+    # (one round trip for all three)
+    user_playlists, user_subscribed_podcasts, user_in_progress_items = \
+        database.get_user_home(user_details['username'])
     # Data integrity checks
     if user_playlists == None:
         user_playlists = []
@@ -72,6 +106,39 @@ def index():
                            subpodcasts=user_subscribed_podcasts,
                            usercurrent=user_in_progress_items)
 
+#####################################################
+#   Server statistics
+#####################################################
+
+@app.route('/stats/pool')
+def pool_stats():
+    """
+    Database connection pool usage as JSON (in use, idle, wait times).
+    """
+    return jsonify(database.pool_stats())
+
+@app.route('/stats/enrichment')
+def enrichment_stats():
+    """
+    Progress and throughput of the OMDb ratings enrichment job as JSON.
+    """
+    return jsonify(database.enrichment_progress() or {})
+
+@app.route('/stats/cache')
+def cache_stats():
+    """
+    Page and entity cache hits and misses of this process as JSON.
+    """
+    return jsonify(pages=database.page_cache.stats(),
+                   entities=database.entity_cache.stats())
+
+@app.route('/stats/autocomplete')
+def autocomplete_stats():
+    """
+    Size, memory footprint and build time of the autocomplete index as JSON.
+    """
+    return jsonify(database.title_index.stats())
+
 #####################################################
 #####################################################
 ####    User Management
@@ -100,18 +167,17 @@ def login():
 
         # If it's null, saying they have incorrect details
         if login_return_data is None:
-            page['bar'] = False
-            flash("Incorrect username/password, please try again")
+            flash("Incorrect username/password, please try again", 'error')
             return redirect(url_for('login'))
 
         # If there was no error, log them in
-        page['bar'] = True
-        flash('You have been logged in successfully')
+        flash('You have been logged in successfully', 'success')
         session['logged_in'] = True
 
-        # Store the user details for us to use throughout
-        global user_details
-        user_details = login_return_data[0]
+        # Store the user details for us to use throughout (not the
+        # password: the session cookie is signed, not encrypted)
+        user = login_return_data[0]
+        session['user'] = {'username': user['username'], 'issuper': user['issuper']}
 
         return redirect(url_for('index'))
 
@@ -130,8 +196,8 @@ def logout():
         - Removes any stored user data.
     """
     session['logged_in'] = False
-    page['bar'] = True
-    flash('You have been logged out')
+    session.pop('user', None)
+    flash('You have been logged out', 'success')
     return redirect(url_for('index'))
 
 #####################################################
@@ -141,10 +207,90 @@ def logout():
 #####################################################
 
 
+#####################################################
+#   Pages of the lists
+#   The list pages show their first page of rows, the
+#   tables ask /data/<kind> for the others (DataTables
+#   server-side processing, see keyset_tables.js).
+#####################################################
+
+# kind -> the item type in SEARCH_RESULT_PAGES its rows link to
+LIST_ITEM_TYPES = {
+    'artists': 'artist',
+    'songs': 'song',
+    'podcasts': 'podcast',
+    'albums': 'album',
+    'tvshows': 'tvshow',
+    'movies': 'movie',
+}
+
+def list_table(kind, cursor):
+    """ Where the table of a list page gets its other pages from."""
+    return {'source': url_for('list_data', kind=kind),
+            'total': database.list_total(kind) or 0,
+            'cursor': cursor or '',
+            'length': database.LIST_PAGE_SIZE}
+
+def list_row(kind, row):
+    """ A list row as JSON, with the link to its item page."""
+    spec = database.LIST_PAGES[kind]
+    label, endpoint, arg = SEARCH_RESULT_PAGES[LIST_ITEM_TYPES[kind]]
+    data = {}
+    for column, value in row.items():
+        if column == 'sort_name':
+            continue
+        if not isinstance(value, (int, float, str, type(None))):
+            value = str(value)          # as the templates show it
+        data[column] = value
+    data['url'] = url_for(endpoint, **{arg: row[spec['id']]})
+    return data
+
+@app.route('/data/<kind>')
+def list_data(kind):
+    """
+    One page of a list as JSON, in the DataTables server-side processing
+    format: draw, start, length, search[value] and order[0][column] /
+    order[0][dir] over columns[i][data] (only the id and name columns
+    sort). &cursor= (the next_cursor of the previous page) seeks straight
+    to the page instead of skipping `start` rows.
+    Can do this without a login, like the list pages.
+    """
+    if kind not in database.LIST_PAGES:
+        abort(404)
+    spec = database.LIST_PAGES[kind]
+    args = request.args
+    try:
+        draw = int(args.get('draw', 0))
+        start = max(0, int(args.get('start', 0)))
+        length = int(args.get('length', database.LIST_PAGE_SIZE))
+    except ValueError:
+        abort(400)
+    if length <= 0:                     # DataTables' "All"
+        length = database.LIST_MAX_PAGE_SIZE
+    search = args.get('search[value]', '').strip()
+
+    order_by = 'id'
+    column = args.get('columns[%s][data]' % args.get('order[0][column]', '0'))
+    if column == spec['name']:
+        order_by = 'name'
+    descending = args.get('order[0][dir]') == 'desc'
+
+    rows, next_cursor = database.get_list_page(
+        kind, length, after=args.get('cursor') or None, order_by=order_by,
+        descending=descending, search=search, offset=start)
+    total = database.list_total(kind) or 0
+    return jsonify(draw=draw,
+                   recordsTotal=total,
+                   recordsFiltered=database.count_list(kind, search) if search else total,
+                   data=[list_row(kind, row) for row in rows or []],
+                   next_cursor=next_cursor)
+
+
 #####################################################
 #   List Artists
 #####################################################
 @app.route('/list/artists')
+@database.page_cache.cached('artists')
 def list_artists():
     """
     Lists all the artists in your media server
@@ -156,9 +302,9 @@ def list_artists():
 
     page['title'] = 'List Artists'
 
-    # Get a list of all artists from the database
+    # Get the first page of artists from the database, the table asks for the rest
     allartists = None
-    allartists = database.get_allartists()
+    allartists, cursor = database.get_allartists(limit=database.LIST_PAGE_SIZE)
 
     # Data integrity checks
     if allartists == None:
@@ -169,13 +315,15 @@ def list_artists():
                            session=session,
                            page=page,
                            user=user_details,
-                           allartists=allartists)
+                           allartists=allartists,
+                           listtable=list_table('artists', cursor))
 
 
 #####################################################
 #   List Songs
 #####################################################
 @app.route('/list/songs')
+@database.page_cache.cached('songs', 'artists')
 def list_songs():
     """
     Lists all the songs in your media server
@@ -187,9 +335,9 @@ def list_songs():
 
     page['title'] = 'List Songs'
 
-    # Get a list of all songs from the database
+    # Get the first page of songs from the database, the table asks for the rest
     allsongs = None
-    allsongs = database.get_allsongs()
+    allsongs, cursor = database.get_allsongs(limit=database.LIST_PAGE_SIZE)
 
 
     # Data integrity checks
@@ -201,12 +349,14 @@ def list_songs():
                            session=session,
                            page=page,
                            user=user_details,
-                           allsongs=allsongs)
+                           allsongs=allsongs,
+                           listtable=list_table('songs', cursor))
 
 #####################################################
 #   List Podcasts
 #####################################################
 @app.route('/list/podcasts')
+@database.page_cache.cached('podcasts')
 def list_podcasts():
     """
     Lists all the podcasts in your media server
@@ -218,9 +368,9 @@ def list_podcasts():
 
     page['title'] = 'List podcasts'
 
-    # Get a list of all podcasts from the database
+    # Get the first page of podcasts from the database, the table asks for the rest
     allpodcasts = None
-    allpodcasts = database.get_allpodcasts()
+    allpodcasts, cursor = database.get_allpodcasts(limit=database.LIST_PAGE_SIZE)
 
     # Data integrity checks
     if allpodcasts == None:
@@ -231,13 +381,15 @@ def list_podcasts():
                            session=session,
                            page=page,
                            user=user_details,
-                           allpodcasts=allpodcasts)
+                           allpodcasts=allpodcasts,
+                           listtable=list_table('podcasts', cursor))
 
 
 #####################################################
 #   List Movies
 #####################################################
 @app.route('/list/movies')
+@database.page_cache.cached('movies')
 def list_movies():
     """
     Lists all the movies in your media server
@@ -249,9 +401,9 @@ def list_movies():
 
     page['title'] = 'List Movies'
 
-    # Get a list of all movies from the database
+    # Get the first page of movies from the database, the table asks for the rest
     allmovies = None
-    allmovies = database.get_allmovies()
+    allmovies, cursor = database.get_allmovies(limit=database.LIST_PAGE_SIZE)
 
     # Data integrity checks
     if allmovies == None:
@@ -261,277 +413,98 @@ def list_movies():
                            session=session,
                            page=page,
                            user=user_details,
-                           allmovies=allmovies)
+                           allmovies=allmovies,
+                           listtable=list_table('movies', cursor))
 
 #####################################################
 #   List Movies Ratings
 #####################################################
-@app.route('/list/movies/ratings')
-def list_movies_ratings():
-    """
-    Lists all the movies in your media server
-    Can do this without a login
-    """
-    # # Check if the user is logged in, if not: back to login.
-    # if('logged_in' not in session or not session['logged_in']):
-    #     return redirect(url_for('login'))
-
-    page['title'] = 'List Movies'
-
-    # Get a list of all movies from the database
-    allmovies = None
-    allmovies = database.get_allmovies_ratings()
-
-    # Data integrity checks
-    if allmovies == None:
-        allmovies = []
-
-    return render_template('listitems/movieratings/ratings_index.html',
-                           session=session,
-                           page=page,
-                           user=user_details,
-                           allmovies=allmovies)
-
-
-#####################################################
-#   List Movies Sorted IMDB
-#####################################################
-@app.route('/list/movies/ratings/sortedIMDB')
-def ratings_sorted_IMDB():
-    """
-    Lists all the movies in your media server
-    Can do this without a login
-    """
-    # # Check if the user is logged in, if not: back to login.
-    # if('logged_in' not in session or not session['logged_in']):
-    #     return redirect(url_for('login'))
-
-    page['title'] = 'List Movies'
 
-    # Get a list of all movies from the database
-    allmovies = None
-    allmovies = database.sort_by_rating("IMDB")
+# filter -> (title, what the highlighted column is)
+RATINGS_FILTER_VIEWS = {
+    'all': ('All Movies –– Ratings Included', None),
+    'top250': ('Movies in the IMDB 250', 'top250'),
+    'top100': ('Movies in the IMDB 100', 'top100'),
+    'both': ('Movies in both IMDB 250 and IMDB 100', 'top250'),
+}
 
-    # Data integrity checks
-    if allmovies == None:
-        allmovies = []
+# sort -> (subtitle, the highlighted column)
+RATINGS_SORT_VIEWS = {
+    'id': (None, None),
+    'imdb': ('Movies sorted by IMDB rating, ties resolved using number of IMDB votes', 'imdb_score'),
+    'rt': ('Movies sorted by Rotten Tomatoes score, ties resolved using IMDB rating', 'rt_score'),
+}
 
-    return render_template('listitems/movieratings/sorted_IMDB.html',
-                           session=session,
-                           page=page,
-                           user=user_details,
-                           allmovies=allmovies)
-
-#####################################################
-#   List Movies Sorted Rotten Tomatoes
-#####################################################
-@app.route('/list/movies/ratings/sortedRT')
-def ratings_sorted_RT():
-    """
-    Lists all the movies in your media server
-    Can do this without a login
-    """
-    # # Check if the user is logged in, if not: back to login.
-    # if('logged_in' not in session or not session['logged_in']):
-    #     return redirect(url_for('login'))
-
-    page['title'] = 'List Movies'
-
-    # Get a list of all movies from the database
-    allmovies = None
-    allmovies = database.sort_by_rating("RT")
-
-    # Data integrity checks
-    if allmovies == None:
-        allmovies = []
-
-    return render_template('listitems/movieratings/sorted_RT.html',
-                           session=session,
-                           page=page,
-                           user=user_details,
-                           allmovies=allmovies)
-
-#####################################################
-#   List Movies in IMDB 250, order by IMDB score
-#####################################################
-@app.route('/list/movies/ratings/IMDB250_IMDB')
-def filter_top250_IMDB():
-    """
-    Lists all the movies in your media server
-    Can do this without a login
-    """
-    # # Check if the user is logged in, if not: back to login.
-    # if('logged_in' not in session or not session['logged_in']):
-    #     return redirect(url_for('login'))
-
-    page['title'] = 'List Movies'
-
-    # Get a list of all movies from the database
-    allmovies = None
-    allmovies = database.get_in_top("top250", "IMDB")
-
-    # Data integrity checks
-    if allmovies == None:
-        allmovies = []
-
-    return render_template('listitems/movieratings/filter_top250_IMDB.html',
-                           session=session,
-                           page=page,
-                           user=user_details,
-                           allmovies=allmovies)
-
-#####################################################
-#   List Movies in IMDB 250, order by RT score
-#####################################################
-@app.route('/list/movies/ratings/IMDB250_RT')
-def filter_top250_RT():
-    """
-    Lists all the movies in your media server
-    Can do this without a login
-    """
-    # # Check if the user is logged in, if not: back to login.
-    # if('logged_in' not in session or not session['logged_in']):
-    #     return redirect(url_for('login'))
-
-    page['title'] = 'List Movies'
-
-    # Get a list of all movies from the database
-    allmovies = None
-    allmovies = database.get_in_top("top250", "RT")
-
-    # Data integrity checks
-    if allmovies == None:
-        allmovies = []
-
-    return render_template('listitems/movieratings/filter_top250_RT.html',
-                           session=session,
-                           page=page,
-                           user=user_details,
-                           allmovies=allmovies)
-
-#####################################################
-#   List Movies in IMDB 100, sorted by IMDB score
-#####################################################
-@app.route('/list/movies/ratings/IMDB100')
-def filter_top100_IMDB():
-    """
-    Lists all the movies in your media server
-    Can do this without a login
-    """
-    # # Check if the user is logged in, if not: back to login.
-    # if('logged_in' not in session or not session['logged_in']):
-    #     return redirect(url_for('login'))
-
-    page['title'] = 'List Movies'
-
-    # Get a list of all movies from the database
-    allmovies = None
-    allmovies = database.get_in_top("top100", "IMDB")
-
-    # Data integrity checks
-    if allmovies == None:
-        allmovies = []
-
-    return render_template('listitems/movieratings/filter_top100_IMDB.html',
-                           session=session,
-                           page=page,
-                           user=user_details,
-                           allmovies=allmovies)
-
-#####################################################
-#   List Movies in IMDB 100, sorted by RT score
-#####################################################
-@app.route('/list/movies/ratings/IMDB100_RT')
-def filter_top100_RT():
-    """
-    Lists all the movies in your media server
-    Can do this without a login
-    """
-    # # Check if the user is logged in, if not: back to login.
-    # if('logged_in' not in session or not session['logged_in']):
-    #     return redirect(url_for('login'))
-
-    page['title'] = 'List Movies'
-
-    # Get a list of all movies from the database
-    allmovies = None
-    allmovies = database.get_in_top("top100", "RT")
-
-    # Data integrity checks
-    if allmovies == None:
-        allmovies = []
-
-    return render_template('listitems/movieratings/filter_top100_RT.html',
-                           session=session,
-                           page=page,
-                           user=user_details,
-                           allmovies=allmovies)
-
-
-#####################################################
-#   List Movies in IMDB 250  and IMDB 100, sorted by IMDB
-#####################################################
-@app.route('/list/movies/ratings/IMDB250_and_IMDB100')
-def filter_top250andtop100_IMDB():
+@app.route('/list/movies/ratings')
+def list_movies_ratings():
     """
-    Lists all the movies in your media server
+    Lists the movies with ratings in your media server, a page at a time.
+    ?filter= is all, top250, top100 or both, ?sort= is id, imdb or rt and
+    ?after= the cursor of the page before.
     Can do this without a login
     """
-    # # Check if the user is logged in, if not: back to login.
-    # if('logged_in' not in session or not session['logged_in']):
-    #     return redirect(url_for('login'))
+    filter_by = request.args.get('filter', 'all')
+    sort_by = request.args.get('sort', 'id')
+    if filter_by not in RATINGS_FILTER_VIEWS or sort_by not in RATINGS_SORT_VIEWS:
+        abort(404)
 
     page['title'] = 'List Movies'
 
-    # Get a list of all movies from the database
-    allmovies = None
-    allmovies = database.get_in_top("both", "IMDB")
-
-    # Data integrity checks
-    if allmovies == None:
-        allmovies = []
-
-    return render_template('listitems/movieratings/filter_top250andtop100_IMDB.html',
-                           session=session,
-                           page=page,
-                           user=user_details,
-                           allmovies=allmovies)
-
-
-#####################################################
-#   List Movies in IMDB 250  and IMDB 100, sorted by RT
-#####################################################
-@app.route('/list/movies/ratings/IMDB250_and_IMDB100_RT')
-def filter_top250andtop100_RT():
-    """
-    Lists all the movies in your media server
-    Can do this without a login
-    """
-    # # Check if the user is logged in, if not: back to login.
-    # if('logged_in' not in session or not session['logged_in']):
-    #     return redirect(url_for('login'))
-
-    page['title'] = 'List Movies'
+    # Movies with old ratings are refreshed in the background
+    database.refresh_stale_ratings()
 
-    # Get a list of all movies from the database
-    allmovies = None
-    allmovies = database.get_in_top("both", "RT")
+    # Get a page of the movies from the database
+    allmovies, cursor = database.get_movie_ratings(
+        filter_by, sort_by, after=request.args.get('after'))
 
     # Data integrity checks
     if allmovies == None:
         allmovies = []
 
-    return render_template('listitems/movieratings/filter_top250andtop100_RT.html',
+    title, filter_column = RATINGS_FILTER_VIEWS[filter_by]
+    subtitle, sort_column = RATINGS_SORT_VIEWS[sort_by]
+    if filter_by != 'all' and subtitle is None:
+        subtitle = 'Movies sorted by ID'
+    if filter_by == 'all' and sort_by != 'id':
+        title = 'Movies Sorted by %s' % ('IMDB Rating' if sort_by == 'imdb' else 'Rotten Tomatoes Score')
+    return render_template('listitems/movieratings/ratings.html',
                            session=session,
                            page=page,
                            user=user_details,
-                           allmovies=allmovies)
+                           allmovies=allmovies,
+                           ratings={'filter': filter_by,
+                                    'sort': sort_by,
+                                    'title': title,
+                                    'subtitle': subtitle,
+                                    'highlight': filter_column or sort_column,
+                                    'cursor': cursor})
+
+# The old ratings addresses, one per view
+RATINGS_OLD_VIEWS = {
+    'sortedIMDB': ('all', 'imdb'),
+    'sortedRT': ('all', 'rt'),
+    'IMDB250_IMDB': ('top250', 'imdb'),
+    'IMDB250_RT': ('top250', 'rt'),
+    'IMDB100': ('top100', 'imdb'),
+    'IMDB100_RT': ('top100', 'rt'),
+    'IMDB250_and_IMDB100': ('both', 'imdb'),
+    'IMDB250_and_IMDB100_RT': ('both', 'rt'),
+}
+
+@app.route('/list/movies/ratings/<view>')
+def list_movies_ratings_view(view):
+    """ Sends the old address of a ratings view to the new one."""
+    if view not in RATINGS_OLD_VIEWS:
+        abort(404)
+    filter_by, sort_by = RATINGS_OLD_VIEWS[view]
+    return redirect(url_for('list_movies_ratings', filter=filter_by, sort=sort_by), code=301)
 
 
 #####################################################
 #   List Albums
 #####################################################
 @app.route('/list/albums')
+@database.page_cache.cached('albums', 'songs', 'artists')
 def list_albums():
     """
     Lists all the albums in your media server
@@ -543,9 +516,9 @@ def list_albums():
 
     page['title'] = 'List Albums'
 
-    # Get a list of all Albums from the database
+    # Get the first page of Albums from the database, the table asks for the rest
     allalbums = None
-    allalbums = database.get_allalbums()
+    allalbums, cursor = database.get_allalbums(limit=database.LIST_PAGE_SIZE)
 
 
     # Data integrity checks
@@ -557,13 +530,15 @@ def list_albums():
                            session=session,
                            page=page,
                            user=user_details,
-                           allalbums=allalbums)
+                           allalbums=allalbums,
+                           listtable=list_table('albums', cursor))
 
 
 #####################################################
 #   List TVShows
 #####################################################
 @app.route('/list/tvshows')
+@database.page_cache.cached('tvshows')
 def list_tvshows():
     """
     Lists all the tvshows in your media server
@@ -575,9 +550,9 @@ def list_tvshows():
 
     page['title'] = 'List TV Shows'
 
-    # Get a list of all tvshows from the database
+    # Get the first page of tvshows from the database, the table asks for the rest
     alltvshows = None
-    alltvshows = database.get_alltvshows()
+    alltvshows, cursor = database.get_alltvshows(limit=database.LIST_PAGE_SIZE)
 
 
     # Data integrity checks
@@ -589,7 +564,8 @@ def list_tvshows():
                            session=session,
                            page=page,
                            user=user_details,
-                           alltvshows=alltvshows)
+                           alltvshows=alltvshows,
+                           listtable=list_table('tvshows', cursor))
 
 
 
@@ -604,6 +580,7 @@ def list_tvshows():
 #   Individual Artist
 #####################################################
 @app.route('/artist/<artist_id>')
+@database.page_cache.conditional()
 def single_artist(artist_id):
     """
     Show a single artist by artist_id in your media server
@@ -617,7 +594,7 @@ def single_artist(artist_id):
 
     # Get a list of all artist by artist_id from the database
     artist = None
-    artist = database.get_artist(artist_id)
+    artist = database.get_artist_page(artist_id)
 
     # Data integrity checks
     if artist == None:
@@ -634,6 +611,7 @@ def single_artist(artist_id):
 #   Individual Song
 #####################################################
 @app.route('/song/<song_id>')
+@database.page_cache.conditional()
 def single_song(song_id):
     """
     Show a single song by song_id in your media server
@@ -645,12 +623,8 @@ def single_song(song_id):
 
     page['title'] = 'Song'
 
-    # Get a list of all song by song_id from the database
-    song = None
-    song = database.get_song(song_id)
-
-    songmetadata = None
-    songmetadata = database.get_song_metadata(song_id)
+    # Get a list of all song by song_id from the database, with its metadata
+    song, songmetadata = database.get_song_page(song_id)
 
     # Data integrity checks
     if song == None:
@@ -671,6 +645,7 @@ def single_song(song_id):
 #   Individual Podcast
 #####################################################
 @app.route('/podcast/<podcast_id>')
+@database.page_cache.conditional()
 def single_podcast(podcast_id):
     """
     Show a single podcast by podcast_id in your media server
@@ -687,11 +662,7 @@ def single_podcast(podcast_id):
     page['title'] = 'Podcast' # Add the title
 
     # Get a list of all podcasts by podcast_id from the database
-    podcast = None
-    podcast = database.get_podcast(podcast_id)
-
-    podcastEps = None
-    podcastEps = database.get_all_podcasteps_for_podcast(podcast_id)
+    podcast, podcastEps = database.get_podcast_page(podcast_id)
 
     # Data integrity checks
     if podcast == None:
@@ -713,6 +684,7 @@ def single_podcast(podcast_id):
 #   Individual Podcast Episode
 #####################################################
 @app.route('/podcastep/<media_id>')
+@database.page_cache.conditional()
 def single_podcastep(media_id):
     """
     Show a single podcast epsiode by media_id in your media server
@@ -730,7 +702,7 @@ def single_podcastep(media_id):
 
     # Get a list of all podcasts by podcast_id from the database
     podcastEpisode = None
-    podcastEpisode = database.get_podcastep(media_id)
+    podcastEpisode = database.get_podcastep_page(media_id)
 
     # Data integrity checks
 
@@ -749,6 +721,7 @@ def single_podcastep(media_id):
 #   Individual Movie
 #####################################################
 @app.route('/movie/<movie_id>')
+@database.page_cache.conditional()
 def single_movie(movie_id):
     """
     Show a single movie by movie_id in your media server
@@ -762,7 +735,7 @@ def single_movie(movie_id):
 
     # Get a list of all movies by movie_id from the database
     movie = None
-    movie = database.get_movie(movie_id)
+    movie = database.get_movie_page(movie_id)
 
 
     # Data integrity checks
@@ -781,6 +754,7 @@ def single_movie(movie_id):
 #   Individual Album
 #####################################################
 @app.route('/album/<album_id>')
+@database.page_cache.conditional()
 def single_album(album_id):
     """
     Show a single album by album_id in your media server
@@ -792,15 +766,8 @@ def single_album(album_id):
 
     page['title'] = 'List Albums'
 
-    # Get the album plus associated metadata from the database
-    album = None
-    album = database.get_album(album_id)
-
-    album_songs = None
-    album_songs = database.get_album_songs(album_id)
-
-    album_genres = None
-    album_genres = database.get_album_genres(album_id)
+    # Get the album plus associated metadata, songs and genres from the database
+    album, album_songs, album_genres = database.get_album_page(album_id)
 
     # Data integrity checks
     if album_songs == None:
@@ -825,6 +792,7 @@ def single_album(album_id):
 #   Individual TVShow
 #####################################################
 @app.route('/tvshow/<tvshow_id>')
+@database.page_cache.conditional()
 def single_tvshow(tvshow_id):
     """
     Show a single tvshows and its eps in your media server
@@ -836,12 +804,8 @@ def single_tvshow(tvshow_id):
 
     page['title'] = 'TV Show'
 
-    # Get a list of all tvshows by tvshow_id from the database
-    tvshow = None
-    tvshow = database.get_tvshow(tvshow_id)
-
-    tvshoweps = None
-    tvshoweps = database.get_all_tvshoweps_for_tvshow(tvshow_id)
+    # Get a list of all tvshows by tvshow_id from the database, with its episodes
+    tvshow, tvshoweps = database.get_tvshow_page(tvshow_id)
 
     # Data integrity checks
     if tvshow == None:
@@ -861,6 +825,7 @@ def single_tvshow(tvshow_id):
 #   Individual TVShow Episode
 #####################################################
 @app.route('/tvshowep/<tvshowep_id>')
+@database.page_cache.conditional()
 def single_tvshowep(tvshowep_id):
     """
     Show a single tvshow episode in your media server
@@ -874,7 +839,7 @@ def single_tvshowep(tvshowep_id):
 
     # Get a list of all tvshow eps by media_id from the database
     tvshowep = None
-    tvshowep = database.get_tvshowep(tvshowep_id)
+    tvshowep = database.get_tvshowep_page(tvshowep_id)
 
 
     # Data integrity checks
@@ -889,12 +854,159 @@ def single_tvshowep(tvshowep_id):
                            tvshowep=tvshowep)
 
 
+#####################################################
+#   Stream a media file
+#####################################################
+
+# Bytes read at a time when the server cannot sendfile the file
+MEDIA_BUFFER_SIZE = database.read_config()['MEDIA'].getint('buffer_size', 64 * 1024)
+
+@app.route('/stream/<int:media_id>')
+def stream_media(media_id):
+    """
+    Provides /stream/<media_id>: the file of a media item. Range requests
+    get 206 Partial Content (so players can seek), If-Range is honoured and
+    the ETag and Last-Modified let browsers revalidate. The open file is
+    handed to the server, which sends it from the disk with sendfile when
+    it can, and otherwise a buffer at a time.
+    """
+    if('logged_in' not in session or not session['logged_in']):
+        return redirect(url_for('login'))
+
+    path = database.get_media_path(media_id)
+    if not path:
+        abort(404)
+    try:
+        media_file = open(path, 'rb')
+    except (IOError, OSError):
+        abort(404)
+    try:
+        stat = os.fstat(media_file.fileno())
+        response = Response(wrap_file(request.environ, media_file, MEDIA_BUFFER_SIZE),
+                            mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                            direct_passthrough=True)
+        response.content_length = stat.st_size
+        response.last_modified = int(stat.st_mtime)
+        response.set_etag('%x-%x-%x' % (media_id, stat.st_size, stat.st_mtime_ns))
+        return response.make_conditional(request, accept_ranges=True,
+                                         complete_length=stat.st_size)
+    except:
+        media_file.close()
+        raise
+
+
 #####################################################
 #####################################################
 ####    Search Items
 #####################################################
 #####################################################
 
+def search_form():
+    """
+    The search form fields: the search term, whether to match it literally
+    and the offset of the page of results asked for.
+    """
+    try:
+        offset = max(0, int(request.form.get('offset', 0)))
+    except ValueError:
+        offset = 0
+    return {'searchterm': request.form.get('searchterm', ''),
+            'literal': bool(request.form.get('literal')),
+            'offset': offset,
+            'next_offset': offset + database.SEARCH_LIMIT}
+
+#####################################################
+#   Search everything
+#####################################################
+
+# item_type -> (label, endpoint showing the item, its id argument)
+SEARCH_RESULT_PAGES = {
+    'song': ('Song', 'single_song', 'song_id'),
+    'album': ('Album', 'single_album', 'album_id'),
+    'artist': ('Artist', 'single_artist', 'artist_id'),
+    'podcast': ('Podcast', 'single_podcast', 'podcast_id'),
+    'podcastep': ('Podcast Episode', 'single_podcastep', 'media_id'),
+    'movie': ('Movie', 'single_movie', 'movie_id'),
+    'tvshow': ('TV Show', 'single_tvshow', 'tvshow_id'),
+    'tvepisode': ('TV Episode', 'single_tvshowep', 'tvshowep_id'),
+}
+
+@app.route('/search', methods=['POST','GET'])
+def search():
+    """
+    Search every kind of item in your media server at once
+    """
+    # Check if the user is logged in, if not: back to login.
+    if('logged_in' not in session or not session['logged_in']):
+        return redirect(url_for('login'))
+
+    page['title'] = 'Search'
+
+    # Get a list of matching items from the database
+    results = None
+    search = search_form()
+    search['types'] = request.form.getlist('types')
+    if(request.method == 'POST'):
+
+        rows = database.search_all(search['searchterm'],
+                                   types=search['types'],
+                                   offset=search['offset'])
+        if rows is not None:
+            # Artists of the songs and years of the movies found, with one
+            # query per kind for the ones not cached yet
+            songs = database.get_song_summaries(
+                [row['item_id'] for row in rows if row['item_type'] == 'song'])
+            movies = database.get_movie_summaries(
+                [row['item_id'] for row in rows if row['item_type'] == 'movie'])
+            results = []
+            for row in rows:
+                label, endpoint, arg = SEARCH_RESULT_PAGES[row['item_type']]
+                details = ''
+                if row['item_type'] == 'song' and str(row['item_id']) in songs:
+                    details = songs[str(row['item_id'])]['artists'] or ''
+                elif row['item_type'] == 'movie' and str(row['item_id']) in movies:
+                    details = movies[str(row['item_id'])]['release_year'] or ''
+                results.append((row, label, url_for(endpoint, **{arg: row['item_id']}), details))
+
+    # Data integrity checks
+    if results == None or results == []:
+        results = []
+        flash("Nothing found, please try again", 'error')
+    else:
+        flash('Found '+str(len(results))+' results!', 'success')
+
+    return render_template('searchitems/search.html',
+                           session=session,
+                           page=page,
+                           user=user_details,
+                           search=search,
+                           types=[(t, SEARCH_RESULT_PAGES[t][0]) for t in database.SEARCH_TYPES],
+                           more=len(results) == database.SEARCH_LIMIT,
+                           results=results)
+
+#####################################################
+#   Autocomplete
+#####################################################
+@app.route('/autocomplete')
+def autocomplete():
+    """
+    Titles starting with (a word starting with) ?q=, as JSON, for search
+    boxes to suggest as you type. Item pages need no login, so neither
+    does this. &type= (repeatable) limits the kinds of item.
+    """
+    types = request.args.getlist('type') or None
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 50))
+    except ValueError:
+        limit = 10
+    results = []
+    for item_type, item_id, title in database.autocomplete_titles(
+            request.args.get('q', ''), limit=limit, types=types):
+        label, endpoint, arg = SEARCH_RESULT_PAGES[item_type]
+        results.append({'type': item_type, 'label': label, 'id': item_id,
+                        'title': title, 'url': url_for(endpoint, **{arg: item_id})})
+    return jsonify(results=results)
+
 #####################################################
 #   Search TVShow
 #####################################################
@@ -912,24 +1024,26 @@ def search_tvshows():
 
     # Get a list of matching tv shows from the database
     tvshows = None
+    search = search_form()
     if(request.method == 'POST'):
 
-        tvshows = database.find_matchingtvshows(request.form['searchterm'])
+        tvshows = database.find_matchingtvshows(search['searchterm'],
+                                                literal=search['literal'],
+                                                offset=search['offset'])
 
     # Data integrity checks
     if tvshows == None or tvshows == []:
         tvshows = []
-        page['bar'] = False
-        flash("No matching tv shows found, please try again")
+        flash("No matching tv shows found, please try again", 'error')
     else:
-        page['bar'] = True
-        flash('Found '+str(len(tvshows))+' results!')
-        session['logged_in'] = True
+        flash('Found '+str(len(tvshows))+' results!', 'success')
 
     return render_template('searchitems/search_tvshows.html',
                            session=session,
                            page=page,
                            user=user_details,
+                           search=search,
+                           more=len(tvshows) == database.SEARCH_LIMIT,
                            tvshows=tvshows)
 
 #####################################################
@@ -956,27 +1070,29 @@ def search_movies():
 
     page['title'] = 'Movie Search'
 
-    # Get a list of matching tv shows from the database
+    # Get a list of matching movies from the database
     movies = None
+    search = search_form()
     if(request.method == 'POST'):
 
-        movies = database.find_matchingmovies(request.form['searchterm'])
+        movies = database.find_matchingmovies(search['searchterm'],
+                                              literal=search['literal'],
+                                              offset=search['offset'])
 
     # Data integrity checks
     if movies == None or movies == []:
         movies = []
-        page['bar'] = False
-        flash("No matching movies found, please try again")
+        flash("No matching movies found, please try again", 'error')
     else:
-        page['bar'] = True
-        flash('Found '+str(len(movies))+' results!')
-        session['logged_in'] = True
+        flash('Found '+str(len(movies))+' results!', 'success')
 
 
     return render_template('searchitems/search_movies.html',
                            session=session,
                            page=page,
                            user=user_details,
+                           search=search,
+                           more=len(movies) == database.SEARCH_LIMIT,
                            movies=movies)
 
 
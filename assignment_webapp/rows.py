@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+MediaServer result rows.
+Compact row objects returned by the dictfetch* helpers in database.py.
+A row is a tuple that can also be read by column name, as row['col'] or
+row.col, so templates and routes keep working as they did with dicts
+while each row costs a single tuple instead of a dictionary.
+"""
+
+import keyword
+from operator import itemgetter
+
+
+class Row(tuple):
+    """
+    Base class of every row class. Subclasses are made by row_class() and
+    only add the column names, there is no per row dictionary.
+    """
+    __slots__ = ()
+
+    _fields = ()                # column names, duplicates removed
+    _index = {}                 # column name -> position in the tuple
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return [self[name] for name in self._fields]
+
+    def items(self):
+        return [(name, self[name]) for name in self._fields]
+
+    def _asdict(self):
+        """ The row as a plain dict, eg. for json.dumps or the session."""
+        return dict(self.items())
+
+    def __repr__(self):
+        return 'Row(%s)' % ', '.join('%s=%r' % item for item in self.items())
+
+
+# Names a column cannot be exposed as an attribute under, because the row
+# needs them itself.
+_RESERVED = set(dir(Row)) - set(dir(tuple)) | {'__slots__'}
+
+_row_classes = {}
+
+
+def row_class(cols):
+    """
+    Returns the Row subclass for a tuple of column names, making it the
+    first time that column set is seen.
+    When a name appears twice (eg. SELECT * over a join) the last column
+    wins, the same as building a dict from the row would.
+    """
+    cols = tuple(cols)
+    try:
+        return _row_classes[cols]
+    except KeyError:
+        pass
+
+    index = {}
+    for position, name in enumerate(cols):
+        index[name] = position
+    namespace = {
+        '__slots__': (),
+        '_fields': tuple(sorted(index, key=cols.index)),
+        '_index': index,
+    }
+    for name, position in index.items():
+        if name.isidentifier() and not keyword.iskeyword(name) \
+                and name not in _RESERVED:
+            namespace[name] = property(itemgetter(position))
+
+    cls = type('Row', (Row,), namespace)
+    _row_classes[cols] = cls
+    return cls
+
+
+def row_class_for(cursor):
+    """
+    Returns the row class for the statement the cursor just executed.
+    The class is cached on pg8000's prepared statement, so column names are
+    only decoded once per statement and connection.
+    """
+    ps = cursor.ps
+    try:
+        return ps['row_class']
+    except KeyError:
+        cls = ps['row_class'] = row_class(
+            a[0].decode("utf-8") for a in cursor.description)
+        return cls
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+MediaServer production server.
+main.py runs the werkzeug debug server: one process with the reloader and
+the debugger. This one pre-forks worker processes (one per CPU core unless
+the [SERVER] section of config.ini says otherwise), each serving requests
+from its own pool of threads, all accepting from the same listening socket.
+
+A worker is replaced after max_requests requests, which caps how much
+memory a long running worker can grow to. The workers import the app after
+they are forked, so each new worker runs the code currently on disk.
+
+One more process refreshes the IMDb charts snapshot ([CHARTS]), so imdb.com
+is asked once whatever the number of workers; the workers load the snapshot
+again when it changes.
+
+    python3 server.py [--workers N] [--threads N] [--port N]
+
+Signals to the main (arbiter) process:
+    SIGHUP          rolling reload: re-reads [SERVER], then replaces the
+                    workers one at a time, stopping an old worker only once
+                    its replacement is ready to serve. If a new worker fails
+                    to start the old ones are kept.
+    SIGTERM/SIGINT  graceful stop: workers finish the requests they have.
+server.py itself and the libraries in modules/ are not reloaded.
+
+Run it from the assignment_webapp folder so config.ini is found.
+"""
+
+import argparse
+import configparser
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import *
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, LISTEN_QUEUE, \
+    select_ip_version
+
+# Seconds a new worker gets to import the app and report it is ready
+STARTUP_TIMEOUT = 60
+
+
+def read_options(args=None):
+    """ The [SERVER] section of config.ini, overridden by the command line."""
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    if 'SERVER' not in config:
+        config['SERVER'] = {}
+    section = config['SERVER']
+
+    parser = argparse.ArgumentParser(description="MediaServer production server")
+    parser.add_argument('--host', default=section.get('host', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=section.getint('port', 5000))
+    parser.add_argument('--workers', type=int, default=section.getint('workers', 0))
+    parser.add_argument('--threads', type=int, default=section.getint('threads', 8))
+    parser.add_argument('--max-requests', type=int,
+                        default=section.getint('max_requests', 1000))
+    parser.add_argument('--max-requests-jitter', type=int,
+                        default=section.getint('max_requests_jitter', 100))
+    parser.add_argument('--graceful-timeout', type=float,
+                        default=section.getfloat('graceful_timeout', 30))
+    parser.add_argument('--keep-alive-timeout', type=float,
+                        default=section.getfloat('keep_alive_timeout', 5))
+    parser.add_argument('--max-keep-alive-requests', type=int,
+                        default=section.getint('max_keep_alive_requests', 100))
+    parser.add_argument('--request-header-timeout', type=float,
+                        default=section.getfloat('request_header_timeout', 10))
+    parser.add_argument('--reuse-port', action='store_true',
+                        default=section.getboolean('reuse_port', False))
+    options = parser.parse_args(args)
+    options.refresh_charts = config.getfloat('CHARTS', 'refresh_interval', fallback=86400) > 0
+    if options.workers <= 0:
+        options.workers = os.cpu_count() or 1
+    return options
+
+
+def share_page_cache(options, log=print):
+    """
+    Makes the workers about to be forked share one page cache. A write in
+    one worker bumps the catalogue generations; with the per process
+    [CACHE] backends the other workers would never see it.
+    """
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    backend = config.get('CACHE', 'backend', fallback='simple')
+    if options.workers > 1 and backend != 'filesystem':
+        log("[CACHE] backend %s is per process, the %d workers use filesystem"
+            % (backend, options.workers))
+        os.environ['MEDIASERVER_CACHE_BACKEND'] = 'filesystem'
+    else:
+        os.environ.pop('MEDIASERVER_CACHE_BACKEND', None)
+
+
+def listen(host, port, reuse_port=False):
+    """ A non-blocking listening socket: workers wait for it with select()."""
+    sock = socket.socket(select_ip_version(host, port), socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_QUEUE)
+    sock.setblocking(False)
+    return sock
+
+
+#####################################################
+#   Worker
+#####################################################
+
+class RequestHandler(WSGIRequestHandler):
+    """ Counts every request, kept alive or not, towards max_requests."""
+
+    def run_wsgi(self):
+        self.server.count_request()
+        return WSGIRequestHandler.run_wsgi(self)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Serves connections from a fixed pool of threads. A connection is only
+    accepted when a thread is free to serve it, so a busy worker leaves new
+    connections to the other workers instead of queueing them itself.
+    Connections are kept alive between requests, except by the last free
+    thread, which must stay free for new connections, and once the worker
+    has served max_requests requests.
+    """
+    multithread = True
+    keep_alive = True
+
+    def __init__(self, host, port, app, threads, max_requests=0, handler=None, fd=None):
+        BaseWSGIServer.__init__(self, host, port, app, handler, fd=fd)
+        self.socket.setblocking(False)
+        self.thread_count = threads
+        self.threads = ThreadPoolExecutor(threads)
+        self.free = threading.Semaphore(threads)
+        self.active = 0
+        self.active_lock = threading.Lock()
+        self.max_requests = max_requests
+        self.handled = 0
+        self.stopping = False
+
+    def get_request(self):
+        con, info = self.socket.accept()
+        con.setblocking(True)
+        return con, info
+
+    def process_request(self, request, client_address):
+        self.threads.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        with self.active_lock:
+            self.active += 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.active_lock:
+                self.active -= 1
+            self.shutdown_request(request)
+            self.free.release()
+
+    def count_request(self):
+        with self.active_lock:
+            self.handled += 1
+
+    def exhausted(self):
+        return bool(self.max_requests) and self.handled >= self.max_requests
+
+    def can_keep_alive(self):
+        return BaseWSGIServer.can_keep_alive(self) and not self.stopping \
+            and not self.exhausted() and self.active < self.thread_count
+
+    def serve(self):
+        """ Serves until stop() or max_requests, then finishes the connections it has."""
+        try:
+            while not self.stopping:
+                if self.exhausted():
+                    break
+                if not self.free.acquire(timeout=0.5):
+                    continue
+                try:
+                    readable = select.select([self.socket], [], [], 0.5)[0]
+                    # Another worker may have accepted it first
+                    request, client_address = self.get_request() if readable else (None, None)
+                except OSError:
+                    request = None
+                if request is None:
+                    self.free.release()
+                    continue
+                self.process_request(request, client_address)
+        finally:
+            self.threads.shutdown(wait=True)
+            self.server_close()
+
+    def stop(self, *args):
+        self.stopping = True
+
+
+def run_worker(options, listener, ready, max_requests):
+    """ The body of a forked worker process. Never returns."""
+    status = 1
+    try:
+        signal.set_wakeup_fd(-1)                        # the arbiter's
+        signal.signal(signal.SIGINT, signal.SIG_IGN)    # the arbiter stops us
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+
+        import routes
+        import database
+        database.imdb_charts.follow()       # refreshed by the charts process
+        database.load_title_index()
+
+        if listener is None:
+            listener = listen(options.host, options.port, reuse_port=True)
+        handler = type('RequestHandler', (RequestHandler,), {
+            'keep_alive_timeout': options.keep_alive_timeout,
+            'max_keep_alive_requests': options.max_keep_alive_requests,
+            'request_header_timeout': options.request_header_timeout})
+        server = PooledWSGIServer(options.host, options.port, routes.app, options.threads,
+                                  max_requests, handler, fd=listener.fileno())
+        listener.close()
+        signal.signal(signal.SIGTERM, server.stop)
+        server.stopping = bool(stopping)
+
+        os.write(ready, b'.')
+        os.close(ready)
+        server.serve()
+        status = 0
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+def run_charts():
+    """ The body of the forked process refreshing the IMDb charts. Never returns."""
+    status = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        # Nothing to finish: the snapshot is replaced in one rename
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        import charts
+        store = charts.from_config()
+        store.load()
+        store.run()
+        status = 0
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+#####################################################
+#   Arbiter
+#   Forks the workers and keeps the right number of
+#   them running.
+#####################################################
+
+class Arbiter(object):
+
+    def __init__(self, options):
+        self.options = options
+        self.listener = None
+        self.workers = {}       # pid -> read end of its ready pipe
+        self.ready = set()      # pids that have said they are ready
+        self.retiring = set()   # pids told to stop, not reaped yet
+        self.charts = None      # pid of the charts process
+        self.signals = []
+        self.last_failure = 0
+
+    def log(self, *args):
+        print("[arbiter %d]" % os.getpid(), *args)
+        sys.stdout.flush()
+
+    def run(self):
+        options = self.options
+        if options.reuse_port:
+            # Fail now if the port cannot be had. Only the workers' own
+            # sockets listen, or the kernel would hand this one connections.
+            listen(options.host, options.port, reuse_port=True).close()
+        else:
+            self.listener = listen(options.host, options.port)
+
+        wake_read, wake_write = os.pipe()
+        os.set_blocking(wake_read, False)
+        os.set_blocking(wake_write, False)
+        signal.set_wakeup_fd(wake_write)
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, lambda sig, frame: self.signals.append(sig))
+
+        share_page_cache(options, self.log)
+        self.log("listening on http://%s:%d with %d workers of %d threads"
+                 % (options.host, options.port, options.workers, options.threads))
+        try:
+            while True:
+                self.reap()
+                self.spawn_missing()
+                select.select([wake_read], [], [], 1.0)
+                try:
+                    os.read(wake_read, 1024)
+                except BlockingIOError:
+                    pass
+                while self.signals:
+                    sig = self.signals.pop(0)
+                    if sig in (signal.SIGTERM, signal.SIGINT):
+                        self.stop()
+                        return
+                    if sig == signal.SIGHUP:
+                        self.reload()
+        finally:
+            if self.listener is not None:
+                self.listener.close()
+
+    def spawn(self):
+        max_requests = self.options.max_requests
+        if max_requests:
+            max_requests += random.randint(0, self.options.max_requests_jitter)
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            run_worker(self.options, self.listener, ready_write, max_requests)
+        os.close(ready_write)
+        self.workers[pid] = ready_read
+        return pid
+
+    def spawn_charts(self):
+        pid = os.fork()
+        if pid == 0:
+            if self.listener is not None:
+                self.listener.close()
+            run_charts()
+        self.charts = pid
+        return pid
+
+    def wait_ready(self, pid, timeout=STARTUP_TIMEOUT):
+        """ True once the worker has reported it is ready, False if it died or hung."""
+        ready = self.workers.get(pid)
+        if ready is None:
+            return False
+        if pid not in self.ready:
+            try:
+                if select.select([ready], [], [], timeout)[0] and os.read(ready, 1) == b'.':
+                    self.ready.add(pid)
+            except OSError:
+                pass
+        return pid in self.ready
+
+    def spawn_missing(self):
+        # A worker dying as it starts (a broken deploy, the database down)
+        # is retried once a second rather than in a tight loop
+        if time.time() - self.last_failure < 1:
+            return
+        while len(self.workers) < self.options.workers:
+            self.spawn()
+        if self.charts is None and self.options.refresh_charts:
+            self.spawn_charts()
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if pid == self.charts:
+                self.charts = None
+                if status != 0:
+                    self.last_failure = time.time()
+                    self.log("charts process %d exited with status %d" % (pid, status))
+                continue
+            if pid not in self.workers:
+                continue
+            started = self.wait_ready(pid, timeout=0)
+            os.close(self.workers.pop(pid))
+            self.ready.discard(pid)
+            if not started or status != 0:
+                self.last_failure = time.time()
+                self.log("worker %d exited with status %d" % (pid, status))
+
+    def retire(self, pid):
+        """ Tells a worker (or the charts process) to finish its requests and exit."""
+        ready = self.workers.pop(pid, None)
+        if ready is not None:
+            os.close(ready)
+        self.ready.discard(pid)
+        if pid == self.charts:
+            self.charts = None
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            self.retiring.discard(pid)
+
+    def reload(self):
+        self.log("reloading")
+        options = read_options(sys.argv[1:])
+        options.host, options.port = self.options.host, self.options.port
+        options.reuse_port = self.options.reuse_port
+        old_options, self.options = self.options, options
+        share_page_cache(options, self.log)
+
+        # Every new worker has to be up before any old one goes, so a
+        # broken deploy leaves the old workers serving as they were
+        old = list(self.workers)
+        new = [self.spawn() for _ in range(options.workers)]
+        for pid in new:
+            if not self.wait_ready(pid):
+                self.log("new worker %d did not start, keeping the old workers" % pid)
+                for started in new:
+                    self.retire(started)
+                self.options = old_options
+                share_page_cache(old_options, self.log)
+                return
+        for pid in old:
+            self.retire(pid)
+        # Started again (if still wanted) with the charts code on disk
+        if self.charts is not None:
+            self.retire(self.charts)
+        self.log("reloaded, %d workers" % len(self.workers))
+
+    def stop(self):
+        self.log("stopping")
+        for pid in list(self.workers) + [self.charts]:
+            if pid is not None:
+                self.retire(pid)
+        deadline = time.time() + self.options.graceful_timeout
+        while self.retiring and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.retiring:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+if __name__ == '__main__':
+    Arbiter(read_options()).run()
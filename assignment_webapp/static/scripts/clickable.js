@@ -1,5 +1,6 @@
 $(document).ready(function() {
-    $('.clickable-tr').on('click', function() {
+    // Delegated, so rows added to a table later are links too
+    $(document).on('click', '.clickable-tr', function() {
         window.location.href=$(this).attr('data-href');
     });
 });
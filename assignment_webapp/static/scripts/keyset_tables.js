@@ -0,0 +1,51 @@
+/*
+ * Catalogue list tables paged by the server.
+ * A table with data-source shows the rows the page came with, then asks
+ * data-source for every other page (DataTables server-side processing).
+ * Going forward passes the cursor of the page before, so the server seeks
+ * to the page instead of counting rows off from the start.
+ */
+$(document).ready(function() {
+    $('table[data-source]').each(function() {
+        var table = $(this);
+        var columns = table.find('thead td').map(function() {
+            return {data: $(this).attr('data-column'),
+                    orderable: $(this).is('[data-sortable]'),
+                    defaultContent: ''};
+        }).get();
+        var length = parseInt(table.attr('data-page-length'), 10);
+        var cursors = {};               // start offset -> cursor of that page
+        var query = null;               // order and search the cursors are for
+
+        if (table.attr('data-cursor')) {
+            cursors[length] = table.attr('data-cursor');
+        }
+
+        table.DataTable({
+            serverSide: true,
+            processing: true,
+            deferLoading: parseInt(table.attr('data-total'), 10),
+            pageLength: length,
+            lengthMenu: [25, 50, 100, 250, 500],
+            searchDelay: 400,
+            columns: columns,
+            ajax: function(request, callback) {
+                var current = JSON.stringify([request.order, request.search.value, request.length]);
+                if (query !== null && current !== query) {
+                    cursors = {};
+                }
+                query = current;
+                request.cursor = cursors[request.start] || '';
+                $.getJSON(table.attr('data-source'), request, function(json) {
+                    if (json.next_cursor) {
+                        cursors[request.start + request.length] = json.next_cursor;
+                    }
+                    callback(json);
+                });
+            },
+            createdRow: function(row, data) {
+                $(row).addClass('clickable-tr').attr('data-href', data.url);
+            }
+        });
+    });
+});
@@ -388,6 +388,9 @@ CREATE TABLE mediaserver.MovieRatings(
     last_updated DATE
 );
 
+-- Finds the movies whose ratings are due for a refresh
+CREATE INDEX movieratings_last_updated_idx ON mediaserver.MovieRatings(last_updated);
+
 -- Stored function for adding to new movieRatings table
 CREATE OR REPLACE FUNCTION mediaserver.addMovieRatings(
     _movie_id INTEGER,
@@ -402,21 +405,479 @@ DECLARE
  
 BEGIN
     INSERT INTO mediaserver.MovieRatings
+        (movie_id, imdb_score, imdb_votes, rt_score, top100, top250, last_updated)
         VALUES(
 			_movie_id,
             _imdb_score,
             _imdb_votes,
             _rt_score,
             _top100,
-            _top250)
+            _top250,
+            current_date)
         ON CONFLICT (movie_id) DO UPDATE 
 			SET imdb_score = _imdb_score,
 				imdb_votes = _imdb_votes,
 				rt_score = _rt_score,
 				top100 = _top100,
 				top250 = _top250,
-				last_updated = current_date
+				last_updated = current_date;
+END;
+$$
+LANGUAGE plpgsql;
+
+
+-- NEW FUNCTIONALITY
+-- Title search indexes (also in migrations/0001_search_indexes.sql, for
+-- databases created before they were added)
+CREATE INDEX IF NOT EXISTS movie_title_fts_idx ON mediaserver.Movie
+    USING GIN (to_tsvector('simple', coalesce(movie_title, '')));
+CREATE INDEX IF NOT EXISTS tvshow_title_fts_idx ON mediaserver.TVShow
+    USING GIN (to_tsvector('simple', coalesce(tvshow_title, '')));
+CREATE INDEX IF NOT EXISTS tvepisode_tvshow_id_idx ON mediaserver.TVEpisode(tvshow_id);
+
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS movie_title_trgm_idx ON mediaserver.Movie
+        USING GIN (lower(movie_title) gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS tvshow_title_trgm_idx ON mediaserver.TVShow
+        USING GIN (lower(tvshow_title) gin_trgm_ops);
+EXCEPTION WHEN feature_not_supported OR undefined_file THEN
+    RAISE NOTICE 'pg_trgm is not installed, literal title search will scan the tables';
+END
+$$;
+
+-- NEW FUNCTIONALITY
+-- Cross-media search documents (also in migrations/0002_search_documents.sql,
+-- for databases created before they were added)
+CREATE TABLE IF NOT EXISTS mediaserver.SearchDocument(
+    item_type VARCHAR(20),
+    item_id INTEGER,
+    title TEXT,
+    body TEXT,
+    document TSVECTOR NOT NULL,
+    PRIMARY KEY(item_type, item_id)
+);
+
+CREATE INDEX IF NOT EXISTS searchdocument_document_idx ON mediaserver.SearchDocument
+    USING GIN (document);
+
+-- Description and genre values of the metadata rows linked to an item
+CREATE OR REPLACE FUNCTION mediaserver.searchMetaData(_md_ids BIGINT[])
+RETURNS TEXT AS
+$$
+    SELECT string_agg(md.md_value, ' ' ORDER BY md.md_id)
+    FROM mediaserver.MetaData md NATURAL JOIN mediaserver.MetaDataType mdt
+    WHERE md.md_id = ANY(_md_ids)
+      AND (mdt.md_type_name = 'description' OR mdt.md_type_name LIKE '%genre');
+$$
+LANGUAGE sql STABLE;
+
+-- What every search document is made from. Filtering it on item_type and
+-- item_id only reads that item.
+CREATE OR REPLACE VIEW mediaserver.SearchSource AS
+    SELECT 'song'::VARCHAR(20) AS item_type, s.song_id AS item_id, s.song_title::TEXT AS title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.MediaItemMetaData
+                                         WHERE media_id = s.song_id)) AS body
+    FROM mediaserver.Song s
+    UNION ALL
+    SELECT 'album', a.album_id, a.album_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.AlbumMetaData
+                                         WHERE album_id = a.album_id))
+    FROM mediaserver.Album a
+    UNION ALL
+    SELECT 'artist', a.artist_id, a.artist_name,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.ArtistMetaData
+                                         WHERE artist_id = a.artist_id))
+    FROM mediaserver.Artist a
+    UNION ALL
+    SELECT 'podcast', p.podcast_id, p.podcast_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.PodcastMetaData
+                                         WHERE podcast_id = p.podcast_id))
+    FROM mediaserver.Podcast p
+    UNION ALL
+    SELECT 'podcastep', pe.media_id, pe.podcast_episode_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.MediaItemMetaData
+                                         WHERE media_id = pe.media_id))
+    FROM mediaserver.PodcastEpisode pe
+    UNION ALL
+    SELECT 'movie', m.movie_id, m.movie_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.MediaItemMetaData
+                                         WHERE media_id = m.movie_id))
+    FROM mediaserver.Movie m
+    UNION ALL
+    SELECT 'tvshow', t.tvshow_id, t.tvshow_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.TVShowMetaData
+                                         WHERE tvshow_id = t.tvshow_id))
+    FROM mediaserver.TVShow t
+    UNION ALL
+    SELECT 'tvepisode', te.media_id, te.tvshow_episode_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.MediaItemMetaData
+                                         WHERE media_id = te.media_id))
+    FROM mediaserver.TVEpisode te;
+
+-- Title words weigh more than metadata words in the ranking
+CREATE OR REPLACE FUNCTION mediaserver.searchVector(_title TEXT, _body TEXT)
+RETURNS TSVECTOR AS
+$$
+    SELECT setweight(to_tsvector('simple', coalesce(_title, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(_body, '')), 'C');
+$$
+LANGUAGE sql IMMUTABLE;
+
+-- Rebuilds the document of one item (removes it if the item is gone).
+-- 'media' stands for whichever media item kind _item_id is.
+CREATE OR REPLACE FUNCTION mediaserver.refreshSearchDocument(
+    _item_type VARCHAR(20),
+    _item_id INTEGER)
+RETURNS void AS
+$$
+BEGIN
+    IF _item_type = 'media' THEN
+        PERFORM mediaserver.refreshSearchDocument(t, _item_id)
+        FROM unnest(ARRAY['song', 'podcastep', 'movie', 'tvepisode']::VARCHAR(20)[]) AS t;
+        RETURN;
+    END IF;
+    -- Waits for any other transaction refreshing this item to commit, so
+    -- the document below includes its rows (migration 0008)
+    PERFORM pg_advisory_xact_lock(hashtext('SearchDocument ' || _item_type), _item_id);
+    INSERT INTO mediaserver.SearchDocument(item_type, item_id, title, body, document)
+    SELECT item_type, item_id, title, body, mediaserver.searchVector(title, body)
+    FROM mediaserver.SearchSource
+    WHERE item_type = _item_type AND item_id = _item_id
+    ON CONFLICT (item_type, item_id) DO UPDATE
+        SET title = EXCLUDED.title, body = EXCLUDED.body, document = EXCLUDED.document;
+    IF NOT FOUND THEN
+        DELETE FROM mediaserver.SearchDocument
+        WHERE item_type = _item_type AND item_id = _item_id;
+    END IF;
+END;
+$$
+LANGUAGE plpgsql;
+
+-- Row trigger: TG_ARGV[0] is the item type, TG_ARGV[1] the item id column
+CREATE OR REPLACE FUNCTION mediaserver.searchDocumentTrigger()
+RETURNS trigger AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM mediaserver.refreshSearchDocument(
+            TG_ARGV[0], (to_jsonb(OLD) ->> TG_ARGV[1])::INTEGER);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM mediaserver.refreshSearchDocument(
+            TG_ARGV[0], (to_jsonb(NEW) ->> TG_ARGV[1])::INTEGER);
+    END IF;
+    RETURN NULL;
+END;
+$$
+LANGUAGE plpgsql;
+
+-- A changed metadata value changes every item it is linked to
+CREATE OR REPLACE FUNCTION mediaserver.searchMetaDataTrigger()
+RETURNS trigger AS
+$$
+BEGIN
+    PERFORM mediaserver.refreshSearchDocument('media', media_id)
+    FROM mediaserver.MediaItemMetaData WHERE md_id = NEW.md_id;
+    PERFORM mediaserver.refreshSearchDocument('album', album_id)
+    FROM mediaserver.AlbumMetaData WHERE md_id = NEW.md_id;
+    PERFORM mediaserver.refreshSearchDocument('artist', artist_id)
+    FROM mediaserver.ArtistMetaData WHERE md_id = NEW.md_id;
+    PERFORM mediaserver.refreshSearchDocument('podcast', podcast_id)
+    FROM mediaserver.PodcastMetaData WHERE md_id = NEW.md_id;
+    PERFORM mediaserver.refreshSearchDocument('tvshow', tvshow_id)
+    FROM mediaserver.TVShowMetaData WHERE md_id = NEW.md_id;
+    RETURN NULL;
 END;
 $$
 LANGUAGE plpgsql;
 
+DROP TRIGGER IF EXISTS song_search ON mediaserver.Song;
+CREATE TRIGGER song_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Song
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('song', 'song_id');
+DROP TRIGGER IF EXISTS album_search ON mediaserver.Album;
+CREATE TRIGGER album_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Album
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('album', 'album_id');
+DROP TRIGGER IF EXISTS artist_search ON mediaserver.Artist;
+CREATE TRIGGER artist_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Artist
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('artist', 'artist_id');
+DROP TRIGGER IF EXISTS podcast_search ON mediaserver.Podcast;
+CREATE TRIGGER podcast_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Podcast
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('podcast', 'podcast_id');
+DROP TRIGGER IF EXISTS podcastepisode_search ON mediaserver.PodcastEpisode;
+CREATE TRIGGER podcastepisode_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.PodcastEpisode
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('podcastep', 'media_id');
+DROP TRIGGER IF EXISTS movie_search ON mediaserver.Movie;
+CREATE TRIGGER movie_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Movie
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('movie', 'movie_id');
+DROP TRIGGER IF EXISTS tvshow_search ON mediaserver.TVShow;
+CREATE TRIGGER tvshow_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.TVShow
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('tvshow', 'tvshow_id');
+DROP TRIGGER IF EXISTS tvepisode_search ON mediaserver.TVEpisode;
+CREATE TRIGGER tvepisode_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.TVEpisode
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('tvepisode', 'media_id');
+
+DROP TRIGGER IF EXISTS mediaitemmetadata_search ON mediaserver.MediaItemMetaData;
+CREATE TRIGGER mediaitemmetadata_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.MediaItemMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('media', 'media_id');
+DROP TRIGGER IF EXISTS albummetadata_search ON mediaserver.AlbumMetaData;
+CREATE TRIGGER albummetadata_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.AlbumMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('album', 'album_id');
+DROP TRIGGER IF EXISTS artistmetadata_search ON mediaserver.ArtistMetaData;
+CREATE TRIGGER artistmetadata_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.ArtistMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('artist', 'artist_id');
+DROP TRIGGER IF EXISTS podcastmetadata_search ON mediaserver.PodcastMetaData;
+CREATE TRIGGER podcastmetadata_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.PodcastMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('podcast', 'podcast_id');
+DROP TRIGGER IF EXISTS tvshowmetadata_search ON mediaserver.TVShowMetaData;
+CREATE TRIGGER tvshowmetadata_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.TVShowMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('tvshow', 'tvshow_id');
+
+DROP TRIGGER IF EXISTS metadata_search ON mediaserver.MetaData;
+CREATE TRIGGER metadata_search AFTER UPDATE OF md_type_id, md_value ON mediaserver.MetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchMetaDataTrigger();
+
+
+
+-- NEW FUNCTIONALITY
+-- Keyset list page indexes (also in migrations/0003_list_keyset_indexes.sql,
+-- for databases created before they were added)
+CREATE INDEX IF NOT EXISTS artist_keyset_idx ON mediaserver.Artist
+    ((coalesce(artist_name, '')), artist_id);
+CREATE INDEX IF NOT EXISTS song_keyset_idx ON mediaserver.Song
+    ((coalesce(song_title, '')), song_id);
+CREATE INDEX IF NOT EXISTS podcast_keyset_idx ON mediaserver.Podcast
+    ((coalesce(podcast_title, '')), podcast_id);
+CREATE INDEX IF NOT EXISTS album_keyset_idx ON mediaserver.Album
+    ((coalesce(album_title, '')), album_id);
+CREATE INDEX IF NOT EXISTS tvshow_keyset_idx ON mediaserver.TVShow
+    ((coalesce(tvshow_title, '')), tvshow_id);
+CREATE INDEX IF NOT EXISTS movie_keyset_idx ON mediaserver.Movie
+    ((coalesce(movie_title, '')), movie_id);
+CREATE INDEX IF NOT EXISTS album_songs_album_id_idx ON mediaserver.Album_Songs(album_id);
+
+
+-- NEW FUNCTIONALITY
+-- List count summaries kept up to date by triggers (also in
+-- migrations/0004_item_summaries.sql, for databases created before they
+-- were added)
+CREATE TABLE IF NOT EXISTS mediaserver.ItemSummary(
+    item_type VARCHAR(20),
+    item_id INTEGER,
+    item_count INTEGER NOT NULL DEFAULT 0,
+    artists TEXT,
+    PRIMARY KEY(item_type, item_id)
+);
+
+-- What every summary row is made from. Filtering it on item_type and
+-- item_id only reads that item.
+CREATE OR REPLACE VIEW mediaserver.SummarySource AS
+    SELECT 'album'::VARCHAR(20) AS item_type, a.album_id AS item_id,
+        (SELECT count(*) FROM mediaserver.Album_Songs als
+         WHERE als.album_id = a.album_id)::INTEGER AS item_count,
+        (SELECT array_to_string(array_agg(DISTINCT ar.artist_name), ',')
+         FROM mediaserver.Album_Songs als
+             JOIN mediaserver.Song_Artists sa ON (als.song_id = sa.song_id)
+             JOIN mediaserver.Artist ar ON (sa.performing_artist_id = ar.artist_id)
+         WHERE als.album_id = a.album_id) AS artists
+    FROM mediaserver.Album a
+    UNION ALL
+    SELECT 'artist', a.artist_id,
+        (SELECT count(*) FROM mediaserver.ArtistMetaData amd
+         WHERE amd.artist_id = a.artist_id)::INTEGER,
+        NULL
+    FROM mediaserver.Artist a
+    UNION ALL
+    SELECT 'podcast', p.podcast_id,
+        (SELECT count(*) FROM mediaserver.PodcastEpisode pe
+         WHERE pe.podcast_id = p.podcast_id)::INTEGER,
+        NULL
+    FROM mediaserver.Podcast p
+    UNION ALL
+    SELECT 'movie', m.movie_id,
+        (SELECT count(*) FROM mediaserver.MediaItemMetaData mimd
+         WHERE mimd.media_id = m.movie_id)::INTEGER,
+        NULL
+    FROM mediaserver.Movie m
+    UNION ALL
+    SELECT 'tvshow', t.tvshow_id,
+        (SELECT count(*) FROM mediaserver.TVEpisode te
+         WHERE te.tvshow_id = t.tvshow_id)::INTEGER,
+        NULL
+    FROM mediaserver.TVShow t;
+
+-- Rebuilds the summary of one item (removes it if the item is gone).
+-- 'song' stands for the albums the song is on, 'artistalbums' for the
+-- albums with songs by the artist.
+CREATE OR REPLACE FUNCTION mediaserver.refreshItemSummary(
+    _item_type VARCHAR(20),
+    _item_id INTEGER)
+RETURNS void AS
+$$
+BEGIN
+    IF _item_type = 'song' THEN
+        PERFORM mediaserver.refreshItemSummary('album', album_id)
+        FROM mediaserver.Album_Songs WHERE song_id = _item_id;
+        RETURN;
+    END IF;
+    IF _item_type = 'artistalbums' THEN
+        PERFORM mediaserver.refreshItemSummary('album', als.album_id)
+        FROM mediaserver.Song_Artists sa
+            JOIN mediaserver.Album_Songs als ON (sa.song_id = als.song_id)
+        WHERE sa.performing_artist_id = _item_id
+        GROUP BY als.album_id;
+        RETURN;
+    END IF;
+    -- Waits for any other transaction refreshing this item to commit, so
+    -- the count below includes its rows (migration 0007)
+    PERFORM pg_advisory_xact_lock(hashtext('ItemSummary ' || _item_type), _item_id);
+    INSERT INTO mediaserver.ItemSummary(item_type, item_id, item_count, artists)
+    SELECT item_type, item_id, item_count, artists
+    FROM mediaserver.SummarySource
+    WHERE item_type = _item_type AND item_id = _item_id
+    ON CONFLICT (item_type, item_id) DO UPDATE
+        SET item_count = EXCLUDED.item_count, artists = EXCLUDED.artists;
+    IF NOT FOUND THEN
+        DELETE FROM mediaserver.ItemSummary
+        WHERE item_type = _item_type AND item_id = _item_id;
+    END IF;
+END;
+$$
+LANGUAGE plpgsql;
+
+-- Row trigger: TG_ARGV[0] is the item type, TG_ARGV[1] the item id column
+CREATE OR REPLACE FUNCTION mediaserver.itemSummaryTrigger()
+RETURNS trigger AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM mediaserver.refreshItemSummary(
+            TG_ARGV[0], (to_jsonb(OLD) ->> TG_ARGV[1])::INTEGER);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM mediaserver.refreshItemSummary(
+            TG_ARGV[0], (to_jsonb(NEW) ->> TG_ARGV[1])::INTEGER);
+    END IF;
+    RETURN NULL;
+END;
+$$
+LANGUAGE plpgsql;
+
+-- The items themselves
+DROP TRIGGER IF EXISTS album_summary ON mediaserver.Album;
+CREATE TRIGGER album_summary AFTER INSERT OR UPDATE OF album_id OR DELETE ON mediaserver.Album
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('album', 'album_id');
+DROP TRIGGER IF EXISTS artist_summary ON mediaserver.Artist;
+CREATE TRIGGER artist_summary AFTER INSERT OR UPDATE OF artist_id OR DELETE ON mediaserver.Artist
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('artist', 'artist_id');
+DROP TRIGGER IF EXISTS podcast_summary ON mediaserver.Podcast;
+CREATE TRIGGER podcast_summary AFTER INSERT OR UPDATE OF podcast_id OR DELETE ON mediaserver.Podcast
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('podcast', 'podcast_id');
+DROP TRIGGER IF EXISTS movie_summary ON mediaserver.Movie;
+CREATE TRIGGER movie_summary AFTER INSERT OR UPDATE OF movie_id OR DELETE ON mediaserver.Movie
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('movie', 'movie_id');
+DROP TRIGGER IF EXISTS tvshow_summary ON mediaserver.TVShow;
+CREATE TRIGGER tvshow_summary AFTER INSERT OR UPDATE OF tvshow_id OR DELETE ON mediaserver.TVShow
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('tvshow', 'tvshow_id');
+
+-- What they count
+DROP TRIGGER IF EXISTS album_songs_summary ON mediaserver.Album_Songs;
+CREATE TRIGGER album_songs_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Album_Songs
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('album', 'album_id');
+DROP TRIGGER IF EXISTS song_artists_summary ON mediaserver.Song_Artists;
+CREATE TRIGGER song_artists_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Song_Artists
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('song', 'song_id');
+DROP TRIGGER IF EXISTS artist_name_summary ON mediaserver.Artist;
+CREATE TRIGGER artist_name_summary AFTER UPDATE OF artist_name ON mediaserver.Artist
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('artistalbums', 'artist_id');
+DROP TRIGGER IF EXISTS artistmetadata_summary ON mediaserver.ArtistMetaData;
+CREATE TRIGGER artistmetadata_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.ArtistMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('artist', 'artist_id');
+DROP TRIGGER IF EXISTS podcastepisode_summary ON mediaserver.PodcastEpisode;
+CREATE TRIGGER podcastepisode_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.PodcastEpisode
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('podcast', 'podcast_id');
+DROP TRIGGER IF EXISTS mediaitemmetadata_summary ON mediaserver.MediaItemMetaData;
+CREATE TRIGGER mediaitemmetadata_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.MediaItemMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('movie', 'media_id');
+DROP TRIGGER IF EXISTS tvepisode_summary ON mediaserver.TVEpisode;
+CREATE TRIGGER tvepisode_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.TVEpisode
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('tvshow', 'tvshow_id');
+
+-- Summaries of the items already in the database
+INSERT INTO mediaserver.ItemSummary(item_type, item_id, item_count, artists)
+SELECT item_type, item_id, item_count, artists
+FROM mediaserver.SummarySource
+ON CONFLICT (item_type, item_id) DO UPDATE
+    SET item_count = excluded.item_count,
+        artists = excluded.artists;
+
+ANALYZE mediaserver.ItemSummary;
+
+
+-- NEW FUNCTIONALITY
+-- Movie ratings view indexes (also in migrations/0005_movie_ratings_indexes.sql,
+-- for databases created before they were added)
+CREATE INDEX IF NOT EXISTS movieratings_imdb_idx ON mediaserver.MovieRatings
+    ((coalesce(imdb_score, -1)) DESC, (coalesce(imdb_votes, -1)) DESC,
+     (coalesce(rt_score, -1)) DESC, movie_id DESC);
+CREATE INDEX IF NOT EXISTS movieratings_rt_idx ON mediaserver.MovieRatings
+    ((coalesce(rt_score, -1)) DESC, (coalesce(imdb_score, -1)) DESC,
+     (coalesce(imdb_votes, -1)) DESC, movie_id DESC);
+
+-- The IMDB 250 and IMDB 100 views only read the index of their list
+-- (movies in both are found through the IMDB 100 one).
+CREATE INDEX IF NOT EXISTS movieratings_top250_idx ON mediaserver.MovieRatings(movie_id)
+    WHERE top250;
+CREATE INDEX IF NOT EXISTS movieratings_top250_imdb_idx ON mediaserver.MovieRatings
+    ((coalesce(imdb_score, -1)) DESC, (coalesce(imdb_votes, -1)) DESC,
+     (coalesce(rt_score, -1)) DESC, movie_id DESC)
+    WHERE top250;
+CREATE INDEX IF NOT EXISTS movieratings_top250_rt_idx ON mediaserver.MovieRatings
+    ((coalesce(rt_score, -1)) DESC, (coalesce(imdb_score, -1)) DESC,
+     (coalesce(imdb_votes, -1)) DESC, movie_id DESC)
+    WHERE top250;
+CREATE INDEX IF NOT EXISTS movieratings_top100_idx ON mediaserver.MovieRatings(movie_id)
+    WHERE top100;
+CREATE INDEX IF NOT EXISTS movieratings_top100_imdb_idx ON mediaserver.MovieRatings
+    ((coalesce(imdb_score, -1)) DESC, (coalesce(imdb_votes, -1)) DESC,
+     (coalesce(rt_score, -1)) DESC, movie_id DESC)
+    WHERE top100;
+CREATE INDEX IF NOT EXISTS movieratings_top100_rt_idx ON mediaserver.MovieRatings
+    ((coalesce(rt_score, -1)) DESC, (coalesce(imdb_score, -1)) DESC,
+     (coalesce(imdb_votes, -1)) DESC, movie_id DESC)
+    WHERE top100;
+
+
+
+-- NEW FUNCTIONALITY
+-- Foreign key and lookup indexes (also in migrations/0006_foreign_key_indexes.sql,
+-- which builds them CONCURRENTLY on databases created before they were added)
+CREATE INDEX IF NOT EXISTS song_artists_performing_artist_id_idx
+    ON mediaserver.Song_Artists(performing_artist_id);
+CREATE INDEX IF NOT EXISTS mediaitemmetadata_md_id_idx
+    ON mediaserver.MediaItemMetaData(md_id);
+CREATE INDEX IF NOT EXISTS albummetadata_md_id_idx
+    ON mediaserver.AlbumMetaData(md_id);
+CREATE INDEX IF NOT EXISTS artistmetadata_md_id_idx
+    ON mediaserver.ArtistMetaData(md_id);
+CREATE INDEX IF NOT EXISTS podcastmetadata_md_id_idx
+    ON mediaserver.PodcastMetaData(md_id);
+CREATE INDEX IF NOT EXISTS tvshowmetadata_md_id_idx
+    ON mediaserver.TVShowMetaData(md_id);
+CREATE INDEX IF NOT EXISTS metadata_md_type_id_idx
+    ON mediaserver.MetaData(md_type_id);
+CREATE INDEX IF NOT EXISTS podcastepisode_media_id_idx
+    ON mediaserver.PodcastEpisode(media_id);
+CREATE INDEX IF NOT EXISTS mediacollection_username_idx
+    ON mediaserver.MediaCollection(username);
+CREATE INDEX IF NOT EXISTS mediacollectioncontents_media_id_idx
+    ON mediaserver.MediaCollectionContents(media_id);
+CREATE INDEX IF NOT EXISTS subscribed_podcasts_podcast_id_idx
+    ON mediaserver.Subscribed_Podcasts(podcast_id);
+CREATE INDEX IF NOT EXISTS usermediaconsumption_username_progress_idx
+    ON mediaserver.UserMediaConsumption(username, progress);
+CREATE INDEX IF NOT EXISTS bandmembership_band_id_idx
+    ON mediaserver.BandMembership(band_id);
+CREATE INDEX IF NOT EXISTS bandmembership_band_member_id_idx
+    ON mediaserver.BandMembership(band_member_id);
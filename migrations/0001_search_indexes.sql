@@ -0,0 +1,36 @@
+-- NEW FUNCTIONALITY
+-- Indexes for movie and TV show title search (find_matchingmovies and
+-- find_matchingtvshows). Safe to run more than once, and on a database
+-- already created from mediaserver_schema.sql.
+--
+--     psql -d <database> -f migrations/0001_search_indexes.sql
+
+SET search_path TO mediaserver, public;
+
+-- Word search: a GIN index over the words of each title. The queries use
+-- exactly this expression, so keep the two in step.
+CREATE INDEX IF NOT EXISTS movie_title_fts_idx ON mediaserver.Movie
+    USING GIN (to_tsvector('simple', coalesce(movie_title, '')));
+CREATE INDEX IF NOT EXISTS tvshow_title_fts_idx ON mediaserver.TVShow
+    USING GIN (to_tsvector('simple', coalesce(tvshow_title, '')));
+
+-- Episode counts of the matching shows only
+CREATE INDEX IF NOT EXISTS tvepisode_tvshow_id_idx ON mediaserver.TVEpisode(tvshow_id);
+
+-- Literal substring search: trigram indexes serve lower(title) LIKE '%term%'.
+-- pg_trgm ships with the PostgreSQL contrib package; without it literal
+-- search still works, it just scans the table.
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS movie_title_trgm_idx ON mediaserver.Movie
+        USING GIN (lower(movie_title) gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS tvshow_title_trgm_idx ON mediaserver.TVShow
+        USING GIN (lower(tvshow_title) gin_trgm_ops);
+EXCEPTION WHEN feature_not_supported OR undefined_file THEN
+    RAISE NOTICE 'pg_trgm is not installed, literal title search will scan the tables';
+END
+$$;
+
+ANALYZE mediaserver.Movie;
+ANALYZE mediaserver.TVShow;
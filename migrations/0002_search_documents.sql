@@ -0,0 +1,203 @@
+-- NEW FUNCTIONALITY
+-- One search document per song, album, artist, podcast, podcast episode,
+-- movie, TV show and TV episode: its title plus the values of its
+-- description and genre metadata, indexed together so /search finds any
+-- kind of item with a single query. Triggers on the item, metadata link
+-- and MetaData tables keep the documents up to date, whether rows are
+-- added through the add functions or directly.
+--
+--     psql -d <database> -f migrations/0002_search_documents.sql
+
+SET search_path TO mediaserver, public;
+
+CREATE TABLE IF NOT EXISTS mediaserver.SearchDocument(
+    item_type VARCHAR(20),
+    item_id INTEGER,
+    title TEXT,
+    body TEXT,
+    document TSVECTOR NOT NULL,
+    PRIMARY KEY(item_type, item_id)
+);
+
+CREATE INDEX IF NOT EXISTS searchdocument_document_idx ON mediaserver.SearchDocument
+    USING GIN (document);
+
+-- Description and genre values of the metadata rows linked to an item
+CREATE OR REPLACE FUNCTION mediaserver.searchMetaData(_md_ids BIGINT[])
+RETURNS TEXT AS
+$$
+    SELECT string_agg(md.md_value, ' ' ORDER BY md.md_id)
+    FROM mediaserver.MetaData md NATURAL JOIN mediaserver.MetaDataType mdt
+    WHERE md.md_id = ANY(_md_ids)
+      AND (mdt.md_type_name = 'description' OR mdt.md_type_name LIKE '%genre');
+$$
+LANGUAGE sql STABLE;
+
+-- What every search document is made from. Filtering it on item_type and
+-- item_id only reads that item.
+CREATE OR REPLACE VIEW mediaserver.SearchSource AS
+    SELECT 'song'::VARCHAR(20) AS item_type, s.song_id AS item_id, s.song_title::TEXT AS title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.MediaItemMetaData
+                                         WHERE media_id = s.song_id)) AS body
+    FROM mediaserver.Song s
+    UNION ALL
+    SELECT 'album', a.album_id, a.album_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.AlbumMetaData
+                                         WHERE album_id = a.album_id))
+    FROM mediaserver.Album a
+    UNION ALL
+    SELECT 'artist', a.artist_id, a.artist_name,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.ArtistMetaData
+                                         WHERE artist_id = a.artist_id))
+    FROM mediaserver.Artist a
+    UNION ALL
+    SELECT 'podcast', p.podcast_id, p.podcast_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.PodcastMetaData
+                                         WHERE podcast_id = p.podcast_id))
+    FROM mediaserver.Podcast p
+    UNION ALL
+    SELECT 'podcastep', pe.media_id, pe.podcast_episode_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.MediaItemMetaData
+                                         WHERE media_id = pe.media_id))
+    FROM mediaserver.PodcastEpisode pe
+    UNION ALL
+    SELECT 'movie', m.movie_id, m.movie_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.MediaItemMetaData
+                                         WHERE media_id = m.movie_id))
+    FROM mediaserver.Movie m
+    UNION ALL
+    SELECT 'tvshow', t.tvshow_id, t.tvshow_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.TVShowMetaData
+                                         WHERE tvshow_id = t.tvshow_id))
+    FROM mediaserver.TVShow t
+    UNION ALL
+    SELECT 'tvepisode', te.media_id, te.tvshow_episode_title,
+        mediaserver.searchMetaData(ARRAY(SELECT md_id FROM mediaserver.MediaItemMetaData
+                                         WHERE media_id = te.media_id))
+    FROM mediaserver.TVEpisode te;
+
+-- Title words weigh more than metadata words in the ranking
+CREATE OR REPLACE FUNCTION mediaserver.searchVector(_title TEXT, _body TEXT)
+RETURNS TSVECTOR AS
+$$
+    SELECT setweight(to_tsvector('simple', coalesce(_title, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(_body, '')), 'C');
+$$
+LANGUAGE sql IMMUTABLE;
+
+-- Rebuilds the document of one item (removes it if the item is gone).
+-- 'media' stands for whichever media item kind _item_id is.
+CREATE OR REPLACE FUNCTION mediaserver.refreshSearchDocument(
+    _item_type VARCHAR(20),
+    _item_id INTEGER)
+RETURNS void AS
+$$
+BEGIN
+    IF _item_type = 'media' THEN
+        PERFORM mediaserver.refreshSearchDocument(t, _item_id)
+        FROM unnest(ARRAY['song', 'podcastep', 'movie', 'tvepisode']::VARCHAR(20)[]) AS t;
+        RETURN;
+    END IF;
+    DELETE FROM mediaserver.SearchDocument
+    WHERE item_type = _item_type AND item_id = _item_id;
+    INSERT INTO mediaserver.SearchDocument(item_type, item_id, title, body, document)
+    SELECT item_type, item_id, title, body, mediaserver.searchVector(title, body)
+    FROM mediaserver.SearchSource
+    WHERE item_type = _item_type AND item_id = _item_id;
+END;
+$$
+LANGUAGE plpgsql;
+
+-- Row trigger: TG_ARGV[0] is the item type, TG_ARGV[1] the item id column
+CREATE OR REPLACE FUNCTION mediaserver.searchDocumentTrigger()
+RETURNS trigger AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM mediaserver.refreshSearchDocument(
+            TG_ARGV[0], (to_jsonb(OLD) ->> TG_ARGV[1])::INTEGER);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM mediaserver.refreshSearchDocument(
+            TG_ARGV[0], (to_jsonb(NEW) ->> TG_ARGV[1])::INTEGER);
+    END IF;
+    RETURN NULL;
+END;
+$$
+LANGUAGE plpgsql;
+
+-- A changed metadata value changes every item it is linked to
+CREATE OR REPLACE FUNCTION mediaserver.searchMetaDataTrigger()
+RETURNS trigger AS
+$$
+BEGIN
+    PERFORM mediaserver.refreshSearchDocument('media', media_id)
+    FROM mediaserver.MediaItemMetaData WHERE md_id = NEW.md_id;
+    PERFORM mediaserver.refreshSearchDocument('album', album_id)
+    FROM mediaserver.AlbumMetaData WHERE md_id = NEW.md_id;
+    PERFORM mediaserver.refreshSearchDocument('artist', artist_id)
+    FROM mediaserver.ArtistMetaData WHERE md_id = NEW.md_id;
+    PERFORM mediaserver.refreshSearchDocument('podcast', podcast_id)
+    FROM mediaserver.PodcastMetaData WHERE md_id = NEW.md_id;
+    PERFORM mediaserver.refreshSearchDocument('tvshow', tvshow_id)
+    FROM mediaserver.TVShowMetaData WHERE md_id = NEW.md_id;
+    RETURN NULL;
+END;
+$$
+LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS song_search ON mediaserver.Song;
+CREATE TRIGGER song_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Song
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('song', 'song_id');
+DROP TRIGGER IF EXISTS album_search ON mediaserver.Album;
+CREATE TRIGGER album_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Album
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('album', 'album_id');
+DROP TRIGGER IF EXISTS artist_search ON mediaserver.Artist;
+CREATE TRIGGER artist_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Artist
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('artist', 'artist_id');
+DROP TRIGGER IF EXISTS podcast_search ON mediaserver.Podcast;
+CREATE TRIGGER podcast_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Podcast
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('podcast', 'podcast_id');
+DROP TRIGGER IF EXISTS podcastepisode_search ON mediaserver.PodcastEpisode;
+CREATE TRIGGER podcastepisode_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.PodcastEpisode
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('podcastep', 'media_id');
+DROP TRIGGER IF EXISTS movie_search ON mediaserver.Movie;
+CREATE TRIGGER movie_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Movie
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('movie', 'movie_id');
+DROP TRIGGER IF EXISTS tvshow_search ON mediaserver.TVShow;
+CREATE TRIGGER tvshow_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.TVShow
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('tvshow', 'tvshow_id');
+DROP TRIGGER IF EXISTS tvepisode_search ON mediaserver.TVEpisode;
+CREATE TRIGGER tvepisode_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.TVEpisode
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('tvepisode', 'media_id');
+
+DROP TRIGGER IF EXISTS mediaitemmetadata_search ON mediaserver.MediaItemMetaData;
+CREATE TRIGGER mediaitemmetadata_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.MediaItemMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('media', 'media_id');
+DROP TRIGGER IF EXISTS albummetadata_search ON mediaserver.AlbumMetaData;
+CREATE TRIGGER albummetadata_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.AlbumMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('album', 'album_id');
+DROP TRIGGER IF EXISTS artistmetadata_search ON mediaserver.ArtistMetaData;
+CREATE TRIGGER artistmetadata_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.ArtistMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('artist', 'artist_id');
+DROP TRIGGER IF EXISTS podcastmetadata_search ON mediaserver.PodcastMetaData;
+CREATE TRIGGER podcastmetadata_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.PodcastMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('podcast', 'podcast_id');
+DROP TRIGGER IF EXISTS tvshowmetadata_search ON mediaserver.TVShowMetaData;
+CREATE TRIGGER tvshowmetadata_search AFTER INSERT OR UPDATE OR DELETE ON mediaserver.TVShowMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchDocumentTrigger('tvshow', 'tvshow_id');
+
+DROP TRIGGER IF EXISTS metadata_search ON mediaserver.MetaData;
+CREATE TRIGGER metadata_search AFTER UPDATE OF md_type_id, md_value ON mediaserver.MetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.searchMetaDataTrigger();
+
+-- Documents of the items already in the database
+INSERT INTO mediaserver.SearchDocument(item_type, item_id, title, body, document)
+SELECT item_type, item_id, title, body, mediaserver.searchVector(title, body)
+FROM mediaserver.SearchSource
+ON CONFLICT (item_type, item_id) DO UPDATE
+    SET title = excluded.title,
+        body = excluded.body,
+        document = excluded.document;
+
+ANALYZE mediaserver.SearchDocument;
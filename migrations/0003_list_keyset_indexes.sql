@@ -0,0 +1,29 @@
+-- NEW FUNCTIONALITY
+-- Indexes for keyset (seek) pages of the catalogue lists (get_list_page).
+-- Safe to run more than once, and on a database already created from
+-- mediaserver_schema.sql.
+--
+--     psql -d <database> -f migrations/0003_list_keyset_indexes.sql
+
+SET search_path TO mediaserver, public;
+
+-- Pages ordered by name: (coalesce(name, ''), id) is both the sort order
+-- and the seek key, so a page is one index range scan. The queries use
+-- exactly these expressions, so keep the two in step. Pages ordered by id
+-- use the primary keys.
+CREATE INDEX IF NOT EXISTS artist_keyset_idx ON mediaserver.Artist
+    ((coalesce(artist_name, '')), artist_id);
+CREATE INDEX IF NOT EXISTS song_keyset_idx ON mediaserver.Song
+    ((coalesce(song_title, '')), song_id);
+CREATE INDEX IF NOT EXISTS podcast_keyset_idx ON mediaserver.Podcast
+    ((coalesce(podcast_title, '')), podcast_id);
+CREATE INDEX IF NOT EXISTS album_keyset_idx ON mediaserver.Album
+    ((coalesce(album_title, '')), album_id);
+CREATE INDEX IF NOT EXISTS tvshow_keyset_idx ON mediaserver.TVShow
+    ((coalesce(tvshow_title, '')), tvshow_id);
+CREATE INDEX IF NOT EXISTS movie_keyset_idx ON mediaserver.Movie
+    ((coalesce(movie_title, '')), movie_id);
+
+-- Song counts and artists of the albums on a page (the primary key of
+-- Album_Songs starts with song_id)
+CREATE INDEX IF NOT EXISTS album_songs_album_id_idx ON mediaserver.Album_Songs(album_id);
@@ -0,0 +1,156 @@
+-- NEW FUNCTIONALITY
+-- Per item counts shown by the catalogue lists, kept in one table instead
+-- of being aggregated over the whole catalogue on every list query:
+-- album song counts and artists, podcast and TV show episode counts, and
+-- artist and movie metadata counts. Triggers on the item and link tables
+-- keep the rows up to date, whether rows are added through the add
+-- functions or directly. Safe to run more than once.
+--
+--     psql -d <database> -f migrations/0004_item_summaries.sql
+
+SET search_path TO mediaserver, public;
+
+CREATE TABLE IF NOT EXISTS mediaserver.ItemSummary(
+    item_type VARCHAR(20),
+    item_id INTEGER,
+    item_count INTEGER NOT NULL DEFAULT 0,
+    artists TEXT,
+    PRIMARY KEY(item_type, item_id)
+);
+
+-- What every summary row is made from. Filtering it on item_type and
+-- item_id only reads that item.
+CREATE OR REPLACE VIEW mediaserver.SummarySource AS
+    SELECT 'album'::VARCHAR(20) AS item_type, a.album_id AS item_id,
+        (SELECT count(*) FROM mediaserver.Album_Songs als
+         WHERE als.album_id = a.album_id)::INTEGER AS item_count,
+        (SELECT array_to_string(array_agg(DISTINCT ar.artist_name), ',')
+         FROM mediaserver.Album_Songs als
+             JOIN mediaserver.Song_Artists sa ON (als.song_id = sa.song_id)
+             JOIN mediaserver.Artist ar ON (sa.performing_artist_id = ar.artist_id)
+         WHERE als.album_id = a.album_id) AS artists
+    FROM mediaserver.Album a
+    UNION ALL
+    SELECT 'artist', a.artist_id,
+        (SELECT count(*) FROM mediaserver.ArtistMetaData amd
+         WHERE amd.artist_id = a.artist_id)::INTEGER,
+        NULL
+    FROM mediaserver.Artist a
+    UNION ALL
+    SELECT 'podcast', p.podcast_id,
+        (SELECT count(*) FROM mediaserver.PodcastEpisode pe
+         WHERE pe.podcast_id = p.podcast_id)::INTEGER,
+        NULL
+    FROM mediaserver.Podcast p
+    UNION ALL
+    SELECT 'movie', m.movie_id,
+        (SELECT count(*) FROM mediaserver.MediaItemMetaData mimd
+         WHERE mimd.media_id = m.movie_id)::INTEGER,
+        NULL
+    FROM mediaserver.Movie m
+    UNION ALL
+    SELECT 'tvshow', t.tvshow_id,
+        (SELECT count(*) FROM mediaserver.TVEpisode te
+         WHERE te.tvshow_id = t.tvshow_id)::INTEGER,
+        NULL
+    FROM mediaserver.TVShow t;
+
+-- Rebuilds the summary of one item (removes it if the item is gone).
+-- 'song' stands for the albums the song is on, 'artistalbums' for the
+-- albums with songs by the artist.
+CREATE OR REPLACE FUNCTION mediaserver.refreshItemSummary(
+    _item_type VARCHAR(20),
+    _item_id INTEGER)
+RETURNS void AS
+$$
+BEGIN
+    IF _item_type = 'song' THEN
+        PERFORM mediaserver.refreshItemSummary('album', album_id)
+        FROM mediaserver.Album_Songs WHERE song_id = _item_id;
+        RETURN;
+    END IF;
+    IF _item_type = 'artistalbums' THEN
+        PERFORM mediaserver.refreshItemSummary('album', als.album_id)
+        FROM mediaserver.Song_Artists sa
+            JOIN mediaserver.Album_Songs als ON (sa.song_id = als.song_id)
+        WHERE sa.performing_artist_id = _item_id
+        GROUP BY als.album_id;
+        RETURN;
+    END IF;
+    DELETE FROM mediaserver.ItemSummary
+    WHERE item_type = _item_type AND item_id = _item_id;
+    INSERT INTO mediaserver.ItemSummary(item_type, item_id, item_count, artists)
+    SELECT item_type, item_id, item_count, artists
+    FROM mediaserver.SummarySource
+    WHERE item_type = _item_type AND item_id = _item_id;
+END;
+$$
+LANGUAGE plpgsql;
+
+-- Row trigger: TG_ARGV[0] is the item type, TG_ARGV[1] the item id column
+CREATE OR REPLACE FUNCTION mediaserver.itemSummaryTrigger()
+RETURNS trigger AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM mediaserver.refreshItemSummary(
+            TG_ARGV[0], (to_jsonb(OLD) ->> TG_ARGV[1])::INTEGER);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM mediaserver.refreshItemSummary(
+            TG_ARGV[0], (to_jsonb(NEW) ->> TG_ARGV[1])::INTEGER);
+    END IF;
+    RETURN NULL;
+END;
+$$
+LANGUAGE plpgsql;
+
+-- The items themselves
+DROP TRIGGER IF EXISTS album_summary ON mediaserver.Album;
+CREATE TRIGGER album_summary AFTER INSERT OR UPDATE OF album_id OR DELETE ON mediaserver.Album
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('album', 'album_id');
+DROP TRIGGER IF EXISTS artist_summary ON mediaserver.Artist;
+CREATE TRIGGER artist_summary AFTER INSERT OR UPDATE OF artist_id OR DELETE ON mediaserver.Artist
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('artist', 'artist_id');
+DROP TRIGGER IF EXISTS podcast_summary ON mediaserver.Podcast;
+CREATE TRIGGER podcast_summary AFTER INSERT OR UPDATE OF podcast_id OR DELETE ON mediaserver.Podcast
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('podcast', 'podcast_id');
+DROP TRIGGER IF EXISTS movie_summary ON mediaserver.Movie;
+CREATE TRIGGER movie_summary AFTER INSERT OR UPDATE OF movie_id OR DELETE ON mediaserver.Movie
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('movie', 'movie_id');
+DROP TRIGGER IF EXISTS tvshow_summary ON mediaserver.TVShow;
+CREATE TRIGGER tvshow_summary AFTER INSERT OR UPDATE OF tvshow_id OR DELETE ON mediaserver.TVShow
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('tvshow', 'tvshow_id');
+
+-- What they count
+DROP TRIGGER IF EXISTS album_songs_summary ON mediaserver.Album_Songs;
+CREATE TRIGGER album_songs_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Album_Songs
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('album', 'album_id');
+DROP TRIGGER IF EXISTS song_artists_summary ON mediaserver.Song_Artists;
+CREATE TRIGGER song_artists_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.Song_Artists
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('song', 'song_id');
+DROP TRIGGER IF EXISTS artist_name_summary ON mediaserver.Artist;
+CREATE TRIGGER artist_name_summary AFTER UPDATE OF artist_name ON mediaserver.Artist
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('artistalbums', 'artist_id');
+DROP TRIGGER IF EXISTS artistmetadata_summary ON mediaserver.ArtistMetaData;
+CREATE TRIGGER artistmetadata_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.ArtistMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('artist', 'artist_id');
+DROP TRIGGER IF EXISTS podcastepisode_summary ON mediaserver.PodcastEpisode;
+CREATE TRIGGER podcastepisode_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.PodcastEpisode
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('podcast', 'podcast_id');
+DROP TRIGGER IF EXISTS mediaitemmetadata_summary ON mediaserver.MediaItemMetaData;
+CREATE TRIGGER mediaitemmetadata_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.MediaItemMetaData
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('movie', 'media_id');
+DROP TRIGGER IF EXISTS tvepisode_summary ON mediaserver.TVEpisode;
+CREATE TRIGGER tvepisode_summary AFTER INSERT OR UPDATE OR DELETE ON mediaserver.TVEpisode
+    FOR EACH ROW EXECUTE PROCEDURE mediaserver.itemSummaryTrigger('tvshow', 'tvshow_id');
+
+-- Summaries of the items already in the database
+INSERT INTO mediaserver.ItemSummary(item_type, item_id, item_count, artists)
+SELECT item_type, item_id, item_count, artists
+FROM mediaserver.SummarySource
+ON CONFLICT (item_type, item_id) DO UPDATE
+    SET item_count = excluded.item_count,
+        artists = excluded.artists;
+
+ANALYZE mediaserver.ItemSummary;
@@ -0,0 +1,44 @@
+-- NEW FUNCTIONALITY
+-- Indexes for the movie ratings views (get_movie_ratings): one per filter
+-- and sort order, so every view reads its page straight off an index
+-- instead of sorting every rating. Safe to run more than once, and on a
+-- database already created from mediaserver_schema.sql.
+--
+--     psql -d <database> -f migrations/0005_movie_ratings_indexes.sql
+
+SET search_path TO mediaserver, public;
+
+-- The sort keys are the expressions in RATINGS_SORTS (database.py): missing
+-- ratings count as -1, ties go to the next rating and then the movie id.
+-- Keep the two in step.
+CREATE INDEX IF NOT EXISTS movieratings_imdb_idx ON mediaserver.MovieRatings
+    ((coalesce(imdb_score, -1)) DESC, (coalesce(imdb_votes, -1)) DESC,
+     (coalesce(rt_score, -1)) DESC, movie_id DESC);
+CREATE INDEX IF NOT EXISTS movieratings_rt_idx ON mediaserver.MovieRatings
+    ((coalesce(rt_score, -1)) DESC, (coalesce(imdb_score, -1)) DESC,
+     (coalesce(imdb_votes, -1)) DESC, movie_id DESC);
+
+-- The IMDB 250 and IMDB 100 views only read the index of their list
+-- (movies in both are found through the IMDB 100 one).
+CREATE INDEX IF NOT EXISTS movieratings_top250_idx ON mediaserver.MovieRatings(movie_id)
+    WHERE top250;
+CREATE INDEX IF NOT EXISTS movieratings_top250_imdb_idx ON mediaserver.MovieRatings
+    ((coalesce(imdb_score, -1)) DESC, (coalesce(imdb_votes, -1)) DESC,
+     (coalesce(rt_score, -1)) DESC, movie_id DESC)
+    WHERE top250;
+CREATE INDEX IF NOT EXISTS movieratings_top250_rt_idx ON mediaserver.MovieRatings
+    ((coalesce(rt_score, -1)) DESC, (coalesce(imdb_score, -1)) DESC,
+     (coalesce(imdb_votes, -1)) DESC, movie_id DESC)
+    WHERE top250;
+CREATE INDEX IF NOT EXISTS movieratings_top100_idx ON mediaserver.MovieRatings(movie_id)
+    WHERE top100;
+CREATE INDEX IF NOT EXISTS movieratings_top100_imdb_idx ON mediaserver.MovieRatings
+    ((coalesce(imdb_score, -1)) DESC, (coalesce(imdb_votes, -1)) DESC,
+     (coalesce(rt_score, -1)) DESC, movie_id DESC)
+    WHERE top100;
+CREATE INDEX IF NOT EXISTS movieratings_top100_rt_idx ON mediaserver.MovieRatings
+    ((coalesce(rt_score, -1)) DESC, (coalesce(imdb_score, -1)) DESC,
+     (coalesce(imdb_votes, -1)) DESC, movie_id DESC)
+    WHERE top100;
+
+ANALYZE mediaserver.MovieRatings;
@@ -0,0 +1,51 @@
+-- NEW FUNCTIONALITY
+-- Indexes on the foreign keys and lookup columns the schema left without
+-- one. Each is built with CREATE INDEX CONCURRENTLY, so the tables stay
+-- writable while it builds; that cannot run inside a transaction, so
+-- apply this file with migrate.py (or psql without --single-transaction).
+--
+--     python3 assignment_webapp/migrate.py
+--
+-- Album_Songs(album_id) and TVEpisode(tvshow_id) already have theirs
+-- (migrations 0003 and 0001).
+-- migrate: no-transaction
+
+-- Songs of an artist, and albums with songs by an artist
+CREATE INDEX CONCURRENTLY IF NOT EXISTS song_artists_performing_artist_id_idx
+    ON mediaserver.Song_Artists(performing_artist_id);
+
+-- Items linked to a metadata value (searchMetaDataTrigger), and metadata
+-- of one type
+CREATE INDEX CONCURRENTLY IF NOT EXISTS mediaitemmetadata_md_id_idx
+    ON mediaserver.MediaItemMetaData(md_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS albummetadata_md_id_idx
+    ON mediaserver.AlbumMetaData(md_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS artistmetadata_md_id_idx
+    ON mediaserver.ArtistMetaData(md_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS podcastmetadata_md_id_idx
+    ON mediaserver.PodcastMetaData(md_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tvshowmetadata_md_id_idx
+    ON mediaserver.TVShowMetaData(md_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS metadata_md_type_id_idx
+    ON mediaserver.MetaData(md_type_id);
+
+-- The podcast an episode belongs to
+CREATE INDEX CONCURRENTLY IF NOT EXISTS podcastepisode_media_id_idx
+    ON mediaserver.PodcastEpisode(media_id);
+
+-- A user's playlists, subscriptions and items in progress, and the
+-- playlists and subscribers of an item
+CREATE INDEX CONCURRENTLY IF NOT EXISTS mediacollection_username_idx
+    ON mediaserver.MediaCollection(username);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS mediacollectioncontents_media_id_idx
+    ON mediaserver.MediaCollectionContents(media_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS subscribed_podcasts_podcast_id_idx
+    ON mediaserver.Subscribed_Podcasts(podcast_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS usermediaconsumption_username_progress_idx
+    ON mediaserver.UserMediaConsumption(username, progress);
+
+-- Bands of a member and members of a band
+CREATE INDEX CONCURRENTLY IF NOT EXISTS bandmembership_band_id_idx
+    ON mediaserver.BandMembership(band_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS bandmembership_band_member_id_idx
+    ON mediaserver.BandMembership(band_member_id);
@@ -0,0 +1,50 @@
+-- NEW FUNCTIONALITY
+-- refreshItemSummary (migration 0004) deleted an item's summary row and
+-- inserted it again. Two transactions writing to the same item (two songs
+-- added to one album at once) both found no row after the delete, and the
+-- second insert failed on itemsummary_pkey, failing the catalogue write.
+--
+-- The row is now upserted. Before it is computed, a transaction level lock
+-- on the item makes a second writer wait for the first to commit. Only then
+-- does the next statement see the first writer's rows; computed earlier,
+-- ON CONFLICT would overwrite the first writer's count with a stale one.
+-- The row is deleted only when the item itself is gone. Safe to run more
+-- than once.
+--
+--     python3 assignment_webapp/migrate.py
+
+SET search_path TO mediaserver, public;
+
+CREATE OR REPLACE FUNCTION mediaserver.refreshItemSummary(
+    _item_type VARCHAR(20),
+    _item_id INTEGER)
+RETURNS void AS
+$$
+BEGIN
+    IF _item_type = 'song' THEN
+        PERFORM mediaserver.refreshItemSummary('album', album_id)
+        FROM mediaserver.Album_Songs WHERE song_id = _item_id;
+        RETURN;
+    END IF;
+    IF _item_type = 'artistalbums' THEN
+        PERFORM mediaserver.refreshItemSummary('album', als.album_id)
+        FROM mediaserver.Song_Artists sa
+            JOIN mediaserver.Album_Songs als ON (sa.song_id = als.song_id)
+        WHERE sa.performing_artist_id = _item_id
+        GROUP BY als.album_id;
+        RETURN;
+    END IF;
+    PERFORM pg_advisory_xact_lock(hashtext('ItemSummary ' || _item_type), _item_id);
+    INSERT INTO mediaserver.ItemSummary(item_type, item_id, item_count, artists)
+    SELECT item_type, item_id, item_count, artists
+    FROM mediaserver.SummarySource
+    WHERE item_type = _item_type AND item_id = _item_id
+    ON CONFLICT (item_type, item_id) DO UPDATE
+        SET item_count = EXCLUDED.item_count, artists = EXCLUDED.artists;
+    IF NOT FOUND THEN
+        DELETE FROM mediaserver.ItemSummary
+        WHERE item_type = _item_type AND item_id = _item_id;
+    END IF;
+END;
+$$
+LANGUAGE plpgsql;
@@ -0,0 +1,39 @@
+-- NEW FUNCTIONALITY
+-- refreshSearchDocument (migration 0002) deleted an item's document and
+-- inserted it again, so two transactions changing the same item's
+-- metadata at once collided on searchdocument_pkey and the second write
+-- failed. As with the item summaries (migration 0007) the document is now
+-- upserted after a transaction level lock on the item, which makes the
+-- second writer wait for the first to commit and build the document from
+-- its rows too. The document is deleted only when the item is gone. Safe
+-- to run more than once.
+--
+--     python3 assignment_webapp/migrate.py
+
+SET search_path TO mediaserver, public;
+
+CREATE OR REPLACE FUNCTION mediaserver.refreshSearchDocument(
+    _item_type VARCHAR(20),
+    _item_id INTEGER)
+RETURNS void AS
+$$
+BEGIN
+    IF _item_type = 'media' THEN
+        PERFORM mediaserver.refreshSearchDocument(t, _item_id)
+        FROM unnest(ARRAY['song', 'podcastep', 'movie', 'tvepisode']::VARCHAR(20)[]) AS t;
+        RETURN;
+    END IF;
+    PERFORM pg_advisory_xact_lock(hashtext('SearchDocument ' || _item_type), _item_id);
+    INSERT INTO mediaserver.SearchDocument(item_type, item_id, title, body, document)
+    SELECT item_type, item_id, title, body, mediaserver.searchVector(title, body)
+    FROM mediaserver.SearchSource
+    WHERE item_type = _item_type AND item_id = _item_id
+    ON CONFLICT (item_type, item_id) DO UPDATE
+        SET title = EXCLUDED.title, body = EXCLUDED.body, document = EXCLUDED.document;
+    IF NOT FOUND THEN
+        DELETE FROM mediaserver.SearchDocument
+        WHERE item_type = _item_type AND item_id = _item_id;
+    END IF;
+END;
+$$
+LANGUAGE plpgsql;